@@ -0,0 +1,196 @@
+# Copyright 2022 aaaaaaaalesha
+
+"""
+Generates synthetic corpus of documents and images for benchmarks.
+Usage: python3 -m benchmarks.corpus OUT_DIR [--scale SCALE]
+"""
+
+import argparse
+import json
+import os
+import random
+import zipfile
+from typing import List, NamedTuple
+
+import numpy
+from PIL import Image
+
+_WORDS = 'alpha beta gamma delta report secret data money plan & < >'.split()
+_W_NAMESPACE = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+_S_NAMESPACE = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+_CORE_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\r\n'
+    '<cp:coreProperties xmlns:cp="http://schemas.openxmlformats.org/package/2006/metadata/core-properties" '
+    'xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:dcterms="http://purl.org/dc/terms/" '
+    'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">'
+    '<dc:creator>Benchmark</dc:creator>'
+    '<dcterms:created xsi:type="dcterms:W3CDTF">2022-01-01T00:00:00Z</dcterms:created>'
+    '<dcterms:modified xsi:type="dcterms:W3CDTF">2022-01-02T00:00:00Z</dcterms:modified>'
+    '</cp:coreProperties>'
+)
+
+
+class CorpusItem(NamedTuple):
+    """
+    Description of generated file: name and parameters of its generator.
+    """
+    name: str
+    params: dict
+
+
+# Default corpus, counts are multiplied by scale.
+DEFAULT_CORPUS = (
+    CorpusItem('small.docx', {'paragraphs': 200, 'headers': 1, 'footers': 1}),
+    CorpusItem('medium.docx', {'paragraphs': 5_000, 'headers': 2, 'footers': 2}),
+    CorpusItem('large.docx', {'paragraphs': 50_000, 'headers': 3, 'footers': 3}),
+    CorpusItem('small.xlsx', {'rows': 500, 'sheets': 1}),
+    CorpusItem('large.xlsx', {'rows': 20_000, 'sheets': 3}),
+    CorpusItem('small.png', {'width': 256, 'height': 256}),
+    CorpusItem('medium.bmp', {'width': 640, 'height': 480}),
+    CorpusItem('large.jpg', {'width': 3000, 'height': 2000}),
+)
+
+
+def make_docx(path: str, paragraphs: int, headers=0, footers=0, seed=0) -> None:
+    """
+    Generates .docx with paragraphs of random words, headers and footers.
+    :param path: path of generated document
+    :param paragraphs: number of paragraphs in body
+    :param headers: number of header parts
+    :param footers: number of footer parts
+    :param seed: random seed
+    :return: None
+    """
+    rnd = random.Random(seed)
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zip_out:
+        zip_out.writestr('docProps/core.xml', _CORE_XML)
+        with zip_out.open('word/document.xml', 'w') as part:
+            part.write(f'<?xml version="1.0" encoding="UTF-8"?><w:document xmlns:w="{_W_NAMESPACE}"><w:body>'.encode())
+            for _ in range(paragraphs):
+                part.write(_paragraph(rnd).encode())
+            part.write(b'</w:body></w:document>')
+
+        for kind, count in (('hdr', headers), ('ftr', footers)):
+            part_name = 'header' if kind == 'hdr' else 'footer'
+            for i in range(1, count + 1):
+                zip_out.writestr(f'word/{part_name}{i}.xml',
+                                 f'<?xml version="1.0" encoding="UTF-8"?><w:{kind} xmlns:w="{_W_NAMESPACE}">'
+                                 f'{_paragraph(rnd)}</w:{kind}>')
+
+
+def make_xlsx(path: str, rows: int, sheets=3, seed=0) -> None:
+    """
+    Generates .xlsx with sheets of random numeric and string cells.
+    :param path: path of generated document
+    :param rows: number of rows in each sheet
+    :param sheets: number of sheets
+    :param seed: random seed
+    :return: None
+    """
+    rnd = random.Random(seed)
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zip_out:
+        zip_out.writestr('docProps/core.xml', _CORE_XML)
+        for sheet in range(1, sheets + 1):
+            with zip_out.open(f'xl/worksheets/sheet{sheet}.xml', 'w') as part:
+                part.write(f'<?xml version="1.0" encoding="UTF-8"?>'
+                           f'<worksheet xmlns="{_S_NAMESPACE}"><sheetData>'.encode())
+                for row in range(1, rows + 1):
+                    cells = (f'<c r="A{row}" t="s"><v>{rnd.randint(0, 999)}</v></c>'
+                             f'<c r="B{row}"><v>{rnd.random()}</v></c>'
+                             f'<c r="C{row}" t="inlineStr"><is><t>{rnd.choice(_WORDS[:-3])}</t></is></c>')
+                    part.write(f'<row r="{row}" spans="1:3">{cells}</row>'.encode())
+                part.write(b'</sheetData></worksheet>')
+
+
+def make_image(path: str, width: int, height: int, seed=0) -> None:
+    """
+    Generates image of smooth color gradients with noise, format is chosen by extension.
+    :param path: path of generated image
+    :param width: image width
+    :param height: image height
+    :param seed: random seed
+    :return: None
+    """
+    rnd = numpy.random.default_rng(seed)
+    y, x = numpy.mgrid[0:height, 0:width]
+    channels = []
+    for _ in range(3):
+        fx, fy, phase = rnd.uniform(1, 6, size=3)
+        channel = 127 + 100 * numpy.sin(2 * numpy.pi * (fx * x / width + fy * y / height) + phase)
+        channels.append(channel + rnd.normal(0, 12, size=channel.shape))
+
+    pixels = numpy.clip(numpy.stack(channels, axis=-1), 0, 255).astype(numpy.uint8)
+    Image.fromarray(pixels, 'RGB').save(path)
+
+
+def make_file(path: str, params: dict, seed=0) -> None:
+    """
+    Generates file of type given by its extension.
+    :param path: path of generated file
+    :param params: parameters of generator
+    :param seed: random seed
+    :return: None
+    """
+    extension = os.path.splitext(path)[1]
+    if extension == '.docx':
+        make_docx(path, seed=seed, **params)
+    elif extension == '.xlsx':
+        make_xlsx(path, seed=seed, **params)
+    else:
+        make_image(path, seed=seed, **params)
+
+
+def make_corpus(out_dir: str, corpus=DEFAULT_CORPUS, scale=1.0, seed=0) -> List[str]:
+    """
+    Generates files of corpus, counts of paragraphs, rows and pixels are multiplied by scale.
+    :param out_dir: destination folder
+    :param corpus: descriptions of files
+    :param scale: size multiplier
+    :param seed: random seed
+    :return: paths of generated files
+    """
+    os.makedirs(out_dir, exist_ok=True)
+
+    paths = []
+    for item in corpus:
+        path = os.path.join(out_dir, item.name)
+        make_file(path, scaled(item.params, scale), seed)
+        paths.append(path)
+
+    return paths
+
+
+def scaled(params: dict, scale: float) -> dict:
+    """
+    Multiplies sizes in generator parameters by scale: counts linearly, image sides by square root.
+    """
+    result = {}
+    for name, value in params.items():
+        if name in ('paragraphs', 'rows'):
+            value = max(1, round(value * scale))
+        elif name in ('width', 'height'):
+            value = max(16, round(value * scale ** 0.5))
+        result[name] = value
+
+    return result
+
+
+def _paragraph(rnd: random.Random) -> str:
+    text = ' '.join(rnd.choice(_WORDS) for _ in range(12))
+    text = text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+    return f'<w:p><w:r><w:t>{text}</w:t></w:r><w:r><w:t xml:space="preserve"> </w:t></w:r></w:p>'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generates synthetic corpus of documents and images.')
+    parser.add_argument('out_dir', help='Destination folder.')
+    parser.add_argument('--scale', type=float, default=1.0, help='Size multiplier (default: 1).')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed (default: 0).')
+    args = parser.parse_args()
+
+    paths = make_corpus(args.out_dir, scale=args.scale, seed=args.seed)
+    print(json.dumps({os.path.basename(path): os.path.getsize(path) for path in paths}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+# Copyright 2022 aaaaaaaalesha
+
+"""
+Compares BeautifulSoup and streaming lxml extractors of document content, which fuzzy hash is computed of.
+Each extractor runs in a separate process, so peak memory usage is measured independently.
+Usage: python3 -m benchmarks.extractor [document.docx|document.xlsx ...]
+Without arguments synthetic documents are generated in a temporary directory.
+"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+import src.extractor as extractor
+import src.ssdeep as ssdeep
+import src.utils as utils
+from benchmarks.corpus import make_docx, make_xlsx
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def bs4_hash(path: str) -> str:
+    """
+    Computes fuzzy hash the old way: document is extracted and each part is parsed by BeautifulSoup.
+    """
+    hasher = ssdeep.FuzzyHasher()
+    tempdir = tempfile.mkdtemp()
+    try:
+        with zipfile.ZipFile(path, 'r') as zip_ref:
+            zip_ref.extractall(tempdir)
+
+        if path.endswith('.docx'):
+            files = [file for file in sorted(utils.get_files_list(os.path.join(tempdir, 'word')))
+                     if os.path.basename(file) == 'document.xml'
+                     or os.path.basename(file).startswith(('footer', 'header'))]
+            pieces = (piece for file in files for piece in utils.iter_xml_tags(file, 'w:t'))
+        else:
+            files = sorted(utils.get_files_list(os.path.join(tempdir, 'xl', 'worksheets')))
+            pieces = (piece for file in files for piece in utils.iter_xml_tags(file, 'sheetData', attrs=True))
+
+        for piece in pieces:
+            hasher.update(piece.encode('utf-8'))
+    finally:
+        shutil.rmtree(tempdir)
+
+    return hasher.digest()
+
+
+def lxml_hash(path: str) -> str:
+    """
+    Computes fuzzy hash streaming document parts with lxml iterparse.
+    """
+    hasher = ssdeep.FuzzyHasher()
+    with zipfile.ZipFile(path, 'r') as zip_ref:
+        for piece in extractor.iter_document_content(zip_ref, os.path.splitext(path)[1]):
+            hasher.update(piece.encode('utf-8'))
+
+    return hasher.digest()
+
+
+def _measure(method: str, path: str) -> dict:
+    started = time.perf_counter()
+    fuzzy_hash = {'bs4': bs4_hash, 'lxml': lxml_hash}[method](path)
+    elapsed = time.perf_counter() - started
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    peak = None
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+    return {'method': method, 'seconds': round(elapsed, 3), 'peak_rss_mb': peak and round(peak / 2 ** 20, 1),
+            'fuzzy_hash': fuzzy_hash}
+
+
+def run(paths: list) -> list:
+    """
+    Measures both extractors on each document in fresh processes.
+    :param paths: paths to .docx/.xlsx documents
+    :return: list of results
+    """
+    results = []
+    for path in paths:
+        measured = {}
+        for method in ('bs4', 'lxml'):
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                measured[method] = executor.submit(_measure, method, path).result()
+
+        results.append({
+            'file': os.path.basename(path),
+            'size_mb': round(os.path.getsize(path) / 2 ** 20, 2),
+            'same_hash': measured['bs4']['fuzzy_hash'] == measured['lxml']['fuzzy_hash'],
+            'results': list(measured.values()),
+        })
+
+    return results
+
+
+def main():
+    paths = sys.argv[1:]
+    tempdir = None
+    if not paths:
+        tempdir = tempfile.mkdtemp()
+        paths = [os.path.join(tempdir, 'large.docx'), os.path.join(tempdir, 'large.xlsx')]
+        make_docx(paths[0], paragraphs=100_000)
+        make_xlsx(paths[1], rows=100_000)
+
+    try:
+        print(json.dumps(run(paths), indent=2))
+    finally:
+        if tempdir is not None:
+            shutil.rmtree(tempdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+# Copyright 2022 aaaaaaaalesha
+
+"""
+Times cold start of CLI invocations processing a single file, like ones made by agents calling it per file.
+Each scenario runs `python -m src.main ...` in a fresh interpreter; interpreter startup alone is measured too.
+Besides wall time, import time and heavy packages loaded by each scenario are reported: a scenario loading
+a package it must not need (e.g. PIL on comparison of documents) makes the exit status 1.
+Usage: python3 -m benchmarks.startup [--repeat N] [--out results.json] [--baseline baseline.json] [--threshold 0.25]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from benchmarks.corpus import make_file
+from benchmarks.suite import environment
+from src.identifier.injector import IdentifierInjector
+
+DEFAULT_REPEAT = 10
+DEFAULT_THRESHOLD = 0.25
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Third-party and standard packages worth noticing in startup, reported when loaded.
+HEAVY_MODULES = ('PIL', 'imagehash', 'numpy', 'scipy', 'pywt', 'bs4', 'lxml', 'pyarrow', 'prettytable',
+                 'sqlite3', 'asyncio', 'concurrent')
+IMAGING_MODULES = ('PIL', 'imagehash', 'numpy', 'scipy', 'pywt')
+
+# Runs CLI with passed arguments and writes names of loaded top-level packages to file at exit.
+_PROBE = '''
+import atexit, json, runpy, sys
+out = sys.argv.pop(1)
+def dump():
+    with open(out, 'w') as file:
+        json.dump(sorted({name.split('.')[0] for name in sys.modules}), file)
+atexit.register(dump)
+sys.argv[0] = 'main'
+runpy.run_module('src.main', run_name='__main__', alter_sys=True)
+'''
+
+
+class Scenario(NamedTuple):
+    """
+    CLI invocation: arguments and packages it must not load.
+    """
+    name: str
+    args: Tuple[str, ...]
+    forbidden: Tuple[str, ...] = ()
+
+
+def scenarios(work_dir: str) -> List[Scenario]:
+    """
+    Generates small marked files and describes invocations of CLI on them.
+    :param work_dir: folder for generated files
+    :return: list of scenarios
+    """
+    source_dir, marked_dir = os.path.join(work_dir, 'source'), os.path.join(work_dir, 'marked')
+    os.makedirs(source_dir)
+
+    marked = {}
+    for name, params, seeds in (('doc.docx', {'paragraphs': 50}, (0, 1)),
+                                ('image.png', {'width': 64, 'height': 64}, (0, 1))):
+        for seed in seeds:
+            path = os.path.join(source_dir, f'{seed}_{name}')
+            make_file(path, params, seed=seed)
+            marked.setdefault(name, []).append(IdentifierInjector(path).inject_identifier(marked_dir))
+
+    out_dir = os.path.join(work_dir, 'out')
+    return [
+        Scenario('help', ('-h',)),
+        Scenario('compare_documents', ('-c', *marked['doc.docx']), IMAGING_MODULES + ('bs4',)),
+        Scenario('compare_images', ('-c', *marked['image.png']), ('bs4', 'lxml')),
+        # Spamsum backend hashes with NumPy when libfuzzy is not available.
+        Scenario('inject_document', ('-i', os.path.join(source_dir, '0_doc.docx'), '-o', out_dir),
+                 ('PIL', 'imagehash', 'scipy', 'pywt', 'bs4')),
+        Scenario('inject_image', ('-i', os.path.join(source_dir, '0_image.png'), '-o', out_dir), ('bs4', 'lxml')),
+    ]
+
+
+def measure(command: List[str], repeat: int) -> Dict[str, float]:
+    """
+    Runs command in fresh interpreters repeat times after a warm-up run, which fills OS caches.
+    :param command: command line
+    :param repeat: number of runs
+    :return: wall time statistics in seconds
+    """
+    timings = []
+    for i in range(repeat + 1):
+        started = time.perf_counter()
+        subprocess.run(command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        if i:
+            timings.append(time.perf_counter() - started)
+
+    return {
+        'min': round(min(timings), 6),
+        'median': round(statistics.median(timings), 6),
+        'mean': round(statistics.mean(timings), 6),
+    }
+
+
+def probe(args: Tuple[str, ...], work_dir: str) -> Tuple[List[str], float]:
+    """
+    Runs CLI once with -X importtime.
+    :param args: CLI arguments
+    :param work_dir: folder for temporary files
+    :return: loaded heavy packages and total import time in seconds
+    """
+    modules_path = os.path.join(work_dir, 'modules.json')
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', _PROBE, modules_path, *args], cwd=ROOT,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True)
+
+    with open(modules_path, encoding='utf-8') as file:
+        loaded = set(json.load(file))
+
+    return [name for name in HEAVY_MODULES if name in loaded], _import_seconds(completed.stderr)
+
+
+def run(repeat: int) -> dict:
+    """
+    Measures interpreter startup and all scenarios.
+    :param repeat: number of runs of each scenario
+    :return: dict of scenario name -> timings, import time, loaded and unexpectedly loaded heavy packages
+    """
+    results = {'python': measure([sys.executable, '-c', 'pass'], repeat)}
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        for scenario in scenarios(work_dir):
+            loaded, import_seconds = probe(scenario.args, work_dir)
+            results[scenario.name] = {
+                **measure([sys.executable, '-m', 'src.main', *scenario.args], repeat),
+                'import_seconds': round(import_seconds, 6),
+                'heavy_modules': loaded,
+                'unexpected_modules': [name for name in loaded if name in scenario.forbidden],
+            }
+    finally:
+        shutil.rmtree(work_dir)
+
+    return results
+
+
+def regressions(results: dict, baseline: dict, threshold: float) -> List[dict]:
+    """
+    Finds scenarios which median wall time grew by more than threshold since baseline.
+    :param results: current results
+    :param baseline: previous results
+    :param threshold: allowed relative slowdown, e.g. 0.25
+    :return: list of regressions
+    """
+    found = []
+    for name, timings in results.items():
+        before: Optional[dict] = baseline.get(name)
+        if before is None:
+            continue
+
+        slowdown = timings['median'] / before['median'] - 1
+        if slowdown > threshold:
+            found.append({'scenario': name, 'baseline': before['median'], 'median': timings['median'],
+                          'slowdown': round(slowdown, 3)})
+
+    return found
+
+
+def _import_seconds(importtime_log: str) -> float:
+    """
+    Sums cumulative import time of top-level imports from -X importtime output.
+    """
+    total = 0
+    for line in importtime_log.splitlines():
+        if not line.startswith('import time:'):
+            continue
+
+        _, cumulative, name = line.split('|')
+        if cumulative.strip().isdigit() and not name.startswith('  '):
+            total += int(cumulative)
+
+    return total / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Times cold start of single file CLI invocations.')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT,
+                        help=f'Number of runs of each scenario (default: {DEFAULT_REPEAT}).')
+    parser.add_argument('--out', help='Write results to passed .json file instead of stdout.')
+    parser.add_argument('--baseline', help='Previous results to check for regressions.')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help=f'Allowed relative slowdown of scenario median (default: {DEFAULT_THRESHOLD}).')
+    args = parser.parse_args()
+
+    report = {'environment': environment(), 'repeat': args.repeat, 'results': run(args.repeat)}
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as file:
+            report['regressions'] = regressions(report['results'], json.load(file)['results'], args.threshold)
+
+    output = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as file:
+            file.write(output)
+    else:
+        print(output)
+
+    failed = False
+    for name, result in report['results'].items():
+        if result.get('unexpected_modules'):
+            failed = True
+            print(f"{name}: unexpectedly loaded {', '.join(result['unexpected_modules'])}", file=sys.stderr)
+
+    for regression in report.get('regressions', ()):
+        failed = True
+        print(f"{regression['scenario']}: startup is {regression['slowdown']:.0%} slower "
+              f"({regression['baseline']} s -> {regression['median']} s)", file=sys.stderr)
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,295 @@
+# Copyright 2022 aaaaaaaalesha
+
+"""
+Times each stage of injection and comparison on synthetic corpus (see benchmarks.corpus) or passed files.
+Document stages: inflating content parts, XML parsing, ssdeep and MinHash hashing, core.xml rewriting, re-zipping,
+whole injection and comparison. Image stages: hashing, whole injection and comparison.
+Results are printed as JSON. With --baseline, medians are compared with the previous results and
+the exit status is 1 if any stage became slower by more than --threshold.
+Usage: python3 -m benchmarks.suite [files ...] [--scale SCALE] [--repeat N] [--out results.json]
+                                   [--baseline baseline.json] [--threshold 0.25]
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import zipfile
+from typing import Callable, Dict, List
+
+import src.constants as const
+import src.extractor as extractor
+import src.imaging as imaging
+import src.ssdeep as ssdeep
+import src.utils as utils
+from src.minhash import MinHasher
+from benchmarks.corpus import make_corpus, make_file, scaled, DEFAULT_CORPUS
+from src.identifier.checker import ComparisonSession
+from src.identifier.injector import IdentifierInjector
+from src.identifier.properties import CoreProperties
+
+DEFAULT_REPEAT = 5
+DEFAULT_THRESHOLD = 0.25
+# Stages faster than this are not checked for regressions, their timings are mostly noise.
+MIN_CHECKED_SECONDS = 0.001
+
+
+def document_stages(path: str, work_dir: str, other: str) -> Dict[str, Callable[[], object]]:
+    """
+    Prepares timed stages of document processing, each stage takes output of the previous one computed in advance.
+    :param path: path to .docx/.xlsx document
+    :param work_dir: folder for files written by stages
+    :param other: another marked document the injected one is compared with
+    :return: dict of stage name -> function running it
+    """
+    extension = os.path.splitext(path)[1]
+    tag_name, attrs = extractor.CONTENT_TAGS[extension]
+
+    def extract() -> Dict[str, bytes]:
+        with zipfile.ZipFile(path) as zip_ref:
+            return {name: zip_ref.read(name) for name in extractor.content_parts(zip_ref, extension)}
+
+    def parse(parts=extract()) -> List[str]:
+        pieces = []
+        for data in parts.values():
+            pieces.extend(extractor.iter_xml_content(io.BytesIO(data), tag_name, attrs))
+        return pieces
+
+    def fuzzy_hash(pieces=parse()) -> str:
+        hasher = ssdeep.FuzzyHasher()
+        for piece in pieces:
+            hasher.update(piece.encode('utf-8'))
+        return hasher.digest()
+
+    def min_hash(pieces=parse()) -> str:
+        hasher = MinHasher(markup=attrs)
+        for piece in pieces:
+            hasher.update(piece)
+        return hasher.hexdigest()
+
+    with zipfile.ZipFile(path) as zip_ref:
+        core_xml = zip_ref.read(const.CORE)
+
+    def rewrite_core(digest=fuzzy_hash()) -> bytes:
+        core = CoreProperties(core_xml)
+        core.keywords = digest
+        core.description = utils.encode_base64_id(f'{os.path.basename(path)} {digest}')
+        return core.serialize()
+
+    new_core = rewrite_core()
+    rezipped = os.path.join(work_dir, 'rezipped' + extension)
+
+    def rezip() -> None:
+        utils.rewrite_zip(path, rezipped, {const.CORE: lambda _: new_core})
+
+    inject_dir = os.path.join(work_dir, 'injected')
+
+    def inject() -> str:
+        return IdentifierInjector(path).inject_identifier(inject_dir)
+
+    injected = inject()
+
+    def compare() -> str:
+        with ComparisonSession(injected) as session:
+            return session.compare(other)
+
+    return {
+        'extract': extract,
+        'parse': parse,
+        'hash': fuzzy_hash,
+        'minhash': min_hash,
+        'rewrite_core': rewrite_core,
+        'rezip': rezip,
+        'inject': inject,
+        'compare': compare,
+    }
+
+
+def image_stages(path: str, work_dir: str, other: str) -> Dict[str, Callable[[], object]]:
+    """
+    Prepares timed stages of image processing.
+    :param path: path to image
+    :param work_dir: folder for files written by stages
+    :param other: another marked image the injected one is compared with
+    :return: dict of stage name -> function running it
+    """
+    inject_dir = os.path.join(work_dir, 'injected')
+
+    def inject() -> str:
+        return IdentifierInjector(path).inject_identifier(inject_dir)
+
+    injected = inject()
+
+    def compare() -> str:
+        with ComparisonSession(injected) as session:
+            return session.compare(other)
+
+    return {
+        'hash': lambda: imaging.hash_image(path),
+        'inject': inject,
+        'compare': compare,
+    }
+
+
+def measure(stages: Dict[str, Callable[[], object]], repeat: int, size: int) -> Dict[str, dict]:
+    """
+    Runs each stage repeat times after a warm-up run.
+    :param stages: dict of stage name -> function running it
+    :param repeat: number of runs
+    :param size: size of processed file in bytes
+    :return: dict of stage name -> timings in seconds and throughput
+    """
+    results = {}
+    for name, stage in stages.items():
+        stage()
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            stage()
+            timings.append(time.perf_counter() - started)
+
+        median = statistics.median(timings)
+        results[name] = {
+            'min': round(min(timings), 6),
+            'median': round(median, 6),
+            'mean': round(statistics.mean(timings), 6),
+            'mb_per_s': round(size / 2 ** 20 / median, 2) if median else None,
+        }
+
+    return results
+
+
+def run(paths: List[str], repeat: int, others: Dict[str, str]) -> List[dict]:
+    """
+    Measures stages on each file.
+    :param paths: paths to documents and images
+    :param repeat: number of runs of each stage
+    :param others: dict of path -> marked file it is compared with
+    :return: list of results
+    """
+    results = []
+    for path in paths:
+        work_dir = tempfile.mkdtemp()
+        try:
+            extension = os.path.splitext(path)[1]
+            make_stages = document_stages if extension in const.DOC_EXTENSIONS else image_stages
+            size = os.path.getsize(path)
+            results.append({
+                'file': os.path.basename(path),
+                'size_bytes': size,
+                'stages': measure(make_stages(path, work_dir, others[path]), repeat, size),
+            })
+        finally:
+            shutil.rmtree(work_dir)
+
+    return results
+
+
+def regressions(results: List[dict], baseline: List[dict], threshold: float) -> List[dict]:
+    """
+    Finds stages which median time grew by more than threshold since baseline.
+    :param results: current results
+    :param baseline: previous results
+    :param threshold: allowed relative slowdown, e.g. 0.25
+    :return: list of regressions
+    """
+    previous = {(item['file'], stage): timings['median']
+                for item in baseline for stage, timings in item['stages'].items()}
+
+    found = []
+    for item in results:
+        for stage, timings in item['stages'].items():
+            before = previous.get((item['file'], stage))
+            if before is None or max(before, timings['median']) < MIN_CHECKED_SECONDS:
+                continue
+
+            slowdown = timings['median'] / before - 1
+            if slowdown > threshold:
+                found.append({'file': item['file'], 'stage': stage, 'baseline': before,
+                              'median': timings['median'], 'slowdown': round(slowdown, 3)})
+
+    return found
+
+
+def environment() -> dict:
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'ssdeep_backend': ssdeep.get_backend(),
+    }
+
+
+def _mark_others(paths: List[str], work_dir: str, scale: float) -> Dict[str, str]:
+    """
+    Generates and marks files each passed one is compared with: variant of the same corpus item
+    generated with another seed, or the file itself if it isn't from corpus.
+    """
+    params = {item.name: item.params for item in DEFAULT_CORPUS}
+    source_dir, marked_dir = os.path.join(work_dir, 'source'), os.path.join(work_dir, 'marked')
+    os.makedirs(source_dir)
+
+    others = {}
+    for path in paths:
+        name = os.path.basename(path)
+        source = path
+        if name in params:
+            source = os.path.join(source_dir, name)
+            make_file(source, scaled(params[name], scale), seed=1)
+        others[path] = IdentifierInjector(source).inject_identifier(marked_dir)
+
+    return others
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Times stages of injection and comparison.')
+    parser.add_argument('files', nargs='*', help='Documents and images, synthetic corpus is generated if none.')
+    parser.add_argument('--scale', type=float, default=1.0, help='Size multiplier of synthetic corpus (default: 1).')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT,
+                        help=f'Number of runs of each stage (default: {DEFAULT_REPEAT}).')
+    parser.add_argument('--out', help='Write results to passed .json file instead of stdout.')
+    parser.add_argument('--baseline', help='Previous results to check for regressions.')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help=f'Allowed relative slowdown of stage median (default: {DEFAULT_THRESHOLD}).')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        paths = args.files or make_corpus(os.path.join(work_dir, 'corpus'), scale=args.scale)
+        others = _mark_others(paths, work_dir, args.scale)
+        report = {
+            'environment': environment(),
+            'scale': args.scale if not args.files else None,
+            'repeat': args.repeat,
+            'results': run(paths, args.repeat, others),
+        }
+    finally:
+        shutil.rmtree(work_dir)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as file:
+            report['regressions'] = regressions(report['results'], json.load(file)['results'], args.threshold)
+
+    output = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as file:
+            file.write(output)
+    else:
+        print(output)
+
+    for regression in report.get('regressions', ()):
+        print(f"{regression['file']}: stage {regression['stage']} is {regression['slowdown']:.0%} slower "
+              f"({regression['baseline']} s -> {regression['median']} s)", file=sys.stderr)
+
+    if report.get('regressions'):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,44 +4,182 @@ import sys
 import os.path
 
 import argparse
-from typing import Callable
+from typing import TYPE_CHECKING, Iterator, Optional, Sequence
 
-from src.identifier import injector, checker
+import src.metrics as metrics
 from src.constants import VALID_EXTENSIONS
 
+# CLI is invoked per file, so each command imports only modules it needs: e.g. comparison of documents
+# never loads imaging libraries and injection never loads asyncio.
+if TYPE_CHECKING:
+    from src.identifier.checker import ComparisonSession
 
-def injection(out_dir: str, path_to_file: str, to_file=None) -> None:
-    id_ = injector.IdentifierInjector(path_to_file)
-    id_.inject_identifier(out_dir)
-    print(f"Identifier was injected successfully in file {os.path.basename(path_to_file)} "
-          f"and moved in out directory {os.path.abspath(out_dir)}")
 
+def batch_injection(out_dir: str, paths: Iterator[str], jobs: int, index_path: Optional[str] = None,
+                    cache_path: Optional[str] = None, roots: Sequence[str] = ()) -> None:
+    from src.identifier import batch
 
-def compare(lhs: str, rhs: str, to_file=None) -> None:
-    print(checker.identity_check(lhs, rhs, to_file))
+    fingerprints = None
+    if index_path is not None:
+        from src.identifier import index
 
+        fingerprints = index.FingerprintIndex(index_path)
 
-def recursive_handler(target_dir: str, func: Callable, first_arg, to_file=None) -> None:
-    for dirpath, dirs, files in os.walk(target_dir):
-        for file in files:
-            path_to_file = os.path.join(target_dir, dirpath, file)
-            extension = os.path.splitext(path_to_file)[1]
-            if extension in VALID_EXTENSIONS:
-                try:
-                    func(first_arg, path_to_file, to_file)
-                except Exception as err:
-                    print(err)
+    failed = cached = 0
+    try:
+        # Documents content is fingerprinted for index while it's hashed, so it isn't read again.
+        for result in batch.inject_many(paths, out_dir, jobs, cache_path, roots,
+                                        with_fingerprints=fingerprints is not None):
+            if result.ok:
+                cached += result.cached
+                print(f"Identifier was injected successfully in file {os.path.basename(result.path)} "
+                      f"and moved in out directory {os.path.dirname(os.path.abspath(result.out_path))}")
+                if fingerprints is not None:
+                    fingerprints.add(result.out_path, result.fingerprints)
+            else:
+                failed += 1
+                print(f"Identifier was not injected in file {result.path}: {result.error}")
+    finally:
+        if fingerprints is not None:
+            fingerprints.close()
+
+    if cache_path is not None:
+        print(f"Fields of {cached} unchanged file(s) were taken from cache")
+
+    if failed:
+        print(f"Failed to inject identifier in {failed} file(s)")
+
+
+def batch_indexing(index_path: str, paths: Iterator[str]) -> None:
+    from src.identifier import index
+
+    indexed = failed = 0
+    for result in index.build_index(index_path, paths):
+        if result.ok:
+            indexed += 1
+        else:
+            failed += 1
+            print(f"File {result.path} was not added to fingerprint index: {result.error}")
+
+    print(f"{indexed} file(s) were added to fingerprint index {index_path}")
+    if failed:
+        print(f"Failed to index {failed} file(s)")
+
+
+def watch_injection(out_dir: str, roots: list, recursive: bool, jobs: int, index_path: Optional[str] = None,
+                    cache_path: Optional[str] = None) -> None:
+    from src.identifier import watch
+
+    for root in roots:
+        if not os.path.isdir(root):
+            raise NotADirectoryError(f"Watched path {root} should be a directory")
+
+    fingerprints = None
+    if index_path is not None:
+        from src.identifier import index
+
+        fingerprints = index.FingerprintIndex(index_path)
+    try:
+        with watch.DirectoryWatcher(roots, out_dir, recursive, jobs, cache_path,
+                                    with_fingerprints=fingerprints is not None) as watcher:
+            print(f"Watching {', '.join(roots)} ({watcher.backend}), press Ctrl+C to stop")
+            for result in watcher.results():
+                if result.ok:
+                    print(f"Identifier was injected successfully in file {os.path.basename(result.path)} "
+                          f"and moved in out directory {os.path.abspath(out_dir)}")
+                    if fingerprints is not None:
+                        fingerprints.add(result.out_path, result.fingerprints)
+                else:
+                    print(f"Identifier was not injected in file {result.path}: {result.error}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if fingerprints is not None:
+            fingerprints.close()
 
 
-def straight_handler(target_dir: str, func: Callable, first_arg, to_file=None) -> None:
+def serve(socket_path: str, jobs: int, index_path: Optional[str] = None, cache_path: Optional[str] = None) -> None:
+    from src.identifier import service
+
+    checker_service = service.CheckerService(socket_path, jobs, index_path, cache_path)
+    print(f"Serving on {socket_path} with {jobs} worker(s), press Ctrl+C to stop")
+    checker_service.run()
+
+
+def lookup(index_path: str, path_to_file: str, top_k: int) -> str:
+    from prettytable import PrettyTable
+    from src.identifier import index
+
+    table = PrettyTable(field_names=('#', 'Indexed File', 'Score'))
+    with index.FingerprintIndex(index_path) as fingerprints:
+        for rank, match in enumerate(fingerprints.query(path_to_file, top_k), start=1):
+            table.add_row([rank, match.path, f'{match.score:g} %'])
+
+    return str(table)
+
+
+def excerpt_search(index_path: str, path_to_file: str, top_k: int) -> str:
+    from prettytable import PrettyTable
+    from src.identifier import index
+
+    table = PrettyTable(field_names=('#', 'Indexed File', 'Shared fingerprints', 'Coverage'))
+    with index.FingerprintIndex(index_path) as fingerprints:
+        for rank, match in enumerate(fingerprints.search_excerpt(path_to_file, top_k), start=1):
+            table.add_row([rank, match.path, match.shared, f'{match.coverage:.0%}'])
+
+    return str(table)
+
+
+def iter_files(target_dir: str, recursive: bool) -> Iterator[str]:
+    """
+    Collects paths of files with valid extensions in target_dir.
+    :param target_dir: path to directory
+    :param recursive: if True collects files in subdirectories too
+    :return: iterator over files' paths
+    """
+    if recursive:
+        for dirpath, dirs, files in os.walk(target_dir):
+            for file in files:
+                if os.path.splitext(file)[1] in VALID_EXTENSIONS:
+                    yield os.path.join(dirpath, file)
+        return
+
     for file in os.listdir(target_dir):
         path_to_file = os.path.join(target_dir, file)
-        extension = os.path.splitext(path_to_file)[1]
-        if not os.path.isdir(path_to_file) and extension in VALID_EXTENSIONS:
-            try:
-                func(first_arg, path_to_file, to_file)
-            except Exception as err:
-                print(err)
+        if not os.path.isdir(path_to_file) and os.path.splitext(file)[1] in VALID_EXTENSIONS:
+            yield path_to_file
+
+
+def iter_inject_paths(paths: list, recursive: bool) -> Iterator[str]:
+    """
+    Collects paths of files for injection from passed files and directories.
+    :param paths: paths to files or directories
+    :param recursive: if True collects files in subdirectories too
+    :return: iterator over files' paths
+    """
+    for path in paths:
+        if not os.path.exists(path):
+            print(f"Path {path} does not exist")
+            continue
+
+        if not os.path.isdir(path):
+            yield path
+            continue
+
+        yield from iter_files(path, recursive)
+
+
+def compare_directory(session: 'ComparisonSession', target_dir: str, recursive: bool, jobs: int = 1) -> None:
+    import asyncio
+
+    asyncio.run(_print_comparisons(session, iter_files(target_dir, recursive), jobs))
+
+
+async def _print_comparisons(session: 'ComparisonSession', paths: Iterator[str], jobs: int) -> None:
+    from src.identifier import pipeline
+
+    async for result in pipeline.compare_paths(session, paths, jobs):
+        print(result.table if result.ok else result.error)
 
 
 def launch():
@@ -53,48 +191,130 @@ def launch():
                         help='Destination folder for saving injected document(s).')
     parser.add_argument('-r', '--recursive', action='store_true',
                         help='Collects file for injection in folder recursively.')
+    parser.add_argument('-w', '--watch', action='store_true',
+                        help='Keep watching passed folder(s) and inject identifier in new and modified documents.')
     parser.add_argument('-c', '--compare', type=str, nargs='+',
                         help='Compare first file with the next passed file(s) by their identifiers.')
     parser.add_argument('-wr', '--write_results', type=str, nargs=1,
-                        help='Writing compare results to passed .csv file.')
+                        help='Writing compare results to passed .csv, .jsonl or .parquet file.')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Number of worker processes for injection or concurrent parsing workers '
+                             'for comparison with directories (default: 1).')
+    parser.add_argument('-db', '--index_db', type=str, nargs=1,
+                        help='Fingerprint index database. Injected documents are added to it.')
+    parser.add_argument('-cc', '--cache', type=str, nargs=1,
+                        help='Fingerprint cache database. Unchanged files are not hashed again on injection.')
+    parser.add_argument('-ix', '--index', type=str, nargs='+',
+                        help='Add already marked file(s) to fingerprint index passed by -db (--index_db).')
+    parser.add_argument('-l', '--lookup', type=str, nargs=1,
+                        help='Find indexed marked files most similar to passed file.')
+    parser.add_argument('-e', '--excerpt', type=str, nargs=1,
+                        help='Find indexed marked documents containing text of passed file, e.g. a few pages of '
+                             'document pasted into email (document, .txt or .html file).')
+    parser.add_argument('-s', '--serve', type=str, nargs=1,
+                        help='Run checker service on passed Unix socket: inject, compare and lookup requests '
+                             'are handled by -j (--jobs) worker threads with warm state.')
+    parser.add_argument('-k', '--top_k', type=int, default=10,
+                        help='Number of files found by lookup or excerpt search (default: 10).')
+    parser.add_argument('-m', '--metrics', type=str, nargs=1,
+                        help='Measure stages of injection and comparison and write summary to passed .json file '
+                             'or metrics in Prometheus text format to any other file.')
+    parser.add_argument('--profile', type=str, nargs=1,
+                        help='Profile the run: cProfile statistics of the main thread are written to .prof file, '
+                             'sampled stacks of all threads in collapsed format – to any other file.')
 
     args = parser.parse_args()
 
+    if args.metrics:
+        metrics.enable()
+
+    try:
+        if args.profile:
+            import src.profiling as profiling
+
+            with profiling.profile(args.profile[0]):
+                dispatch(parser, args)
+        else:
+            dispatch(parser, args)
+    finally:
+        if args.metrics:
+            metrics.registry().write(args.metrics[0])
+
+
+def dispatch(parser: argparse.ArgumentParser, args: argparse.Namespace) -> None:
     try:
+        # -s, --serve
+        if args.serve:
+            if args.jobs < 1:
+                parser.error("Named argument -j (--jobs) should be positive")
+
+            # -j, --jobs; -db, --index_db; -cc, --cache
+            serve(args.serve[0], args.jobs, args.index_db[0] if args.index_db else None,
+                  args.cache[0] if args.cache else None)
+            print("Service stopped")
+
         # -i, --inject
-        if args.inject:
+        elif args.inject:
             if not args.output:
                 parser.error("Named argument -o (--output) required")
                 sys.exit(1)
 
-            print("Processing...")
-            for path in args.inject:
-                if not os.path.exists(path):
-                    print(f"Path {path} does not exist")
-                    continue
+            if args.jobs < 1:
+                parser.error("Named argument -j (--jobs) should be positive")
+
+            # -r, --recursive; -j, --jobs; -db, --index_db; -cc, --cache
+            index_path = args.index_db[0] if args.index_db else None
+            cache_path = args.cache[0] if args.cache else None
+
+            # -w, --watch
+            if args.watch:
+                watch_injection(*args.output, args.inject, args.recursive, args.jobs, index_path, cache_path)
+                print("Watching stopped")
+            else:
+                print("Processing...")
+                # Files found in passed folders keep their relative folders under the output one.
+                roots = [path for path in args.inject if os.path.isdir(path)]
+                batch_injection(*args.output, iter_inject_paths(args.inject, args.recursive), args.jobs, index_path,
+                                cache_path, roots)
+
+                print("Injection completed")
+
+        # -ix, --index
+        elif args.index:
+            if not args.index_db:
+                parser.error("Named argument -db (--index_db) required")
+
+            batch_indexing(args.index_db[0], iter_inject_paths(args.index, args.recursive))
 
-                if not os.path.isdir(path):
-                    injection(*args.output, path)
-                    continue
+        # -l, --lookup
+        elif args.lookup:
+            if not args.index_db:
+                parser.error("Named argument -db (--index_db) required")
 
-                # -r, --recursive
-                if args.recursive:
-                    recursive_handler(path, injection, *args.output)
-                    continue
+            print(lookup(args.index_db[0], args.lookup[0], args.top_k))
 
-                straight_handler(path, injection, *args.output)
+        # -e, --excerpt
+        elif args.excerpt:
+            if not args.index_db:
+                parser.error("Named argument -db (--index_db) required")
 
-            print("Injection completed")
+            print(excerpt_search(args.index_db[0], args.excerpt[0], args.top_k))
 
         # -c, --compare
         elif args.compare is not None:
+            from src.identifier import checker
+            from src.identifier.results import RESULTS_EXTENSIONS
+
+            if args.jobs < 1:
+                parser.error("Named argument -j (--jobs) should be positive")
+
             to_file = None
             if args.write_results:
                 to_file = args.write_results[0]
                 ext = os.path.splitext(to_file)[1]
 
-                if not ext == '.csv':
-                    print(f"File {to_file} should have .csv extension")
+                if ext not in RESULTS_EXTENSIONS:
+                    print(f"File {to_file} should have {', '.join(RESULTS_EXTENSIONS)} extension")
                     exit(1)
 
             # First argument is always target file.
@@ -107,24 +327,27 @@ def launch():
                 print(f"{lhs} should be a target file, not directory")
                 exit(1)
 
-            for rhs in args.compare[1:]:
-                if not os.path.exists(rhs):
-                    print(f"Path {rhs} does not exist")
-                    continue
+            # Target identifier is parsed only once for all compared files.
+            with checker.ComparisonSession(lhs, to_file) as session:
+                for rhs in args.compare[1:]:
+                    if not os.path.exists(rhs):
+                        print(f"Path {rhs} does not exist")
+                        continue
+
+                    if not os.path.isdir(rhs):
+                        try:
+                            print(session.compare(rhs))
+                        except Exception as err:
+                            print(err)
 
-                if not os.path.isdir(rhs):
+                        continue
+
+                    # -r, --recursive; -j, --jobs
                     try:
-                        print(checker.identity_check(lhs, rhs, to_file))
+                        compare_directory(session, rhs, args.recursive, args.jobs)
                     except Exception as err:
                         print(err)
 
-                # -r, --recursive
-                if args.recursive:
-                    recursive_handler(rhs, compare, lhs, to_file)
-                    continue
-
-                straight_handler(rhs, compare, lhs, to_file)
-
         else:
             parser.print_help()
 
@@ -5,6 +5,11 @@ IMG_EXTENSIONS = ('.jpg', '.png', '.bmp')
 VALID_EXTENSIONS = (*DOC_EXTENSIONS, *IMG_EXTENSIONS)
 
 CORE = 'docProps/core.xml'
+CORE_NAMESPACES = {
+    'cp': 'http://schemas.openxmlformats.org/package/2006/metadata/core-properties',
+    'dc': 'http://purl.org/dc/elements/1.1/',
+    'dcterms': 'http://purl.org/dc/terms/',
+}
 
 DOC_CREATOR_TAG = 'dc:creator'
 DOC_DT_CREATED = 'dcterms:created'
@@ -13,6 +18,21 @@ DOC_CORE_PROPERTIES = 'cp:coreProperties'
 DOC_CP_KEYWORDS = 'cp:keywords'
 DOC_DC_DESCRIPTION = 'dc:description'
 
+# User-defined properties of document, MinHash signature of content is kept in a property of its own.
+CUSTOM = 'docProps/custom.xml'
+CUSTOM_NAMESPACE = 'http://schemas.openxmlformats.org/officeDocument/2006/custom-properties'
+VT_NAMESPACE = 'http://schemas.openxmlformats.org/officeDocument/2006/docPropsVTypes'
+CUSTOM_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.custom-properties+xml'
+CUSTOM_RELATIONSHIP = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/custom-properties'
+# Format identifier Office applications use for all user-defined properties.
+CUSTOM_FMTID = '{D5CDD505-2E9C-101B-9397-08002B2CF9AE}'
+DOC_MINHASH_PROPERTY = 'FuzzyDocmarkingContentMinHash'
+
+CONTENT_TYPES = '[Content_Types].xml'
+CONTENT_TYPES_NAMESPACE = 'http://schemas.openxmlformats.org/package/2006/content-types'
+PACKAGE_RELATIONSHIPS = '_rels/.rels'
+RELATIONSHIPS_NAMESPACE = 'http://schemas.openxmlformats.org/package/2006/relationships'
+
 # Compare section.
 FILE_NAME = 'Filename'
 
@@ -22,6 +42,7 @@ CREATION_TIME = 'Creation time'
 MODIFIED_TIME = 'Last modified time'
 FUZZY_HASH = 'Fuzzy hash'
 IS_HASH_INTEGRITY = 'Hash integrity'
+CONTENT_MINHASH = 'Content MinHash'
 
 DOC_FIELDS = (
     FILE_NAME,
@@ -31,6 +52,7 @@ DOC_FIELDS = (
     MODIFIED_TIME,
     FUZZY_HASH,
     IS_HASH_INTEGRITY,
+    CONTENT_MINHASH,
 )
 
 FROM_FILE = 'Generated from file'
@@ -50,3 +72,6 @@ IMG_FIELDS = (
 MATCH = '[v]'
 MISMATCH = '[ ]'
 NOT_FOUND = 'information_not_found'
+
+# Column of estimated Jaccard similarity of documents content in compare results.
+CONTENT_SIMILARITY = 'Content similarity'
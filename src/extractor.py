@@ -0,0 +1,336 @@
+# Copyright 2022 aaaaaaaalesha
+
+import zipfile
+from typing import BinaryIO, Dict, Iterator, List, Optional
+
+from lxml import etree
+
+XML_NAMESPACE = 'http://www.w3.org/XML/1998/namespace'
+XML_SPACE = f'{{{XML_NAMESPACE}}}space'
+
+# Tag whose content is taken from document parts and whether attributes are kept, by document extension.
+CONTENT_TAGS = {
+    '.docx': ('w:t', False),
+    '.xlsx': ('sheetData', True),
+}
+
+# Whitespace-only strings made of these characters are collapsed by BeautifulSoup.
+_ASCII_SPACES = '\x20\x0a\x09\x0c\x0d'
+
+
+def iter_document_content(zip_ref: zipfile.ZipFile, extension: str) -> Iterator[str]:
+    """
+    Yields all valuable content of .docx/.xlsx document, which fuzzy hash is computed of.
+    Parts are read straight from the archive members without extracting them.
+    :param zip_ref: opened document archive
+    :param extension: document extension, '.docx' or '.xlsx'
+    :return: iterator over document content
+    """
+    tag_name, attrs = CONTENT_TAGS[extension]
+    for name in content_parts(zip_ref, extension):
+        with zip_ref.open(name) as stream:
+            yield from iter_xml_content(stream, tag_name, attrs)
+
+
+def content_parts(zip_ref: zipfile.ZipFile, extension: str) -> List[str]:
+    """
+    Collects names of document parts with valuable content in the order they are hashed:
+    body, headers and footers of .docx, worksheets of .xlsx.
+    :param zip_ref: opened document archive
+    :param extension: document extension, '.docx' or '.xlsx'
+    :return: list of members' names
+    """
+    if extension == '.docx':
+        names = []
+        for name in sorted(_members_of(zip_ref, 'word/')):
+            basename = name.rsplit('/', 1)[-1]
+            if basename == 'document.xml' or basename.startswith(('footer', 'header')):
+                names.append(name)
+        return names
+
+    # if '.xlsx'
+    return sorted(_members_of(zip_ref, 'xl/worksheets/'))
+
+
+def _members_of(zip_ref: zipfile.ZipFile, folder: str) -> List[str]:
+    """
+    Collects names of archive members lying right in the folder, not in its subfolders.
+    :param zip_ref: opened archive
+    :param folder: folder path inside archive ending with '/'
+    :return: list of members' names
+    """
+    return [
+        name for name in zip_ref.namelist()
+        if name.startswith(folder) and '/' not in name[len(folder):] and name != folder
+    ]
+
+
+def iter_xml_content(stream: BinaryIO, tag_name: str, attrs=False) -> Iterator[str]:
+    """
+    Parses xml incrementally and yields content of found tags the same way as utils.iter_xml_tags does with
+    BeautifulSoup: tags are matched by name or by prefixed name, strings are collapsed and serialized alike.
+    Parsed elements are cleared as soon as they are processed, so memory usage doesn't depend on xml size.
+    :param stream: binary file-like object with xml
+    :param tag_name: name of tags we are searching for
+    :param attrs: if True yields full tag piece by piece, otherwise – only string content inside
+    :return: iterator over tags content
+    """
+    namespaces = _NamespaceScope()
+    declared = {}
+    # BeautifulSoup prefixes and start tags of elements inside the matched tag.
+    prefixes = {}
+    start_tags = {}
+    nested = []
+    match = None
+    emitted = False
+
+    events = etree.iterparse(stream, events=('start-ns', 'start', 'end'), recover=True, huge_tree=True)
+    for event, item in events:
+        if event == 'start-ns':
+            declared[item[0] or None] = item[1]
+            continue
+
+        element = item
+        if event == 'start':
+            namespaces.push(declared)
+            namespace, name = _split_tag(element.tag)
+            prefix = namespaces.prefix_for(namespace)
+
+            matched = _is_matched(name, prefix, tag_name)
+            if match is None and matched:
+                match = element
+                emitted = False
+
+            if match is not None:
+                if not attrs:
+                    prefixes[element] = prefix
+                else:
+                    start_tags[element] = (*_start_tag(element, name, prefix, declared, namespaces), matched)
+                    if element.getparent() is match:
+                        yield from _flush(match, element, start_tags, nested, emitted)
+                        emitted = True
+
+            declared = {}
+            continue
+
+        namespaces.pop()
+        if element is not match:
+            if match is None:
+                _clear(element)
+            continue
+
+        if attrs:
+            yield from _flush(match, None, start_tags, nested, emitted)
+            # Matched tags inside the matched one are yielded after it, like find_all does.
+            yield from nested
+            nested.clear()
+        else:
+            for tag in match.iter(tag=etree.Element):
+                _, name = _split_tag(tag.tag)
+                if _is_matched(name, prefixes[tag], tag_name):
+                    string = _string_of(tag)
+                    if string is not None:
+                        yield ' ' if tag.get(XML_SPACE) is not None else string
+
+        prefixes.clear()
+        start_tags.clear()
+        match = None
+        _clear(element)
+
+
+class _NamespaceScope:
+    """
+    Mirrors namespace prefixes resolution of BeautifulSoup lxml tree builder.
+    """
+
+    def __init__(self):
+        self.__maps: List[Optional[Dict[str, Optional[str]]]] = [{XML_NAMESPACE: 'xml'}]
+
+    def push(self, declared: Dict[Optional[str], str]) -> None:
+        if declared:
+            self.__maps.append({namespace: prefix for prefix, namespace in declared.items()})
+        elif len(self.__maps) > 1:
+            self.__maps.append(None)
+
+    def pop(self) -> None:
+        if len(self.__maps) > 1:
+            self.__maps.pop()
+
+    def prefix_for(self, namespace: Optional[str]) -> Optional[str]:
+        if namespace is None:
+            return None
+
+        for inverted in reversed(self.__maps):
+            if inverted is not None and namespace in inverted:
+                return inverted[namespace]
+
+        return None
+
+
+def _split_tag(tag: str) -> tuple:
+    if tag[0] == '{':
+        namespace, name = tag[1:].split('}', 1)
+        return namespace, name
+
+    return None, tag
+
+
+def _is_matched(name: str, prefix: Optional[str], tag_name: str) -> bool:
+    return name == tag_name or bool(prefix) and f'{prefix}:{name}' == tag_name
+
+
+def _qualified(name: str, prefix: Optional[str]) -> str:
+    return f'{prefix}:{name}' if prefix else name
+
+
+def _start_tag(element, name: str, prefix: Optional[str], declared: dict, namespaces: _NamespaceScope) -> tuple:
+    """
+    Renders qualified name and attributes of element like BeautifulSoup does.
+    :return: qualified name and attributes string
+    """
+    attributes = {}
+    for key, value in element.attrib.items():
+        namespace, attribute = _split_tag(key)
+        attributes[_qualified(attribute, namespaces.prefix_for(namespace))] = value
+
+    for namespace_prefix, namespace in declared.items():
+        attributes[_qualified(namespace_prefix, 'xmlns') if namespace_prefix else 'xmlns'] = namespace
+
+    attributes_string = ''.join(
+        f' {key}={_quoted_attribute(_escape(value))}' for key, value in sorted(attributes.items())
+    )
+
+    return _qualified(name, prefix), attributes_string
+
+
+def _flush(match, until, start_tags: dict, nested: list, emitted: bool) -> Iterator[str]:
+    """
+    Serializes already parsed children of matched element and removes them.
+    :param match: matched element
+    :param until: child, which parsing has just started, None if the matched element is complete
+    :param start_tags: rendered start tags of elements inside matched one
+    :param nested: list for collecting serialized matched tags inside matched one
+    :param emitted: whether the start tag of matched element is already yielded
+    :return: iterator over serialized pieces
+    """
+    name, attributes_string, _ = start_tags[match]
+
+    if not emitted:
+        if until is None and not match.text and not len(match):
+            yield f'<{name}{attributes_string}/>'
+            return
+
+        yield f'<{name}{attributes_string}>'
+        if match.text:
+            yield _escape(_collapse(match.text))
+
+    while len(match) and match[0] is not until:
+        child = match[0]
+        pieces = []
+        _serialize(child, start_tags, pieces, nested)
+        yield ''.join(pieces)
+        del match[0]
+
+    if until is None:
+        yield f'</{name}>'
+
+
+def _serialize(node, start_tags: dict, out: list, nested: list) -> None:
+    """
+    Serializes complete node with its tail like str() of BeautifulSoup tag does.
+    :param node: element, comment or processing instruction
+    :param start_tags: rendered start tags of elements
+    :param out: list for collecting serialized pieces
+    :param nested: list for collecting serialized matched tags
+    """
+    if node.tag is etree.Comment:
+        out.append(f'<!--{_collapse(node.text or "")}-->')
+    elif node.tag is etree.PI:
+        out.append(f'<?{_pi_string(node)}?>')
+    else:
+        name, attributes_string, matched = start_tags.pop(node)
+        start = len(out)
+        if matched:
+            # Reserving place keeps matched tags in order of their start.
+            position = len(nested)
+            nested.append(None)
+
+        if not node.text and not len(node):
+            out.append(f'<{name}{attributes_string}/>')
+        else:
+            out.append(f'<{name}{attributes_string}>')
+            if node.text:
+                out.append(_escape(_collapse(node.text)))
+            for child in node:
+                _serialize(child, start_tags, out, nested)
+            out.append(f'</{name}>')
+
+        if matched:
+            nested[position] = ''.join(out[start:])
+
+    if node.tail:
+        out.append(_escape(_collapse(node.tail)))
+
+
+def _string_of(element) -> Optional[str]:
+    """
+    Returns the only string inside complete element like BeautifulSoup Tag.string does.
+    """
+    contents = []
+    if element.text:
+        contents.append(element.text)
+    for child in element:
+        contents.append(child)
+        if child.tail:
+            contents.append(child.tail)
+
+    if len(contents) != 1:
+        return None
+
+    child = contents[0]
+    if isinstance(child, str):
+        return _collapse(child)
+    if child.tag is etree.Comment:
+        return _collapse(child.text or '')
+    if child.tag is etree.PI:
+        return _pi_string(child)
+
+    return _string_of(child)
+
+
+def _pi_string(node) -> str:
+    return f'{node.target} {node.text or ""}'
+
+
+def _collapse(text: str) -> str:
+    """
+    Replaces whitespace-only string with single newline or space like BeautifulSoup does.
+    """
+    if text.strip(_ASCII_SPACES):
+        return text
+
+    return '\n' if '\n' in text else ' '
+
+
+def _escape(text: str) -> str:
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+def _quoted_attribute(value: str) -> str:
+    if '"' not in value:
+        return f'"{value}"'
+    if "'" not in value:
+        return f"'{value}'"
+
+    return '"{}"'.format(value.replace('"', '&quot;'))
+
+
+def _clear(element) -> None:
+    """
+    Frees processed element and its already processed preceding siblings.
+    """
+    element.clear(keep_tail=True)
+    parent = element.getparent()
+    if parent is not None:
+        while element.getprevious() is not None:
+            del parent[0]
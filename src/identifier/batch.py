@@ -0,0 +1,179 @@
+# Copyright 2022 aaaaaaaalesha
+
+import os
+from collections import deque
+from typing import Dict, Iterable, Iterator, NamedTuple, Optional, Sequence, Set, Tuple
+
+import src.metrics as metrics
+
+from src.identifier.cache import FingerprintCache
+from src.identifier.injector import IdentifierInjector
+
+# Fingerprint cache opened in each worker process by pool initializer.
+_worker_cache: Optional[FingerprintCache] = None
+
+
+class InjectionResult(NamedTuple):
+    """
+    Result of identifier injection in a single file.
+    """
+    path: str
+    out_path: Optional[str] = None
+    error: Optional[str] = None
+    cached: bool = False
+    # Winnowing fingerprints of document content, if they were requested and content was read.
+    fingerprints: Optional[Set[int]] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def inject_file(path: str, out_dir: str, cache: Optional[FingerprintCache] = None,
+                with_fingerprints: bool = False) -> InjectionResult:
+    """
+    Injects identifier in file, catching any failure into result.
+    :param path: path to file
+    :param out_dir: destination folder for injected file
+    :param cache: fingerprint cache, worker's one if None
+    :param with_fingerprints: if True, winnowing fingerprints of document content are selected in the same pass
+    :return: injection result
+    """
+    if cache is None:
+        cache = _worker_cache
+
+    try:
+        with metrics.span('inject.total'):
+            injector = IdentifierInjector(path, cache, with_fingerprints)
+            out_path = injector.inject_identifier(out_dir)
+    except Exception as err:
+        return InjectionResult(path, error=f'{type(err).__name__}: {err}')
+
+    return InjectionResult(path, out_path, cached=injector.cached, fingerprints=injector.fingerprints)
+
+
+def inject_many(paths: Iterable[str], out_dir: str, jobs: int = 1, cache_path: Optional[str] = None,
+                roots: Sequence[str] = (), with_fingerprints: bool = False) -> Iterator[InjectionResult]:
+    """
+    Injects identifiers in files, fanning work out to a pool of jobs worker processes.
+    Results are yielded in the order of passed paths, only a bounded window of files is in flight at once.
+    Files found in one of roots keep their folder relative to it under out_dir, e.g. root/a/report.docx and
+    root/b/report.docx are written to out_dir/a and out_dir/b. File which would overwrite the output of another
+    file of the same batch fails instead.
+    :param paths: paths to files
+    :param out_dir: destination folder for injected files
+    :param jobs: number of worker processes, 1 – inject in current process
+    :param cache_path: path to fingerprint cache database, files aren't cached if None
+    :param roots: folders paths were collected from
+    :param with_fingerprints: if True, winnowing fingerprints of documents content are selected in the same pass
+    :return: iterator over injection results
+    """
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+
+    destinations = _Destinations(out_dir, roots)
+    if jobs <= 1:
+        cache = FingerprintCache(cache_path) if cache_path is not None else None
+        try:
+            for path in paths:
+                out_folder, duplicate = destinations.claim(path)
+                yield duplicate or inject_file(path, out_folder, cache, with_fingerprints)
+        finally:
+            if cache is not None:
+                cache.close()
+        return
+
+    # Single file injections shouldn't pay for importing multiprocessing machinery.
+    from concurrent.futures import Future, ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker,
+                             initargs=(cache_path, metrics.enabled())) as executor:
+        pending = deque()
+        for path in paths:
+            out_folder, duplicate = destinations.claim(path)
+            if duplicate is not None:
+                # Failure keeps its place among results.
+                future = Future()
+                future.set_result((duplicate, None))
+                pending.append(future)
+            else:
+                pending.append(executor.submit(_inject_in_worker, path, out_folder, with_fingerprints))
+            # Keep every worker busy, but don't submit the whole share at once.
+            if len(pending) >= jobs * 4:
+                yield _merged(pending.popleft().result())
+
+        while pending:
+            yield _merged(pending.popleft().result())
+
+
+def init_worker(cache_path: Optional[str], instrumented: bool = False) -> None:
+    """
+    Initializer of worker processes: opens fingerprint cache used by inject_file and enables instrumentation.
+    :param cache_path: path to fingerprint cache database, files aren't cached if None
+    :param instrumented: if True, stages are measured like in the main process
+    :return: None
+    """
+    global _worker_cache
+    if cache_path is not None:
+        _worker_cache = FingerprintCache(cache_path)
+
+    if instrumented:
+        metrics.enable()
+
+
+class _Destinations:
+    """
+    Maps files to output folders and remembers which file claimed each output file name.
+    """
+
+    def __init__(self, out_dir: str, roots: Sequence[str]):
+        # The deepest root wins if roots are nested.
+        self.__roots = sorted((os.path.abspath(root) for root in roots), key=len, reverse=True)
+        self.__out_dir = out_dir
+        # Output path -> path of file which claimed it.
+        self.__claimed: Dict[str, str] = {}
+
+    def claim(self, path: str) -> Tuple[str, Optional[InjectionResult]]:
+        """
+        Finds output folder of file and claims its output name. File may claim its own name again.
+        :param path: path to file
+        :return: output folder and failed result if the name is already claimed by another file, None otherwise
+        """
+        out_folder, out_path = self.__locate(path)
+        owner = self.__claimed.setdefault(out_path, os.path.abspath(path))
+        if owner != os.path.abspath(path):
+            return out_folder, InjectionResult(path, error=f'Output file {out_path} is already written by another '
+                                                           f'file of this batch')
+
+        return out_folder, None
+
+    def release(self, path: str) -> None:
+        """
+        Frees output name claimed by file, e.g. when it is removed from watched directory.
+        :param path: path to file
+        :return: None
+        """
+        _, out_path = self.__locate(path)
+        if self.__claimed.get(out_path) == os.path.abspath(path):
+            del self.__claimed[out_path]
+
+    def __locate(self, path: str) -> Tuple[str, str]:
+        folder = os.path.dirname(os.path.abspath(path))
+        out_folder = self.__out_dir
+        for root in self.__roots:
+            if folder == root or folder.startswith(root + os.sep):
+                out_folder = os.path.normpath(os.path.join(self.__out_dir, os.path.relpath(folder, root)))
+                break
+
+        return out_folder, os.path.normcase(os.path.abspath(os.path.join(out_folder, os.path.basename(path))))
+
+
+def _inject_in_worker(path: str, out_dir: str, with_fingerprints: bool) -> Tuple[InjectionResult, Optional[dict]]:
+    return inject_file(path, out_dir, with_fingerprints=with_fingerprints), metrics.collect()
+
+
+def _merged(item: Tuple[InjectionResult, Optional[dict]]) -> InjectionResult:
+    # Metrics measured in worker process are added to the main process ones.
+    result, snapshot = item
+    metrics.merge(snapshot)
+    return result
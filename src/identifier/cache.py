@@ -0,0 +1,199 @@
+# Copyright 2022 aaaaaaaalesha
+
+import json
+import os
+from typing import NamedTuple, Optional
+
+from src.utils import get_file_digests
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+# Estimated bytes of entry besides its text columns: numbers, keys of indexes and page overhead.
+ROW_OVERHEAD = 64
+# Content digest used to recognize moved or touched, but unchanged files.
+DIGEST_ALGORITHM = 'blake2b'
+
+# Estimated size of entry in bytes.
+_ENTRY_SIZE = f'length(path) + length(digest) + length(fields) + {ROW_OVERHEAD}'
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS entries (
+    path TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime_ns INTEGER,
+    digest TEXT,
+    fields TEXT,
+    accessed INTEGER
+);
+CREATE INDEX IF NOT EXISTS entries_digest ON entries (digest);
+CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed);
+'''
+
+
+class CacheStats(NamedTuple):
+    """
+    Statistics of fingerprint cache usage.
+    """
+    hits: int = 0
+    digest_hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+
+class FingerprintCache:
+    """
+    Class implements persistent cache of fields collected from files: fuzzy hash and core fields of documents,
+    perceptual hashes of images. Entry is valid while file keeps its size and modification time.
+    Otherwise, content digest of file is looked up, so moved or touched files are not processed again.
+    Least recently used entries are evicted when estimated size of entries exceeds max_bytes.
+    """
+
+    def __init__(self, path: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        """
+        :param path: path to cache database
+        :param max_bytes: maximal estimated size of cached entries: their paths, digests and fields plus ROW_OVERHEAD
+        """
+        import sqlite3
+
+        # Several worker processes may use the same cache.
+        self.__connection = sqlite3.connect(path, timeout=60)
+        self.__connection.execute('PRAGMA journal_mode=WAL')
+        self.__connection.execute('PRAGMA synchronous=NORMAL')
+        self.__connection.executescript(_SCHEMA)
+
+        self.__max_bytes = max_bytes
+        self.__clock = self.__connection.execute('SELECT COALESCE(MAX(accessed), 0) FROM entries').fetchone()[0]
+        self.__stats = CacheStats()
+        # Upper bound of entries size, it's recounted only when it exceeds max_bytes.
+        self.__size = self.__total_size()
+        # Stat and digest of the last looked up file, they are reused when its fields are put.
+        self.__looked_up = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self) -> int:
+        return self.__connection.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    @property
+    def stats(self) -> CacheStats:
+        return self.__stats
+
+    def close(self) -> None:
+        self.__connection.close()
+
+    def get(self, path: str) -> Optional[dict]:
+        """
+        Returns cached fields of file if it hasn't changed since they were put.
+        :param path: path to file
+        :return: fields dict or None
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        self.__looked_up = (path, stat.st_size, stat.st_mtime_ns, None)
+
+        row = self.__connection.execute(
+            'SELECT fields FROM entries WHERE path = ? AND size = ? AND mtime_ns = ?',
+            (path, stat.st_size, stat.st_mtime_ns),
+        ).fetchone()
+        if row is not None:
+            self.__touch(path)
+            self.__stats = self.__stats._replace(hits=self.__stats.hits + 1)
+            return json.loads(row[0])
+
+        digest = get_file_digests(path, (DIGEST_ALGORITHM,))[DIGEST_ALGORITHM]
+        self.__looked_up = (path, stat.st_size, stat.st_mtime_ns, digest)
+
+        row = self.__connection.execute(
+            'SELECT fields FROM entries WHERE digest = ? AND size = ? LIMIT 1', (digest, stat.st_size)
+        ).fetchone()
+        if row is not None:
+            self.__put(path, stat.st_size, stat.st_mtime_ns, digest, row[0])
+            self.__stats = self.__stats._replace(digest_hits=self.__stats.digest_hits + 1)
+            return json.loads(row[0])
+
+        self.__stats = self.__stats._replace(misses=self.__stats.misses + 1)
+        return None
+
+    def is_fresh(self, path: str) -> bool:
+        """
+        Checks that fields of file are cached and file keeps its size and modification time.
+        Unlike get, content digest isn't computed and entry isn't touched.
+        :param path: path to file
+        :return: True if cached entry of file is valid, False – otherwise
+        """
+        path = os.path.abspath(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+
+        return self.__connection.execute(
+            'SELECT 1 FROM entries WHERE path = ? AND size = ? AND mtime_ns = ?', (path, stat.st_size, stat.st_mtime_ns)
+        ).fetchone() is not None
+
+    def put(self, path: str, fields: dict) -> None:
+        """
+        Stores fields collected from file.
+        :param path: path to file
+        :param fields: JSON-serializable fields dict
+        :return: None
+        """
+        path = os.path.abspath(path)
+        if self.__looked_up is not None and self.__looked_up[0] == path:
+            _, size, mtime_ns, digest = self.__looked_up
+        else:
+            stat = os.stat(path)
+            size, mtime_ns, digest = stat.st_size, stat.st_mtime_ns, None
+
+        if digest is None:
+            digest = get_file_digests(path, (DIGEST_ALGORITHM,))[DIGEST_ALGORITHM]
+
+        self.__put(path, size, mtime_ns, digest, json.dumps(fields, ensure_ascii=False))
+        self.__looked_up = None
+
+    def __put(self, path: str, size: int, mtime_ns: int, digest: str, fields: str) -> None:
+        self.__clock += 1
+        with self.__connection:
+            self.__connection.execute(
+                'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)',
+                (path, size, mtime_ns, digest, fields, self.__clock),
+            )
+        self.__size += len(path) + len(digest) + len(fields) + ROW_OVERHEAD
+        self.__evict()
+
+    def __touch(self, path: str) -> None:
+        self.__clock += 1
+        with self.__connection:
+            self.__connection.execute('UPDATE entries SET accessed = ? WHERE path = ?', (self.__clock, path))
+
+    def __total_size(self) -> int:
+        return self.__connection.execute(f'SELECT COALESCE(SUM({_ENTRY_SIZE}), 0) FROM entries').fetchone()[0]
+
+    def __evict(self) -> None:
+        """
+        Removes least recently used entries, so that their estimated size is at most 90% of max_bytes.
+        """
+        if self.__size <= self.__max_bytes:
+            return
+
+        # Other processes may have evicted entries already.
+        self.__size = self.__total_size()
+        if self.__size <= self.__max_bytes:
+            return
+
+        with self.__connection:
+            evicted = self.__connection.execute(
+                f'''
+                DELETE FROM entries WHERE path IN (
+                    SELECT path FROM (
+                        SELECT path, SUM({_ENTRY_SIZE}) OVER (ORDER BY accessed DESC, path) AS kept FROM entries
+                    ) WHERE kept > ?
+                )
+                ''',
+                (self.__max_bytes * 9 // 10,),
+            ).rowcount
+        self.__size = self.__total_size()
+        self.__stats = self.__stats._replace(evictions=self.__stats.evictions + evicted)
@@ -1,23 +1,121 @@
 # Copyright 2022 aaaaaaaalesha
 
 import os
-import zipfile
+from typing import Iterable, Iterator, NamedTuple, Optional
 
-import imagehash
-from bs4 import BeautifulSoup
 from prettytable import PrettyTable
 
 import src.constants as const
-from src.utils import decode_base64_id
+import src.metrics as metrics
+from src.utils import decode_base64_id, get_file_sha3
 from src.ssdeep import compare as ssdeep_cmp
+from src.minhash import compare as minhash_cmp, is_signature
 from src.identifier.injector import InvalidExtensionException
-from src.identifier.results import write_compare_results
+from src.identifier.properties import read_identifier
+from src.identifier.results import ResultsSink, write_compare_results
 
 
 class NoIdentifierException(Exception):
     pass
 
 
+class CompareResult(NamedTuple):
+    """
+    Result of comparing target file with a single candidate.
+    """
+    path: str
+    table: Optional[str] = None
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+class ComparisonSession:
+    """
+    Class implements comparison of target file with many candidates.
+    Target identifier is parsed and its SHA3-hash for results file is computed only once,
+    so comparison cost depends only on candidate. Results are written through one buffered sink,
+    so session should be closed after use.
+    """
+
+    def __init__(self, target: str, to_file=None):
+        """
+        :param target: target file path
+        :param to_file: if not None, compare results will be written in passed file
+        """
+        self.__target = target
+        self.__fields = parse_file_identifier(target)
+        self.__sha3_hash = None
+        if to_file is not None:
+            with metrics.span('compare.sha3'):
+                self.__sha3_hash = get_file_sha3(target)
+        self.__sink = ResultsSink(to_file) if to_file is not None else None
+
+    @property
+    def target(self) -> str:
+        return self.__target
+
+    def parse(self, candidate: str) -> dict:
+        """
+        Parses identifier of candidate comparable with target.
+        Doesn't touch session state, so it's safe to call from several threads.
+        :param candidate: candidate file path
+        :return: fields dict
+        """
+        check_comparable(self.__target, candidate)
+
+        return parse_file_identifier(candidate)
+
+    def score(self, fields: dict) -> str:
+        """
+        Builds string with table of matching target and already parsed candidate identifiers.
+        :param fields: parsed identifier of candidate
+        :return: resulted sting table
+        """
+        if self.__sink is not None:
+            with metrics.span('compare.write_results'):
+                self.__sink.write((self.__fields, fields), self.__target, self.__sha3_hash)
+
+        return identity_table(self.__target, self.__fields, fields)
+
+    def compare(self, candidate: str) -> str:
+        """
+        Builds string with table of matching target and candidate identifiers data.
+        :param candidate: candidate file path
+        :return: resulted sting table
+        """
+        with metrics.span('compare.total'):
+            return self.score(self.parse(candidate))
+
+    def compare_many(self, candidates: Iterable[str]) -> Iterator[CompareResult]:
+        """
+        Compares target with candidates one by one, catching any failure into result.
+        :param candidates: candidates' paths
+        :return: iterator over compare results
+        """
+        for candidate in candidates:
+            try:
+                yield CompareResult(candidate, self.compare(candidate))
+            except Exception as err:
+                yield CompareResult(candidate, error=str(err))
+
+    def close(self) -> None:
+        """
+        Writes buffered results and closes results file.
+        :return: None
+        """
+        if self.__sink is not None:
+            self.__sink.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
 def identity_check(file1: str, file2: str, to_file=None) -> str:
     """
     Builds string with table of matching files' identifiers data.
@@ -26,34 +124,62 @@ def identity_check(file1: str, file2: str, to_file=None) -> str:
     :param to_file: if not None, compare results will be written in passed file
     :return: resulted sting table
     """
+    with metrics.span('compare.total'):
+        check_comparable(file1, file2)
+
+        out1: dict = parse_file_identifier(file1)
+        out2: dict = parse_file_identifier(file2)
+
+        return identity_table(file1, out1, out2, to_file)
+
+
+def identity_table(file1: str, out1: dict, out2: dict, to_file=None) -> str:
+    """
+    Builds string with table of matching already parsed identifiers data.
+    :param file1: first file path
+    :param out1: parsed identifier of first file
+    :param out2: parsed identifier of second file
+    :param to_file: if not None, compare results will be written in passed file
+    :return: resulted sting table
+    """
     table = PrettyTable(
         field_names=('', 'First File', 'Second File', 'Matching')
     )
 
-    if not _comparable(file1, file2):
-        raise InvalidExtensionException(f'Files {file1} and {file2} have incomparable extensions')
-
-    out1: dict = parse_file_identifier(file1)
-    out2: dict = parse_file_identifier(file2)
-
     if to_file is not None:
-        write_compare_results((out1, out2), to_file, file1)
+        with metrics.span('compare.write_results'):
+            write_compare_results((out1, out2), to_file, file1)
 
     row_names = tuple(out1.keys())
 
-    for name in row_names:
-        row = [name, out1[name], out2[name]]
-        if not name.endswith('hash'):
-            row.append(__match_check(out1[name], out2[name]))
-        else:
-            if isinstance(out1[name], imagehash.ImageHash):
-                row.append(f'{100 - (out1[name] - out2[name])} %')
+    with metrics.span('compare.score'):
+        for name in row_names:
+            row = [name, out1[name], out2[name]]
+            if name == const.CONTENT_MINHASH:
+                # Signatures are too long for the table, their estimated Jaccard similarity is shown.
+                row = [name, _abbreviated(out1[name]), _abbreviated(out2[name]), _content_similarity(out1, out2)]
+            elif not name.endswith('hash'):
+                row.append(__match_check(out1[name], out2[name]))
             else:
-                row.append(f'{ssdeep_cmp(out1[name], out2[name])} %')
+                if name == const.FUZZY_HASH:
+                    row.append(f'{ssdeep_cmp(out1[name], out2[name])} %')
+                else:
+                    row.append(f'{100 - (out1[name] - out2[name])} %')
 
-        table.add_row(row)
+            table.add_row(row)
 
-    return str(table)
+        return str(table)
+
+
+def check_comparable(file1: str, file2: str) -> None:
+    """
+    Raises InvalidExtensionException if files are incomparable.
+    :param file1: first file path
+    :param file2: second file path
+    :return: None
+    """
+    if not _comparable(file1, file2):
+        raise InvalidExtensionException(f'Files {file1} and {file2} have incomparable extensions')
 
 
 def parse_file_identifier(file: str) -> dict:
@@ -63,14 +189,18 @@ def parse_file_identifier(file: str) -> dict:
     :return:
     """
     extension = os.path.splitext(file)[1]
-    if extension in const.DOC_EXTENSIONS:
-        return _parse_document_identifier(file)
-    elif extension in const.IMG_EXTENSIONS:
-        return _parse_image_identifier(file)
-    else:
-        raise InvalidExtensionException(
-            f'Valid file should have extension like {", ".join(const.VALID_EXTENSIONS)}. Not {extension}.'
-        )
+    with metrics.span('compare.parse_identifier'):
+        if extension in const.DOC_EXTENSIONS:
+            fields = _parse_document_identifier(file)
+        elif extension in const.IMG_EXTENSIONS:
+            fields = _parse_image_identifier(file)
+        else:
+            raise InvalidExtensionException(
+                f'Valid file should have extension like {", ".join(const.VALID_EXTENSIONS)}. Not {extension}.'
+            )
+
+    metrics.count('compare_files')
+    return fields
 
 
 def _comparable(file1_: str, file2_: str) -> bool:
@@ -117,35 +247,59 @@ def _parse_document_identifier(doc_file: str) -> dict:
         const.CREATION_TIME: '',
         const.MODIFIED_TIME: '',
         const.FUZZY_HASH: '',
-        const.IS_HASH_INTEGRITY: False
+        const.IS_HASH_INTEGRITY: False,
+        const.CONTENT_MINHASH: const.NOT_FOUND,
     }
 
-    with zipfile.ZipFile(doc_file, 'r') as zip_ref:
-        soup = BeautifulSoup(zip_ref.read(const.CORE), 'xml')
-        description_tag = soup.find(const.DOC_DC_DESCRIPTION)
-
-        if description_tag is not None and description_tag.string:
-            words = decode_base64_id(description_tag.string).split()
-            __get_document_fields(words, out_dict)
-        else:
-            raise NoIdentifierException(f'File {doc_file} has no identifier.')
+    # Only core.xml is read, it's enough for identifier.
+    core = read_identifier(doc_file)
+    if core.description:
+        words = decode_base64_id(core.description).split()
+        __get_document_fields(words, out_dict)
+    else:
+        raise NoIdentifierException(f'File {doc_file} has no identifier.')
 
-        # Check explicit fuzzy hash existence in cp:keywords tag.
-        soup = BeautifulSoup(zip_ref.read(const.CORE), 'xml')
-        keywords_tag = soup.find(const.DOC_CP_KEYWORDS)
+    # Check explicit fuzzy hash existence in cp:keywords tag.
+    if core.keywords is not None:
+        out_dict[const.IS_HASH_INTEGRITY] = core.keywords == out_dict[const.FUZZY_HASH]
 
-        if keywords_tag is not None:
-            out_dict[const.IS_HASH_INTEGRITY] = keywords_tag.string == out_dict[const.FUZZY_HASH]
+    # MinHash signature user-defined property is absent in documents marked before it was introduced.
+    if is_signature(core.minhash):
+        out_dict[const.CONTENT_MINHASH] = core.minhash
 
     return out_dict
 
 
+def _content_similarity(out1: dict, out2: dict) -> str:
+    """
+    Estimates Jaccard similarity of documents content by their MinHash signatures.
+    :param out1: parsed identifier of first document
+    :param out2: parsed identifier of second document
+    :return: similarity in percents, NOT_FOUND if any document was marked without signature
+    """
+    signature1, signature2 = out1[const.CONTENT_MINHASH], out2[const.CONTENT_MINHASH]
+    if const.NOT_FOUND in (signature1, signature2):
+        return const.NOT_FOUND
+
+    return f'{minhash_cmp(signature1, signature2)} %'
+
+
+def _abbreviated(signature: str, length: int = 16) -> str:
+    if signature == const.NOT_FOUND or len(signature) <= length:
+        return signature
+
+    return f'{signature[:length]}...'
+
+
 def _parse_image_identifier(img_file: str) -> dict:
     """
     Parse image identifier in dict of information fields.
     :param img_file: path to img_file
     :return: fields dict
     """
+    # imagehash pulls in NumPy, SciPy and PIL, documents never need them.
+    import imagehash
+
     filename = os.path.basename(os.path.splitext(img_file)[0])
     # Take all instead defaulthash.
     fields = filename.split('_', maxsplit=5)
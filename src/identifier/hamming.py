@@ -0,0 +1,298 @@
+# Copyright 2022 aaaaaaaalesha
+
+from itertools import combinations
+from typing import Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy
+
+# Every 64-bit hash is split into substrings of this many bits.
+SUBSTRING_BITS = 16
+SUBSTRINGS_PER_HASH = 64 // SUBSTRING_BITS
+# Substrings are probed with up to this many flipped bits before falling back to linear scan.
+MAX_PROBE_RADIUS = 3
+# Items added after the tables were built are scanned linearly while there are few of them.
+MAX_PENDING_SCAN = 1 << 12
+
+_POPCOUNT8 = numpy.array([bin(byte).count('1') for byte in range(256)], dtype=numpy.uint8)
+
+
+def _probe_masks(radius: int) -> numpy.ndarray:
+    masks = [sum(1 << bit for bit in bits) for bits in combinations(range(SUBSTRING_BITS), radius)]
+    return numpy.array(masks, dtype=numpy.uint16)
+
+
+_MASKS = [_probe_masks(radius) for radius in range(MAX_PROBE_RADIUS + 1)]
+
+
+class HammingIndex:
+    """
+    Class implements multi-index hashing over tuples of 64-bit hashes (e.g. average, difference and perceptual
+    hashes of image). Distance between tuples is the sum of Hamming distances of their hashes.
+
+    Each hash is split into 16-bit substrings, and each substring position has its own table.
+    If the total distance doesn't exceed r, at least one of S substrings differs in no more than r // S bits,
+    so only items found by probing substrings of the query with few flipped bits are really compared.
+    """
+
+    def __init__(self, width: int):
+        """
+        :param width: number of hashes in each item
+        """
+        self.__width = width
+        self.__substrings = width * SUBSTRINGS_PER_HASH
+        self.__keys: List[Hashable] = []
+        self.__ids: Dict[Hashable, int] = {}
+        self.__codes = numpy.empty((0, width), dtype=numpy.uint64)
+        self.__alive = numpy.empty(0, dtype=bool)
+        self.__pending: List[Tuple[int, ...]] = []
+        self.__removed = 0
+        # Bucket boundaries and ids sorted by substring value for each substring position.
+        self.__starts = numpy.empty((self.__substrings, 0), dtype=numpy.int64)
+        self.__orders = numpy.empty((self.__substrings, 0), dtype=numpy.int64)
+
+    def __len__(self) -> int:
+        return len(self.__ids)
+
+    def __contains__(self, key) -> bool:
+        return key in self.__ids
+
+    def add(self, key, hashes: Sequence[int]) -> None:
+        """
+        Adds item to index, replacing the previous one stored under the same key.
+        :param key: hashable key of item, e.g. file path
+        :param hashes: width hashes as unsigned 64-bit integers
+        :return: None
+        """
+        if len(hashes) != self.__width:
+            raise ValueError(f'Item should have {self.__width} hashes, not {len(hashes)}.')
+
+        if key in self.__ids:
+            self.remove(key)
+
+        self.__ids[key] = len(self.__keys)
+        self.__keys.append(key)
+        self.__pending.append(tuple(int(value) for value in hashes))
+
+    def remove(self, key) -> None:
+        """
+        Removes item from index.
+        :param key: key of item
+        :return: None
+        """
+        id_ = self.__ids.pop(key)
+        self.__keys[id_] = None
+        self.__removed += 1
+
+        if id_ < len(self.__alive):
+            self.__alive[id_] = False
+        else:
+            # Pending items are stored after indexed ones.
+            self.__pending[id_ - len(self.__alive)] = None
+
+        if self.__removed > len(self.__keys) // 2:
+            self.__compact()
+
+    def within(self, hashes: Sequence[int], radius: int) -> List[Tuple[Hashable, int]]:
+        """
+        Finds all items with total Hamming distance to the passed hashes not greater than radius.
+        :param hashes: width hashes as unsigned 64-bit integers
+        :param radius: maximal total distance
+        :return: list of (key, distance) pairs sorted by ascending distance
+        """
+        query = self.__query_codes(hashes)
+        probe_radius = radius // self.__substrings
+
+        ids = None
+        if probe_radius <= MAX_PROBE_RADIUS:
+            ids = self.__candidates(query, range(probe_radius + 1), self.__scan_limit())
+
+        if ids is None:
+            ids, distances = self.__scan(query)
+        else:
+            distances = self.__distances(query, ids)
+
+        pending_ids, pending_distances = self.__scan_pending(query)
+        ids = numpy.concatenate((ids, pending_ids))
+        distances = numpy.concatenate((distances, pending_distances))
+
+        found = distances <= radius
+        return self.__sorted(ids[found], distances[found], len(ids))
+
+    def nearest(self, hashes: Sequence[int], k: int = 10) -> List[Tuple[Hashable, int]]:
+        """
+        Finds k items with the least total Hamming distance to the passed hashes.
+        Probing radius grows until k items are found within the distance guaranteed to be searched completely.
+        :param hashes: width hashes as unsigned 64-bit integers
+        :param k: number of returned items
+        :return: list of (key, distance) pairs sorted by ascending distance
+        """
+        query = self.__query_codes(hashes)
+        pending_ids, pending_distances = self.__scan_pending(query)
+
+        found_ids = [numpy.empty(0, dtype=numpy.int64)]
+        found_distances = [numpy.empty(0, dtype=numpy.int64)]
+        seen = numpy.zeros(len(self.__alive), dtype=bool)
+        limit = self.__scan_limit()
+
+        for level in range(MAX_PROBE_RADIUS + 1):
+            ids = self.__candidates(query, range(level, level + 1), limit)
+            if ids is None:
+                break
+
+            ids = ids[~seen[ids]]
+            seen[ids] = True
+            limit -= len(ids)
+            found_ids.append(ids)
+            found_distances.append(self.__distances(query, ids))
+
+            # All items within this total distance have been found already.
+            complete = (level + 1) * self.__substrings - 1
+            distances = numpy.concatenate(found_distances)
+            if numpy.count_nonzero(distances <= complete) + numpy.count_nonzero(pending_distances <= complete) >= k:
+                break
+        else:
+            ids = None
+
+        if ids is None:
+            scanned_ids, scanned_distances = self.__scan(query)
+            found_ids, found_distances = [scanned_ids], [scanned_distances]
+
+        ids = numpy.concatenate((*found_ids, pending_ids))
+        distances = numpy.concatenate((*found_distances, pending_distances))
+
+        return self.__sorted(ids, distances, k)
+
+    def __query_codes(self, hashes: Sequence[int]) -> numpy.ndarray:
+        if len(hashes) != self.__width:
+            raise ValueError(f'Query should have {self.__width} hashes, not {len(hashes)}.')
+
+        if len(self.__pending) > MAX_PENDING_SCAN:
+            self.__build()
+
+        return numpy.array([int(value) for value in hashes], dtype=numpy.uint64)
+
+    def __scan_limit(self) -> int:
+        # Gathering candidates costs more than linear scan if they are a noticeable part of all items.
+        return len(self.__alive) // 8
+
+    def __candidates(self, query: numpy.ndarray, levels: range, limit: int) -> Optional[numpy.ndarray]:
+        """
+        Collects unique ids of indexed items having a substring which differs from the query one
+        in number of bits from levels.
+        :param query: width hashes
+        :param levels: numbers of flipped bits in probed substrings
+        :param limit: maximal number of gathered postings
+        :return: sorted ids, None if there are more postings than limit
+        """
+        if not len(self.__alive):
+            return numpy.empty(0, dtype=numpy.int64)
+
+        masks = numpy.concatenate([_MASKS[level] for level in levels])
+        positions = numpy.arange(self.__substrings)[:, None]
+        probes = (_substrings(query[None, :])[0][:, None] ^ masks).astype(numpy.int64)
+
+        starts = self.__starts[positions, probes].ravel()
+        lengths = self.__starts[positions, probes + 1].ravel() - starts
+        total = int(lengths.sum())
+        if total > limit:
+            return None
+
+        # Concatenated ranges [start, start + length) of all probed buckets in flattened tables.
+        starts += numpy.repeat(numpy.arange(self.__substrings) * len(self.__alive), len(masks))
+        offsets = numpy.repeat(starts - (numpy.cumsum(lengths) - lengths), lengths)
+        ids = self.__orders.ravel()[numpy.arange(total) + offsets]
+
+        found = numpy.zeros(len(self.__alive), dtype=bool)
+        found[ids] = True
+        return numpy.flatnonzero(found & self.__alive)
+
+    def __distances(self, query: numpy.ndarray, ids: numpy.ndarray) -> numpy.ndarray:
+        return _popcount(self.__codes[ids] ^ query).sum(axis=1, dtype=numpy.int64)
+
+    def __scan(self, query: numpy.ndarray) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        ids = numpy.flatnonzero(self.__alive)
+        return ids, self.__distances(query, ids)
+
+    def __scan_pending(self, query: numpy.ndarray) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        offset = len(self.__alive)
+        ids = [offset + i for i, codes in enumerate(self.__pending) if codes is not None]
+        if not ids:
+            return numpy.empty(0, dtype=numpy.int64), numpy.empty(0, dtype=numpy.int64)
+
+        codes = numpy.array([self.__pending[id_ - offset] for id_ in ids], dtype=numpy.uint64)
+        return numpy.array(ids, dtype=numpy.int64), _popcount(codes ^ query).sum(axis=1, dtype=numpy.int64)
+
+    def __sorted(self, ids: numpy.ndarray, distances: numpy.ndarray, k: int) -> List[Tuple[Hashable, int]]:
+        if k <= 0 or not len(ids):
+            return []
+
+        if k < len(ids):
+            kth = numpy.partition(distances, k - 1)[k - 1]
+            selected = distances <= kth
+            ids, distances = ids[selected], distances[selected]
+
+        # Ties are broken by insertion order.
+        order = numpy.lexsort((ids, distances))[:k]
+        return [(self.__keys[id_], distance) for id_, distance in zip(ids[order].tolist(), distances[order].tolist())]
+
+    def __build(self) -> None:
+        """
+        Moves pending items to the arrays and rebuilds substring tables.
+        """
+        alive = [codes is not None for codes in self.__pending]
+        pending = [codes if codes is not None else (0,) * self.__width for codes in self.__pending]
+        pending = numpy.array(pending, dtype=numpy.uint64).reshape(-1, self.__width)
+        self.__codes = numpy.concatenate((self.__codes, pending))
+        self.__alive = numpy.concatenate((self.__alive, numpy.array(alive, dtype=bool)))
+        self.__pending = []
+
+        substrings = _substrings(self.__codes).T
+        self.__orders = numpy.argsort(substrings, axis=1, kind='stable')
+        sorted_substrings = numpy.take_along_axis(substrings, self.__orders, axis=1)
+        buckets = numpy.arange((1 << SUBSTRING_BITS) + 1)
+        self.__starts = numpy.stack([numpy.searchsorted(row, buckets) for row in sorted_substrings])
+
+    def __compact(self) -> None:
+        """
+        Rebuilds the index without removed items.
+        """
+        items = [(key, self.__item_codes(id_)) for key, id_ in self.__ids.items()]
+        self.__init__(self.__width)
+        for key, codes in items:
+            self.add(key, codes)
+
+    def __item_codes(self, id_: int) -> Tuple[int, ...]:
+        if id_ < len(self.__alive):
+            return tuple(self.__codes[id_].tolist())
+
+        return self.__pending[id_ - len(self.__alive)]
+
+
+def substring_keys(hashes: Sequence[int], flipped: int = 0) -> List[int]:
+    """
+    Keys of substrings of hashes for inverted index stored elsewhere, e.g. in database: key combines substring
+    position and its value. Probes of multi-index hashing are keys of substrings with flipped bits.
+    :param hashes: 64-bit hashes
+    :param flipped: number of bits flipped in each substring, from 0 to MAX_PROBE_RADIUS
+    :return: keys of all substrings with exactly flipped bits changed
+    """
+    substrings = _substrings(numpy.array([[int(value) for value in hashes]], dtype=numpy.uint64))[0]
+    keys = (numpy.arange(len(substrings), dtype=numpy.int64)[:, None] << SUBSTRING_BITS) | \
+        (substrings[:, None] ^ _MASKS[flipped]).astype(numpy.int64)
+    return keys.ravel().tolist()
+
+
+def _substrings(codes: numpy.ndarray) -> numpy.ndarray:
+    """
+    Splits (n, width) array of 64-bit hashes into (n, width * 4) array of 16-bit substrings.
+    """
+    codes = numpy.ascontiguousarray(codes, dtype='<u8')
+    return codes.view('<u2').reshape(len(codes), -1)
+
+
+def _popcount(values: numpy.ndarray) -> numpy.ndarray:
+    if hasattr(numpy, 'bitwise_count'):
+        return numpy.bitwise_count(values)
+
+    values = numpy.ascontiguousarray(values)
+    return _POPCOUNT8[values.view(numpy.uint8)].reshape(*values.shape, 8).sum(axis=-1, dtype=numpy.uint8)
@@ -0,0 +1,606 @@
+# Copyright 2022 aaaaaaaalesha
+
+import contextlib
+import hashlib
+import heapq
+import itertools
+import os
+import sqlite3
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple, Union
+
+import src.constants as const
+from src.minhash import MinHashIndex, band_keys, decode_signature, jaccard
+from src.ssdeep import signature_keys
+from src.winnowing import file_fingerprints
+from src.identifier.checker import parse_file_identifier
+from src.identifier.hamming import MAX_PROBE_RADIUS, SUBSTRINGS_PER_HASH, HammingIndex, substring_keys
+from src.identifier.injector import InvalidExtensionException
+
+IMG_HASH_FIELDS = (const.AVG_HASH, const.DIFF_HASH, const.PERC_HASH, const.COLOR_HASH)
+# Bulk indexing commits once per so many files.
+BULK_SIZE = 1000
+
+# Version of schema in PRAGMA user_version, older indexes are migrated on open.
+_SCHEMA_VERSION = 3
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS documents (
+    path TEXT PRIMARY KEY,
+    file_name TEXT,
+    creator_name TEXT,
+    workplace_name TEXT,
+    creation_time TEXT,
+    modified_time TEXT,
+    fuzzy_hash TEXT,
+    block_size INTEGER,
+    hash_integrity INTEGER,
+    minhash TEXT
+);
+CREATE INDEX IF NOT EXISTS documents_block_size ON documents (block_size);
+CREATE TABLE IF NOT EXISTS images (
+    path TEXT PRIMARY KEY,
+    from_file TEXT,
+    avg_hash TEXT,
+    diff_hash TEXT,
+    perc_hash TEXT,
+    color_hash TEXT
+);
+CREATE TABLE IF NOT EXISTS document_ids (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE
+);
+CREATE TABLE IF NOT EXISTS fuzzy_postings (
+    key INTEGER,
+    document INTEGER,
+    PRIMARY KEY (key, document)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS fuzzy_postings_document ON fuzzy_postings (document);
+CREATE TABLE IF NOT EXISTS minhash_bands (
+    key INTEGER,
+    document INTEGER,
+    PRIMARY KEY (key, document)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS minhash_bands_document ON minhash_bands (document);
+CREATE TABLE IF NOT EXISTS excerpts (
+    fingerprint INTEGER,
+    document INTEGER,
+    PRIMARY KEY (fingerprint, document)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS excerpts_document ON excerpts (document);
+CREATE TABLE IF NOT EXISTS image_substrings (
+    key INTEGER,
+    image INTEGER,
+    PRIMARY KEY (key, image)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS image_substrings_image ON image_substrings (image);
+'''
+
+
+class Match(NamedTuple):
+    """
+    Indexed marked file similar to the queried one.
+    """
+    path: str
+    score: float
+    fields: dict
+
+
+class ExcerptMatch(NamedTuple):
+    """
+    Indexed marked document sharing winnowing fingerprints with the queried excerpt.
+    """
+    path: str
+    shared: int
+    # Share of excerpt fingerprints found in document.
+    coverage: float
+    fields: dict
+
+
+class FingerprintIndex:
+    """
+    Class implements on-disk index of parsed identifiers of marked files.
+    Index stores identifier fields of documents and images, so similarity queries never touch original files.
+    Document keys are stored in inverted indexes from key to documents: (block size, 7-gram) keys of fuzzy hash,
+    LSH band keys of MinHash signature and winnowing fingerprints of content. Images are keyed by 16-bit substrings
+    of their hashes for multi-index hashing. Queries read only postings of their own keys, so a single query doesn't
+    load the index and costs time proportional to the size of queried hash or excerpt, not to the number of indexed
+    files.
+    """
+
+    def __init__(self, path: str, in_memory: bool = False):
+        """
+        :param path: path to index database
+        :param in_memory: if True, fuzzy hashes and MinHash signatures of all documents and hashes of all images
+                          are loaded into memory on first query and later queries are served from there,
+                          e.g. by long-running service
+        """
+        self.__connection = sqlite3.connect(path)
+        self.__migrate()
+        self.__batched = False
+
+        # Built from stored hashes on first query if in_memory.
+        self.__in_memory = in_memory
+        self.__fuzzy_index = None
+        self.__minhash_index = None
+        self.__hamming_index = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self) -> int:
+        return sum(self.__connection.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                   for table in ('documents', 'images'))
+
+    def close(self) -> None:
+        self.__connection.close()
+
+    def add(self, path: str, fingerprints: Optional[Iterable[int]] = None) -> None:
+        """
+        Parses identifier of marked file and stores it in index, fingerprints of document content are stored too.
+        :param path: path to marked file
+        :param fingerprints: already selected winnowing fingerprints of document content, e.g. by injector,
+                             selected from file if None
+        :return: None
+        """
+        self.add_fields(path, *parse_entry(path, fingerprints))
+
+    @contextlib.contextmanager
+    def batch(self) -> Iterator[None]:
+        """
+        Groups updates into a single transaction committed on exit, so bulk indexing doesn't sync database to disk
+        after each file. Failed update is rolled back alone, updates made before it are kept.
+        :return: context manager
+        """
+        with self.__connection:
+            self.__connection.execute('BEGIN')
+            self.__batched = True
+            try:
+                yield
+            finally:
+                self.__batched = False
+
+    def add_fields(self, path: str, fields: dict, fingerprints: Optional[Iterable[int]] = None) -> None:
+        """
+        Stores already parsed identifier fields of marked file in index.
+        :param path: path to marked file
+        :param fields: identifier fields from checker.parse_file_identifier
+        :param fingerprints: winnowing fingerprints of document content, document isn't found by excerpts if None
+        :return: None
+        """
+        path = os.path.abspath(path)
+        with self.__transaction():
+            if const.FUZZY_HASH in fields:
+                signature = _signature_of(fields)
+                document = self.__file_id(path)
+                self.__replace_postings(document, _fuzzy_keys(fields[const.FUZZY_HASH]), _band_keys(signature),
+                                        fingerprints)
+                self.__connection.execute(
+                    'INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (path, fields[const.FILE_NAME], fields[const.CREATOR_NAME], fields[const.WORKPLACE_NAME],
+                     fields[const.CREATION_TIME], fields[const.MODIFIED_TIME], fields[const.FUZZY_HASH],
+                     _block_size(fields[const.FUZZY_HASH]), int(fields[const.IS_HASH_INTEGRITY]), signature),
+                )
+                if self.__fuzzy_index is not None:
+                    self.__fuzzy_index.add(path, fields[const.FUZZY_HASH])
+                if self.__minhash_index is not None:
+                    if signature is not None:
+                        self.__minhash_index.add(path, signature)
+                    elif path in self.__minhash_index:
+                        self.__minhash_index.remove(path)
+            else:
+                hashes = [str(fields[name]) for name in IMG_HASH_FIELDS]
+                image = self.__file_id(path)
+                self.__connection.execute('DELETE FROM image_substrings WHERE image = ?', (image,))
+                self.__connection.executemany('INSERT OR IGNORE INTO image_substrings VALUES (?, ?)',
+                                              ((key, image) for key in substring_keys(_hash_values(hashes))))
+                self.__connection.execute(
+                    'INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?)',
+                    (path, fields[const.FROM_FILE], *hashes),
+                )
+                if self.__hamming_index is not None:
+                    self.__hamming_index.add(path, _hash_values(hashes))
+
+    def remove(self, path: str) -> None:
+        """
+        Removes marked file from index.
+        :param path: path to marked file
+        :return: None
+        """
+        path = os.path.abspath(path)
+        with self.__transaction():
+            for table in ('documents', 'images'):
+                self.__connection.execute(f'DELETE FROM {table} WHERE path = ?', (path,))
+
+            row = self.__connection.execute('SELECT id FROM document_ids WHERE path = ?', (path,)).fetchone()
+            if row is not None:
+                self.__replace_postings(row[0], (), (), None)
+                self.__connection.execute('DELETE FROM image_substrings WHERE image = ?', row)
+                self.__connection.execute('DELETE FROM document_ids WHERE id = ?', row)
+
+        if self.__fuzzy_index is not None and path in self.__fuzzy_index:
+            self.__fuzzy_index.remove(path)
+        if self.__minhash_index is not None and path in self.__minhash_index:
+            self.__minhash_index.remove(path)
+        if self.__hamming_index is not None and path in self.__hamming_index:
+            self.__hamming_index.remove(path)
+
+    def query(self, file_or_fields: Union[str, dict], k: int = 10) -> List[Match]:
+        """
+        Finds top-k indexed files most similar to the passed one.
+        Documents are scored by the best of fuzzy hash match and estimated Jaccard similarity of content,
+        so documents with reordered or partially copied content are found as well.
+        :param file_or_fields: path to queried file or its identifier fields
+        :param k: number of returned matches
+        :return: matches sorted by descending score
+        """
+        fields = file_or_fields
+        if isinstance(file_or_fields, str):
+            fields = parse_file_identifier(file_or_fields)
+
+        if const.FUZZY_HASH in fields:
+            return self.__query_documents(fields[const.FUZZY_HASH], _signature_of(fields), k)
+        if const.AVG_HASH in fields:
+            return self.__query_images([str(fields[name]) for name in IMG_HASH_FIELDS], k)
+
+        raise InvalidExtensionException('Passed fields are neither document nor image identifier.')
+
+    def search_excerpt(self, file_or_fingerprints: Union[str, Set[int]], k: int = 10) -> List[ExcerptMatch]:
+        """
+        Finds top-k indexed documents sharing the most winnowing fingerprints with excerpt, e.g. a few pages
+        of marked document pasted into email. Only postings of excerpt fingerprints are read.
+        :param file_or_fingerprints: path to excerpt file (document or text) or its fingerprints
+        :param k: number of returned matches
+        :return: matches sorted by descending number of shared fingerprints
+        """
+        fingerprints = file_or_fingerprints
+        if isinstance(file_or_fingerprints, str):
+            fingerprints = file_fingerprints(file_or_fingerprints)
+        if not fingerprints:
+            return []
+
+        rows = self.__query_postings('excerpts', 'fingerprint', fingerprints, k)
+        return [ExcerptMatch(row[0], row[-1], row[-1] / len(fingerprints), _document_fields(row[:-1]))
+                for row in rows]
+
+    def __migrate(self) -> None:
+        """
+        Creates tables missing in index and fills them for documents indexed before they were introduced.
+        :return: None
+        """
+        version = self.__connection.execute('PRAGMA user_version').fetchone()[0]
+        if version >= _SCHEMA_VERSION:
+            self.__connection.executescript(_SCHEMA)
+            return
+
+        with self.__connection:
+            # Ids of documents were kept only for excerpts before fuzzy hash postings were stored.
+            if self.__connection.execute("SELECT 1 FROM sqlite_master WHERE name = 'excerpt_documents'").fetchone():
+                self.__connection.execute('ALTER TABLE excerpt_documents RENAME TO document_ids')
+
+        self.__connection.executescript(_SCHEMA)
+        with self.__connection:
+            # Indexes created before MinHash signatures were introduced lack their column.
+            columns = [row[1] for row in self.__connection.execute('PRAGMA table_info(documents)')]
+            if 'minhash' not in columns:
+                self.__connection.execute('ALTER TABLE documents ADD COLUMN minhash TEXT')
+
+            self.__connection.execute('INSERT OR IGNORE INTO document_ids (path) SELECT path FROM documents')
+            self.__connection.execute('INSERT OR IGNORE INTO document_ids (path) SELECT path FROM images')
+            if version < 1:
+                rows = self.__connection.execute(
+                    'SELECT id, fuzzy_hash FROM documents JOIN document_ids USING (path)').fetchall()
+                self.__connection.executemany('INSERT OR IGNORE INTO fuzzy_postings VALUES (?, ?)',
+                                              ((key, document) for document, fuzzy_hash in rows
+                                               for key in _fuzzy_keys(fuzzy_hash)))
+
+            # LSH bands of MinHash signatures were kept only in memory before version 2.
+            if version < 2:
+                rows = self.__connection.execute(
+                    'SELECT id, minhash FROM documents JOIN document_ids USING (path) '
+                    'WHERE minhash IS NOT NULL').fetchall()
+                self.__connection.executemany('INSERT OR IGNORE INTO minhash_bands VALUES (?, ?)',
+                                              ((key, document) for document, signature in rows
+                                               for key in _band_keys(signature)))
+
+            # Substrings of image hashes were kept only in memory before version 3.
+            rows = self.__connection.execute(
+                'SELECT id, avg_hash, diff_hash, perc_hash, color_hash FROM images JOIN document_ids USING (path)'
+            ).fetchall()
+            self.__connection.executemany('INSERT OR IGNORE INTO image_substrings VALUES (?, ?)',
+                                          ((key, image) for image, *hashes in rows
+                                           for key in substring_keys(_hash_values(hashes))))
+            self.__connection.execute(f'PRAGMA user_version = {_SCHEMA_VERSION}')
+
+    @contextlib.contextmanager
+    def __transaction(self) -> Iterator[None]:
+        """
+        Runs statements in a transaction of their own, or in a savepoint of batch transaction inside batch().
+        """
+        if not self.__batched:
+            with self.__connection:
+                yield
+            return
+
+        self.__connection.execute('SAVEPOINT entry')
+        try:
+            yield
+        except BaseException:
+            self.__connection.execute('ROLLBACK TO entry')
+            raise
+        finally:
+            self.__connection.execute('RELEASE entry')
+
+    def __file_id(self, path: str) -> int:
+        """
+        Returns id of document or image in postings tables, assigning it on first use. Must be called inside
+        transaction.
+        :param path: absolute path to marked file
+        :return: id of file
+        """
+        self.__connection.execute('INSERT OR IGNORE INTO document_ids (path) VALUES (?)', (path,))
+        return self.__connection.execute('SELECT id FROM document_ids WHERE path = ?', (path,)).fetchone()[0]
+
+    def __replace_postings(self, document: int, fuzzy_keys: Iterable[int], minhash_keys: Iterable[int],
+                           fingerprints: Optional[Iterable[int]]) -> None:
+        """
+        Replaces keys of document in inverted indexes, must be called inside transaction.
+        :param document: id of document
+        :param fuzzy_keys: keys of fuzzy hash
+        :param minhash_keys: LSH band keys of MinHash signature
+        :param fingerprints: winnowing fingerprints of content, document isn't found by excerpts if None
+        :return: None
+        """
+        for table in ('fuzzy_postings', 'minhash_bands', 'excerpts'):
+            self.__connection.execute(f'DELETE FROM {table} WHERE document = ?', (document,))
+
+        self.__connection.executemany('INSERT OR IGNORE INTO fuzzy_postings VALUES (?, ?)',
+                                      ((key, document) for key in fuzzy_keys))
+        self.__connection.executemany('INSERT OR IGNORE INTO minhash_bands VALUES (?, ?)',
+                                      ((key, document) for key in minhash_keys))
+        if fingerprints is not None:
+            self.__connection.executemany('INSERT OR IGNORE INTO excerpts VALUES (?, ?)',
+                                          ((fingerprint, document) for fingerprint in fingerprints))
+
+    def __query_postings(self, table: str, column: str, keys: Iterable[int], k: int = -1,
+                         files: str = 'documents') -> List[tuple]:
+        """
+        Counts keys each indexed file shares with query, reading only postings of query keys.
+        :param table: postings table
+        :param column: key column of postings table
+        :param keys: query keys
+        :param k: number of returned files, all of them if negative
+        :param files: table of indexed files: documents or images
+        :return: rows of files table followed by number of shared keys, sorted by it in descending order
+        """
+        file_id = 'document' if files == 'documents' else 'image'
+        with self.__transaction():
+            self.__connection.execute('CREATE TEMP TABLE IF NOT EXISTS query_keys (key INTEGER PRIMARY KEY)')
+            self.__connection.execute('DELETE FROM query_keys')
+            self.__connection.executemany('INSERT OR IGNORE INTO query_keys VALUES (?)', ((key,) for key in keys))
+            # CROSS JOIN makes SQLite loop over query keys and look each of them up in postings.
+            rows = self.__connection.execute(
+                f'SELECT {files}.*, COUNT(*) AS shared FROM query_keys '
+                f'CROSS JOIN {table} ON {table}.{column} = query_keys.key '
+                f'JOIN document_ids ON document_ids.id = {table}.{file_id} '
+                f'JOIN {files} ON {files}.path = document_ids.path '
+                f'GROUP BY {table}.{file_id} ORDER BY shared DESC, {files}.path LIMIT ?', (k,)
+            ).fetchall()
+            self.__connection.execute('DELETE FROM query_keys')
+
+        return rows
+
+    def __query_documents(self, fuzzy_hash: str, signature: Optional[str], k: int) -> List[Match]:
+        from src.ssdeep import compare_many
+
+        if self.__in_memory:
+            if self.__fuzzy_index is None:
+                from src.ssdeep import FuzzyHashIndex
+
+                self.__fuzzy_index = FuzzyHashIndex()
+                for path, stored_hash in self.__connection.execute('SELECT path, fuzzy_hash FROM documents'):
+                    self.__fuzzy_index.add(path, stored_hash)
+
+            rows: Dict[str, tuple] = {}
+            scores = dict(self.__fuzzy_index.query(fuzzy_hash))
+        else:
+            # Documents sharing no key with fuzzy hash have zero match score.
+            candidates = self.__query_postings('fuzzy_postings', 'key', _fuzzy_keys(fuzzy_hash))
+            rows = {row[0]: row[:-1] for row in candidates}
+            stored_hashes = [row[6] for row in candidates]
+            scores = {path: score for path, score in zip(rows, compare_many(fuzzy_hash, stored_hashes).tolist())
+                      if score > 0}
+
+        if signature is not None:
+            for path, similarity in self.__similar_contents(signature, rows):
+                scores[path] = max(scores.get(path, 0), round(100 * similarity))
+
+        matches = []
+        for path, score in heapq.nlargest(k, scores.items(), key=lambda item: item[1]):
+            row = rows.get(path) or self.__connection.execute('SELECT * FROM documents WHERE path = ?',
+                                                              (path,)).fetchone()
+            matches.append(Match(path, score, _document_fields(row)))
+
+        return matches
+
+    def __similar_contents(self, signature: str, rows: Dict[str, tuple]) -> List[Tuple[str, float]]:
+        """
+        Finds documents sharing at least one LSH band with MinHash signature.
+        :param signature: encoded MinHash signature
+        :param rows: rows of documents table by path, rows of candidates read from index are added to it
+        :return: list of (path, estimated Jaccard similarity) pairs
+        """
+        if self.__in_memory:
+            if self.__minhash_index is None:
+                self.__minhash_index = MinHashIndex()
+                for path, stored_signature in self.__connection.execute(
+                        'SELECT path, minhash FROM documents WHERE minhash IS NOT NULL'):
+                    self.__minhash_index.add(path, stored_signature)
+
+            return self.__minhash_index.query(signature)
+
+        digest = decode_signature(signature)
+        candidates = self.__query_postings('minhash_bands', 'key', band_keys(digest))
+        for row in candidates:
+            rows.setdefault(row[0], row[:-1])
+
+        return [(row[0], jaccard(digest, decode_signature(row[9]))) for row in candidates]
+
+    def __query_images(self, hashes: List[str], k: int) -> List[Match]:
+        values = _hash_values(hashes)
+        if self.__in_memory:
+            if self.__hamming_index is None:
+                self.__hamming_index = HammingIndex(len(IMG_HASH_FIELDS))
+                for path, *stored_hashes in self.__connection.execute(
+                        'SELECT path, avg_hash, diff_hash, perc_hash, color_hash FROM images'):
+                    self.__hamming_index.add(path, _hash_values(stored_hashes))
+
+            nearest = self.__hamming_index.nearest(values, k)
+            paths = [path for path, _ in nearest]
+            rows = {row[0]: row for row in self.__connection.execute(
+                f'SELECT * FROM images WHERE path IN ({", ".join("?" * len(paths))})', paths)}
+        else:
+            nearest, rows = self.__nearest_images(values, k)
+
+        matches = []
+        for path, distance in nearest:
+            # Mean of percentage similarities of image hashes like identity_check shows.
+            score = 100 - distance / len(IMG_HASH_FIELDS)
+            matches.append(Match(path, score, dict(zip(const.IMG_FIELDS, rows[path][1:]))))
+
+        return matches
+
+    def __nearest_images(self, values: List[int], k: int) -> Tuple[List[Tuple[str, int]], Dict[str, tuple]]:
+        """
+        Finds k images nearest to hashes by multi-index hashing over substring postings, like HammingIndex.nearest:
+        substrings are probed with growing number of flipped bits until k images are found within the distance
+        guaranteed to be searched completely. All images are compared if probing doesn't find enough of them.
+        :param values: hashes of queried image as integers
+        :param k: number of returned images
+        :return: list of (path, distance) pairs sorted by ascending distance and rows of images table by path
+        """
+        rows: Dict[str, tuple] = {}
+        distances: Dict[str, int] = {}
+        substrings = len(values) * SUBSTRINGS_PER_HASH
+        for flipped in range(MAX_PROBE_RADIUS + 1):
+            for row in self.__query_postings('image_substrings', 'key', substring_keys(values, flipped),
+                                             files='images'):
+                if row[0] not in rows:
+                    rows[row[0]] = row[:-1]
+                    distances[row[0]] = _hamming_distance(values, _hash_values(row[2:-1]))
+
+            # All images within this total distance have been found already.
+            complete = (flipped + 1) * substrings - 1
+            if sum(distance <= complete for distance in distances.values()) >= k:
+                break
+        else:
+            for row in self.__connection.execute('SELECT * FROM images'):
+                if row[0] not in rows:
+                    rows[row[0]] = row
+                    distances[row[0]] = _hamming_distance(values, _hash_values(row[2:]))
+
+        nearest = heapq.nsmallest(k, distances.items(), key=lambda item: (item[1], item[0]))
+        return nearest, rows
+
+
+def parse_entry(path: str, fingerprints: Optional[Iterable[int]] = None) -> Tuple[dict, Optional[Iterable[int]]]:
+    """
+    Collects everything index stores about marked file: identifier fields and, for documents, winnowing fingerprints
+    of content. Doesn't touch index, so it's safe to call from several threads.
+    :param path: path to marked file
+    :param fingerprints: already selected fingerprints of document content, content isn't read again if passed
+    :return: identifier fields and fingerprints, None for images
+    """
+    fields = parse_file_identifier(path)
+    if const.FUZZY_HASH not in fields:
+        fingerprints = None
+    elif fingerprints is None:
+        fingerprints = file_fingerprints(path)
+
+    return fields, fingerprints
+
+
+class IndexResult(NamedTuple):
+    """
+    Result of adding a single marked file to index.
+    """
+    path: str
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def build_index(index_path: str, paths: Iterable[str]) -> Iterator[IndexResult]:
+    """
+    Bulk indexes marked files, catching any failure, e.g. file without identifier, into result.
+    Files are added in transactions of BULK_SIZE files.
+    :param index_path: path to index database
+    :param paths: paths to marked files
+    :return: iterator over results in the order of passed paths
+    """
+    paths = iter(paths)
+    with FingerprintIndex(index_path) as index:
+        while True:
+            bulk = list(itertools.islice(paths, BULK_SIZE))
+            if not bulk:
+                break
+
+            results = []
+            with index.batch():
+                for path in bulk:
+                    try:
+                        index.add(path)
+                    except Exception as err:
+                        results.append(IndexResult(path, f'{type(err).__name__}: {err}'))
+                        continue
+
+                    results.append(IndexResult(path))
+
+            # Results are reported once their files are committed.
+            yield from results
+
+
+def _block_size(fuzzy_hash: str) -> int:
+    return int(fuzzy_hash.split(':', maxsplit=1)[0])
+
+
+def _fuzzy_keys(fuzzy_hash: str) -> Set[int]:
+    """
+    Keys of fuzzy hash in postings. Hash too short to have any 7-gram is keyed by itself: it matches only
+    identical hashes, like in FuzzyHashIndex.
+    """
+    keys = signature_keys(fuzzy_hash)
+    if not keys:
+        digest = hashlib.blake2b(fuzzy_hash.encode('utf-8'), digest_size=8).digest()
+        # 7-gram keys are non-negative.
+        keys.add(-1 - (int.from_bytes(digest, 'big') >> 1))
+
+    return keys
+
+
+def _band_keys(signature: Optional[str]) -> List[int]:
+    return [] if signature is None else band_keys(decode_signature(signature))
+
+
+def _document_fields(row: tuple) -> dict:
+    fields = dict(zip(const.DOC_FIELDS, row[1:7]))
+    fields[const.IS_HASH_INTEGRITY] = bool(row[8])
+    fields[const.CONTENT_MINHASH] = row[9] or const.NOT_FOUND
+
+    return fields
+
+
+def _signature_of(fields: dict) -> Optional[str]:
+    signature = fields.get(const.CONTENT_MINHASH, const.NOT_FOUND)
+    return None if signature == const.NOT_FOUND else signature
+
+
+def _hash_values(hashes) -> List[int]:
+    return [int(image_hash, 16) for image_hash in hashes]
+
+
+def _hamming_distance(values: List[int], other: List[int]) -> int:
+    return sum(bin(value ^ other_value).count('1') for value, other_value in zip(values, other))
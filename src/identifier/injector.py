@@ -4,15 +4,15 @@ import os
 import socket
 import zipfile
 import shutil
-
-from bs4 import BeautifulSoup
-from imagehash import average_hash, dhash, phash, colorhash
-from tempfile import mkdtemp
-from PIL import Image
+from typing import Callable, Optional, Set, Tuple
 
 import src.constants as const
+import src.metrics as metrics
 import src.ssdeep as ssdeep
 import src.utils as utils
+from src.identifier.cache import FingerprintCache
+from src.identifier.properties import CoreProperties, CustomProperties, declare_custom_properties, read_identifier, \
+    relate_custom_properties
 
 
 class InvalidExtensionException(Exception):
@@ -27,8 +27,19 @@ class IdentifierInjector:
     - .jpg, .png, .bmp – images.
     """
 
-    def __init__(self, path: str):
+    def __init__(self, path: str, cache: Optional[FingerprintCache] = None, with_fingerprints: bool = False):
+        """
+        :param path: path to file
+        :param cache: if not None, fields of unchanged files are taken from it instead of being computed again
+        :param with_fingerprints: if True, winnowing fingerprints of document content are selected in the same pass
+                                  as its hashes, e.g. for fingerprint index
+        """
         self.__path = path
+        self.__cache = cache
+        self.__cached = False
+        self.__core = None
+        self.__with_fingerprints = with_fingerprints
+        self.__fingerprints = None
 
         self.__extension = os.path.splitext(path)[1]
         if self.__extension not in const.VALID_EXTENSIONS:
@@ -40,237 +51,308 @@ class IdentifierInjector:
         # Saving document name.
         self.__file_name = os.path.basename(path)
 
+        cached = None
+        if cache is not None:
+            with metrics.span('inject.cache_lookup'):
+                cached = cache.get(path)
         if self.__extension in const.DOC_EXTENSIONS:
-            self.__collect_document_fields()
+            self.__collect_document_fields(cached)
         else:
-            self.__collect_img_fields()
+            self.__collect_img_fields(cached)
+
+    @property
+    def cached(self) -> bool:
+        """
+        Whether fields were taken from fingerprint cache.
+        """
+        return self.__cached
+
+    @property
+    def fingerprints(self) -> Optional[Set[int]]:
+        """
+        Winnowing fingerprints of document content, None if they weren't requested or content wasn't read:
+        for images and fields taken from cache.
+        """
+        return self.__fingerprints
 
-    def inject_identifier(self, out_folder: str) -> None:
+    def inject_identifier(self, out_folder: str) -> str:
         """
         Injects identifier in file and puts it to out_folder directory.
         :param: out_folder: destination directory path for injected file
-        :return: None.
+        :return: path to injected file.
         """
         if not os.path.exists(self.__path):
             raise FileNotFoundError(f'File {self.__file_name} is no longer available at {self.__path}.')
 
         if not os.path.exists(out_folder):
-            os.makedirs(out_folder)
+            # Several workers of batch injection may create the same folder simultaneously.
+            os.makedirs(out_folder, exist_ok=True)
 
         if not os.path.isdir(out_folder):
             raise NotADirectoryError(f'Path "{out_folder}" should be accessible directory to write injected documents.')
 
-        if self.__extension in const.DOC_EXTENSIONS:
-            self.__document_injection(out_folder)
-        else:
-            self.__image_injection(out_folder)
+        with metrics.span('inject.write'):
+            if self.__extension in const.DOC_EXTENSIONS:
+                out_path = self.__document_injection(out_folder)
+            else:
+                out_path = self.__image_injection(out_folder)
+
+        if metrics.enabled():
+            metrics.count('inject_files')
+            metrics.count('inject_bytes_read', os.path.getsize(self.__path))
+            metrics.count('inject_bytes_written', os.path.getsize(out_path))
+
+        return out_path
 
     def _is_injected(self) -> bool:
         """
         Method checks is identifier already injected in document.
         :return: True if identifier is already injected in document, False – otherwise.
         """
-        with zipfile.ZipFile(self.__path, 'r') as zip_ref:
-            soup = BeautifulSoup(zip_ref.read(const.CORE), 'xml')
-            description_tag = soup.find(const.DOC_DC_DESCRIPTION)
-
-            if description_tag is not None and description_tag.string:
-                try:
-                    positions = utils.decode_base64_id(description_tag.string).rsplit()
-                except UnicodeDecodeError:
-                    return False
+        return _is_identifier(self.__core_properties().description)
 
-                return True
-
-        return False
-
-    def __collect_document_fields(self) -> None:
+    def __collect_document_fields(self, cached: Optional[dict]) -> None:
         """
         Collects all needed fields for document.
+        :param cached: fields taken from fingerprint cache, if any
         :return: None
         """
+        # Saving name of workplace.
+        self.__workplace_name = socket.gethostname()
+
+        # Entries cached before MinHash signature was introduced are computed again.
+        if cached is not None and 'minhash' in cached:
+            self.__cached = True
+            self.__creator_name = cached['creator_name']
+            self.__creation_time = cached['creation_time']
+            self.__modified_time = cached['modified_time']
+            self.__fuzzy_hash = cached['fuzzy_hash']
+            self.__minhash = cached['minhash']
+            return
+
+        # Central directory of the archive is read once for core properties and all hashed members.
         with zipfile.ZipFile(self.__path, 'r') as zip_ref:
-            soup = BeautifulSoup(zip_ref.read(const.CORE), 'xml')
+            core = self.__core_properties(zip_ref)
 
-        # Saving name of creator.
-        tag = soup.find(const.DOC_CREATOR_TAG)
-        self.__creator_name = tag.string if tag is not None and tag.string else const.NOT_FOUND
+            # Saving name of creator.
+            self.__creator_name = core.creator or const.NOT_FOUND
 
-        # Saving name of workplace.
-        self.__workplace_name = socket.gethostname()
+            # Saving creation time.
+            self.__creation_time = core.created or const.NOT_FOUND
 
-        # Saving creation time.
-        tag = soup.find(const.DOC_DT_CREATED)
-        self.__creation_time = tag.string if tag is not None and tag.string else const.NOT_FOUND
+            # Saving last modification time.
+            self.__modified_time = core.modified or const.NOT_FOUND
 
-        # Saving last modification time.
-        tag = soup.find(const.DOC_DT_MODIFIED)
-        self.__modified_time = tag.string if tag is not None and tag.string else const.NOT_FOUND
+            self.__fuzzy_hash, self.__minhash = self.__get_content_hashes(zip_ref)
 
-        self.__fuzzy_hash = self.__get_fuzzy_hash()
+        if self.__cache is not None:
+            self.__cache.put(self.__path, {
+                'creator_name': self.__creator_name,
+                'creation_time': self.__creation_time,
+                'modified_time': self.__modified_time,
+                'fuzzy_hash': self.__fuzzy_hash,
+                'minhash': self.__minhash,
+            })
 
-    def __collect_img_fields(self) -> None:
+    def __collect_img_fields(self, cached: Optional[dict]) -> None:
         """
         Collects all needed fields for image.
+        :param cached: fields taken from fingerprint cache, if any
         :return: None
         """
-        with Image.open(self.__path) as img:
-            self.__defaulthash = hash(self.__path)
-            self.__avghash = str(average_hash(img))
-            self.__dhash = str(dhash(img))
-            self.__phash = str(phash(img))
-            self.__colorhash = str(colorhash(img))
-
-    def __get_fuzzy_hash(self) -> str:
-        """
-        Returns fuzzy hash, of .docx/.xlsx file.
-        :return: str-fuzzy hash.
-        """
-        string_builder = list()
-        tempdir = mkdtemp()
-        with zipfile.ZipFile(self.__path, 'r') as zip_ref:
-            zip_ref.extractall(tempdir)
+        # Imaging pulls in NumPy, PIL and imagehash, documents never need them.
+        import src.imaging as imaging
 
-        source_dir = tempdir
-        if self.__extension == '.docx':
-            source_dir += f'{os.sep}word'
-            self.__collect_word_content(source_dir, string_builder)
-        else:  # if '.xlsx'
-            source_dir += f'{os.sep}xl{os.sep}worksheets'
-            self.__collect_excel_content(source_dir, string_builder)
+        if cached is not None:
+            self.__cached = True
+            self.__avghash, self.__dhash, self.__phash, self.__colorhash = imaging.ImageHashes(**cached)
+            return
 
-        shutil.rmtree(tempdir)
+        with metrics.span('inject.image_hash'):
+            hashes = imaging.hash_image(self.__path)
+        self.__avghash, self.__dhash, self.__phash, self.__colorhash = hashes
 
-        return ssdeep.hash(''.join(string_builder))
+        if self.__cache is not None:
+            self.__cache.put(self.__path, hashes._asdict())
 
-    @staticmethod
-    def __collect_word_content(source_dir_: str, string_builder_: list) -> None:
+    def __core_properties(self, zip_ref: Optional[zipfile.ZipFile] = None) -> CoreProperties:
         """
-        Collects all valuable content from word document.
-        :param source_dir_: source directory inside unzipped word document
-        :param string_builder_: list for collecting word content
-        :return:
+        Returns core properties of document, parsing them on first use.
+        :param zip_ref: already opened document archive, if any
+        :return: parsed core properties
         """
-        existing_files = utils.get_files_list(source_dir_)
-        existing_files.sort()
+        if self.__core is None:
+            with metrics.span('inject.read_core'):
+                if zip_ref is not None:
+                    self.__core = CoreProperties(zip_ref.read(const.CORE))
+                else:
+                    self.__core = CoreProperties.from_document(self.__path)
 
-        for file in existing_files:
-            basename = os.path.basename(file)
-            if basename == 'document.xml' or basename.startswith(('footer', 'header')):
-                utils.extract_xml_tags(file, string_builder_, 'w:t')
+        return self.__core
 
-    @staticmethod
-    def __collect_excel_content(source_dir_: str, string_builder_: list) -> None:
+    def __get_content_hashes(self, zip_ref: zipfile.ZipFile) -> Tuple[str, Optional[str]]:
         """
-        Collects all valuable content from excel document.
-        :param source_dir_: source directory inside unzipped excel document
-        :param string_builder_: list for collecting excel content
-        :return: None
+        Returns fuzzy hash and MinHash signature of .docx/.xlsx file content, selects its winnowing fingerprints
+        if they were requested. Only members with content are streamed from the archive to all hashers piece by piece
+        in one pass, nothing is extracted to disk.
+        :param zip_ref: opened document archive
+        :return: str-fuzzy hash and encoded MinHash signature, None if content has no words
         """
-        existing_files = utils.get_files_list(source_dir_)
-
-        for file in existing_files:
-            utils.extract_xml_tags(file, string_builder_, 'sheetData', attrs=True)
-
-    def __write_identifier(self, tempdir_path: str) -> None:
-
+        import src.extractor as extractor
+        from src.minhash import MinHasher
+
+        # Extraction and parsing are interleaved with hashing, so their durations are accumulated separately.
+        extraction = metrics.stopwatch('inject.extract_parse')
+        hashing, min_hashing = metrics.stopwatch('inject.ssdeep'), metrics.stopwatch('inject.minhash')
+
+        hasher = ssdeep.FuzzyHasher()
+        # Content of .xlsx is sheetData markup, only text between its tags is split into words.
+        markup = extractor.CONTENT_TAGS[self.__extension][1]
+        min_hasher = MinHasher(markup=markup)
+        winnower, winnowing = None, metrics.stopwatch('inject.winnow')
+        if self.__with_fingerprints:
+            from src.winnowing import Winnower
+
+            winnower = Winnower(markup=markup)
+
+        for piece in extraction.iterate(extractor.iter_document_content(zip_ref, self.__extension)):
+            with hashing:
+                hasher.update(piece.encode('utf-8'))
+            with min_hashing:
+                min_hasher.update(piece)
+            if winnower is not None:
+                with winnowing:
+                    winnower.update(piece)
+
+        with hashing:
+            digest = hasher.digest()
+        with min_hashing:
+            signature = min_hasher.hexdigest()
+        if winnower is not None:
+            with winnowing:
+                self.__fingerprints = winnower.fingerprints()
+            winnowing.record()
+
+        extraction.record()
+        hashing.record()
+        min_hashing.record()
+        return digest, signature
+
+    def __build_core_xml(self, core_xml: bytes) -> bytes:
         """
-        Writes identifier in docProps/core.xml in tag <dc:description> like base64-string.
-        :param tempdir_path: path to temporary directory for working with external of .docx/.xlsx file
-        :return: None
+        Builds docProps/core.xml content with injected identifier.
+        Fuzzy hash is set explicitly in <cp:keywords> tag, identifier is written in <dc:description> like
+        base64-string.
+        :param core_xml: original docProps/core.xml content
+        :return: new docProps/core.xml content
         """
-        soup: BeautifulSoup = BeautifulSoup()
-
-        with open(f'{tempdir_path}{os.sep}{const.CORE}', 'r', encoding='utf-8') as core_xml:
-            soup = BeautifulSoup(core_xml.read(), 'xml')
-
-        description_tag = soup.find(const.DOC_DC_DESCRIPTION)
         text_id = f'{self.__file_name} {self.__creator_name} {self.__workplace_name} ' \
                   f'{self.__creation_time} {self.__modified_time} {self.__fuzzy_hash}'
 
-        # Inject base64 identifier in company tag if it exists.
-        if description_tag is not None:
-            description_tag.string = utils.encode_base64_id(text_id)
-        else:
-            soup.find(const.DOC_CORE_PROPERTIES).append(
-                BeautifulSoup(
-                    f'<{const.DOC_DC_DESCRIPTION}>{utils.encode_base64_id(text_id)}</{const.DOC_DC_DESCRIPTION}>',
-                    'xml',
-                ))
-
-            # Tag needs correction, because of wrong parsing of bs4.
-            tag = soup.find('description')
-            if tag is not None:
-                tag.name = const.DOC_DC_DESCRIPTION
-
-        with open(f'{tempdir_path}{os.sep}{const.CORE}', 'w', encoding='utf-8') as core_xml:
-            core_xml.write(str(soup))
+        with metrics.span('inject.build_core'):
+            core = CoreProperties(core_xml)
+            core.keywords = self.__fuzzy_hash
+            core.description = utils.encode_base64_id(text_id)
 
-    def __set_explicit_fuzzy_hash(self, tempdir_path: str) -> None:
+            return core.serialize()
 
+    def __build_custom_xml(self, custom_xml: Optional[bytes]) -> bytes:
         """
-        Setting fuzzy hash explicitly in docProps/core.xml in tag <cp:keywords>.
-        :param tempdir_path: path to temporary directory for working with external of .docx/.xlsx file
-        :return: None
+        Builds docProps/custom.xml content with MinHash signature of content in a user-defined property of its own,
+        other user-defined properties are kept.
+        :param custom_xml: original docProps/custom.xml content, None if document has no user-defined properties
+        :return: new docProps/custom.xml content
         """
+        with metrics.span('inject.build_custom'):
+            custom = CustomProperties(custom_xml)
+            custom.set(const.DOC_MINHASH_PROPERTY, self.__minhash)
 
-        soup: BeautifulSoup = BeautifulSoup()
-        core_path = f'{tempdir_path}{os.sep}{const.CORE}'
-
-        with open(core_path, 'r', encoding='utf-8') as core_xml:
-            soup = BeautifulSoup(core_xml.read(), 'xml')
-
-            keywords_tag = soup.find(const.DOC_CP_KEYWORDS)
-
-            # Paste fuzzy hash in cp:keywords tag if it exists.
-            if keywords_tag is not None:
-                keywords_tag.string = self.__fuzzy_hash
-            else:
-                soup.find(const.DOC_CORE_PROPERTIES).append(
-                    BeautifulSoup(f"<{const.DOC_CP_KEYWORDS}>{self.__fuzzy_hash}</{const.DOC_CP_KEYWORDS}>", 'xml')
-                )
-
-                # Tag needs correction, because of wrong parsing of bs4.
-                tag = soup.find('keywords')
-                if tag is not None:
-                    tag.name = const.DOC_CP_KEYWORDS
-
-        with open(core_path, 'w', encoding='utf-8') as core_xml:
-            core_xml.write(str(soup))
+            return custom.serialize()
 
-    def __document_injection(self, out: str) -> None:
+    def __document_injection(self, out: str) -> str:
         """
         Injects base64-string representation of identifier in document.
+        Source archive is read once: only docProps/core.xml and, for MinHash signature, docProps/custom.xml
+        with package parts referencing it are regenerated, other members are copied as is.
         :param out:  path for writing documents with injected id
-        :return: None
+        :return: path to injected document
         """
-        tempdir = mkdtemp()
-        with zipfile.ZipFile(self.__path, 'r') as zip_ref:
-            zip_ref.extractall(tempdir)
-
-        self.__set_explicit_fuzzy_hash(tempdir)
+        transforms = {const.CORE: self.__build_core_xml}
+        if self.__minhash is not None:
+            transforms.update({
+                const.CUSTOM: self.__build_custom_xml,
+                # Created docProps/custom.xml has to be declared, parts missing in archive aren't added.
+                const.CONTENT_TYPES: _existing_only(declare_custom_properties),
+                const.PACKAGE_RELATIONSHIPS: _existing_only(relate_custom_properties),
+            })
 
-        self.__write_identifier(tempdir)
+        out_path = f'{out}{os.sep}{self.__file_name}'
+        utils.rewrite_zip(self.__path, out_path, transforms)
 
-        utils.zip_path_to_file(tempdir, f'{out}{os.sep}{self.__file_name}')
+        return out_path
 
-        shutil.rmtree(tempdir)
-
-    def __image_injection(self, out: str) -> None:
+    def __image_injection(self, out: str) -> str:
         """
         Injects of identifier in the basename of image.
         :param out: path for writing documents with injected id
-        :return: None
+        :return: path to injected image
         """
         id_text = f"{utils.encode_base64_id(self.__file_name)}_{self.__avghash}_{self.__dhash}_{self.__phash}_" \
                   f"{self.__colorhash}{self.__extension}"
-        shutil.copy2(self.__path, out)
-
         new_path_name = os.path.join(out, id_text)
-        if os.path.exists(new_path_name):
-            os.remove(new_path_name)
 
-        os.rename(
-            os.path.join(out, self.__file_name),
-            os.path.join(out, id_text)
-        )
+        # Image is copied under temporary name first, so concurrent injections never write the same file.
+        tmp_path = utils.temporary_path(new_path_name)
+        try:
+            shutil.copy2(self.__path, tmp_path)
+            os.replace(tmp_path, new_path_name)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        return new_path_name
+
+
+def is_injected(path: str) -> bool:
+    """
+    Checks is identifier already injected in file without collecting its fields.
+    Document is marked if its <dc:description> is base64-identifier, image – if its name consists of
+    base64-encoded original name and four hashes.
+    :param path: path to file
+    :return: True if identifier is already injected in file, False – otherwise.
+    """
+    extension = os.path.splitext(path)[1]
+    if extension in const.DOC_EXTENSIONS:
+        return _is_identifier(read_identifier(path).description)
+
+    fields = os.path.basename(os.path.splitext(path)[0]).split('_', maxsplit=5)
+    if len(fields) != 5 or not all(_is_hex(field) for field in fields[1:]):
+        return False
+
+    return _is_identifier(fields[0])
+
+
+def _existing_only(transform: Callable[[bytes], bytes]) -> Callable[[Optional[bytes]], Optional[bytes]]:
+    return lambda content: None if content is None else transform(content)
+
+
+def _is_identifier(text: Optional[str]) -> bool:
+    if not text:
+        return False
+
+    try:
+        utils.decode_base64_id(text)
+    except (ValueError, UnicodeDecodeError):
+        return False
+
+    return True
+
+
+def _is_hex(text: str) -> bool:
+    try:
+        int(text, 16)
+    except ValueError:
+        return False
+
+    return True
@@ -0,0 +1,124 @@
+# Copyright 2022 aaaaaaaalesha
+
+import asyncio
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import AsyncIterator, Iterable, Iterator, List
+
+from src.identifier.checker import CompareResult, ComparisonSession
+
+# Number of paths taken from the walking iterator by one executor call.
+WALK_BATCH = 256
+
+
+async def compare_paths(session: ComparisonSession, paths: Iterable[str], jobs: int = 1,
+                        queue_size: int = 1024) -> AsyncIterator[CompareResult]:
+    """
+    Compares session target with candidates in three overlapping stages connected by bounded queues:
+    walking paths, parsing candidates' identifiers by jobs concurrent workers and scoring them one by one.
+    Every blocking call runs in an executor, so slow filesystems (e.g. network shares) don't stall other stages.
+    Walking waits while queues are full, so memory usage doesn't depend on the number of candidates.
+    :param session: comparison session with parsed target
+    :param paths: iterator over candidates' paths, it is advanced in a separate thread
+    :param jobs: number of concurrent parsing workers
+    :param queue_size: capacity of each queue between stages
+    :return: async iterator over compare results in order of their completion
+    """
+    loop = asyncio.get_running_loop()
+    walk_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='compare-walk')
+    parse_executor = ThreadPoolExecutor(max_workers=jobs, thread_name_prefix='compare-parse')
+    # Single scoring thread writes results file sequentially.
+    score_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='compare-score')
+
+    path_queue = asyncio.Queue(maxsize=queue_size)
+    parsed_queue = asyncio.Queue(maxsize=queue_size)
+    tasks = []
+    try:
+        tasks.append(loop.create_task(_walk(paths, path_queue, walk_executor, jobs)))
+        for _ in range(jobs):
+            tasks.append(loop.create_task(_parse(session, path_queue, parsed_queue, parse_executor)))
+
+        finished = 0
+        while finished < jobs:
+            item = await parsed_queue.get()
+            if item is None:
+                finished += 1
+                continue
+
+            path, fields, error = item
+            if error is None:
+                try:
+                    table = await loop.run_in_executor(score_executor, session.score, fields)
+                except Exception as err:
+                    error = str(err)
+                else:
+                    yield CompareResult(path, table)
+                    continue
+
+            yield CompareResult(path, error=error)
+
+        # Re-raises walking failure, if any.
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        for executor in (walk_executor, parse_executor, score_executor):
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def _walk(paths: Iterable[str], path_queue: asyncio.Queue, executor: Executor, workers: int) -> None:
+    """
+    Puts paths to queue, advancing paths iterator in executor batch by batch.
+    Finally puts stop marker for each parsing worker.
+    """
+    loop = asyncio.get_running_loop()
+    error = None
+    try:
+        iterator = iter(paths)
+        while True:
+            batch = await loop.run_in_executor(executor, _next_batch, iterator)
+            if not batch:
+                break
+
+            for path in batch:
+                await path_queue.put(path)
+    except Exception as err:
+        error = err
+
+    for _ in range(workers):
+        await path_queue.put(None)
+
+    if error is not None:
+        raise error
+
+
+async def _parse(session: ComparisonSession, path_queue: asyncio.Queue, parsed_queue: asyncio.Queue,
+                 executor: Executor) -> None:
+    """
+    Parses identifiers of candidates from path_queue in executor and puts them to parsed_queue
+    as (path, fields, error) items. Puts stop marker when path_queue is exhausted.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        path = await path_queue.get()
+        if path is None:
+            await parsed_queue.put(None)
+            return
+
+        try:
+            fields = await loop.run_in_executor(executor, session.parse, path)
+        except Exception as err:
+            await parsed_queue.put((path, None, str(err)))
+        else:
+            await parsed_queue.put((path, fields, None))
+
+
+def _next_batch(iterator: Iterator[str]) -> List[str]:
+    batch = []
+    for path in iterator:
+        batch.append(path)
+        if len(batch) == WALK_BATCH:
+            break
+
+    return batch
@@ -0,0 +1,412 @@
+# Copyright 2022 aaaaaaaalesha
+
+import html
+import re
+from functools import lru_cache
+from typing import BinaryIO, NamedTuple, Optional, Tuple, Union
+
+import src.constants as const
+from src.utils import read_zip_member, read_zip_members
+
+_NAMESPACE_DECLARATION = re.compile(r'\sxmlns:([\w.-]+)\s*=\s*(["\'])(.*?)\2', re.S)
+_DEFAULT_NAMESPACE_DECLARATION = re.compile(r'\sxmlns\s*=\s*(["\'])(.*?)\1', re.S)
+_ENCODING_DECLARATION = re.compile(rb'^\s*<\?xml[^>]*\bencoding\s*=\s*["\']([\w.-]+)', re.I)
+_NAME_ATTRIBUTE = re.compile(r'\sname\s*=\s*(["\'])(.*?)\1', re.S)
+
+# docProps/custom.xml of document without user-defined properties.
+_EMPTY_CUSTOM_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\r\n'
+    f'<Properties xmlns="{const.CUSTOM_NAMESPACE}" xmlns:vt="{const.VT_NAMESPACE}"/>'
+).encode('utf-8')
+
+
+class CoreProperties:
+    """
+    Class implements in-memory model of docProps/core.xml of .docx/.xlsx document.
+    Content is parsed once, edited through properties and serialized once.
+    lxml is imported on first use: identifiers are usually read by read_identifier() without parsing.
+    """
+
+    def __init__(self, core_xml: bytes):
+        from lxml import etree
+
+        self.__tree = etree.ElementTree(etree.fromstring(core_xml, _parser()))
+        self.__root = self.__tree.getroot()
+
+    @classmethod
+    def from_document(cls, source: Union[str, BinaryIO]) -> 'CoreProperties':
+        """
+        Reads core properties of document, only docProps/core.xml member is inflated.
+        :param source: path to .docx/.xlsx document or seekable binary file object
+        :return: parsed core properties
+        """
+        return cls(read_zip_member(source, const.CORE))
+
+    @property
+    def creator(self) -> Optional[str]:
+        return self.__get(const.DOC_CREATOR_TAG)
+
+    @property
+    def created(self) -> Optional[str]:
+        return self.__get(const.DOC_DT_CREATED)
+
+    @property
+    def modified(self) -> Optional[str]:
+        return self.__get(const.DOC_DT_MODIFIED)
+
+    @property
+    def keywords(self) -> Optional[str]:
+        return self.__get(const.DOC_CP_KEYWORDS)
+
+    @keywords.setter
+    def keywords(self, value: str) -> None:
+        self.__set(const.DOC_CP_KEYWORDS, value)
+
+    @property
+    def description(self) -> Optional[str]:
+        return self.__get(const.DOC_DC_DESCRIPTION)
+
+    @description.setter
+    def description(self, value: str) -> None:
+        self.__set(const.DOC_DC_DESCRIPTION, value)
+
+    def serialize(self) -> bytes:
+        """
+        Serializes core properties back to docProps/core.xml content.
+        :return: xml bytes
+        """
+        return _serialize(self.__tree)
+
+    def __get(self, name: str) -> Optional[str]:
+        """
+        Returns text of property tag, None if tag doesn't exist or contains anything but text.
+        :param name: prefixed name of tag, e.g. 'dc:creator'
+        :return: text of tag or None
+        """
+        element = self.__root.find(_clark(name))
+        if element is None or len(element):
+            return None
+
+        return element.text
+
+    def __set(self, name: str, value: str) -> None:
+        """
+        Sets text of property tag, appending the tag if it doesn't exist.
+        :param name: prefixed name of tag, e.g. 'dc:creator'
+        :param value: new text of tag
+        :return: None
+        """
+        from lxml import etree
+
+        element = self.__root.find(_clark(name))
+        if element is None:
+            prefix = name.split(':', 1)[0]
+            element = etree.SubElement(self.__root, _clark(name), nsmap={prefix: const.CORE_NAMESPACES[prefix]})
+        else:
+            for child in list(element):
+                element.remove(child)
+
+        element.text = value
+
+
+class CustomProperties:
+    """
+    Class implements in-memory model of docProps/custom.xml of .docx/.xlsx document – user-defined properties,
+    which are kept by Office applications as is. Only text (vt:lpwstr) properties are read and written.
+    """
+
+    def __init__(self, custom_xml: Optional[bytes] = None):
+        """
+        :param custom_xml: docProps/custom.xml content, None – document has no user-defined properties yet
+        """
+        from lxml import etree
+
+        self.__tree = etree.ElementTree(etree.fromstring(custom_xml or _EMPTY_CUSTOM_XML, _parser()))
+        self.__root = self.__tree.getroot()
+
+    def get(self, name: str) -> Optional[str]:
+        """
+        Returns text value of property, None if there is no such text property.
+        :param name: property name
+        :return: text of property or None
+        """
+        element = self.__find(name)
+        if element is None:
+            return None
+
+        value = element.find(f'{{{const.VT_NAMESPACE}}}lpwstr')
+        if value is None or len(value):
+            return None
+
+        return value.text
+
+    def set(self, name: str, value: str) -> None:
+        """
+        Sets text value of property, appending the property if it doesn't exist.
+        :param name: property name
+        :param value: new text of property
+        :return: None
+        """
+        from lxml import etree
+
+        element = self.__find(name)
+        if element is None:
+            # Identifiers of properties start from 2, the lower ones are reserved.
+            pids = [int(pid) for pid in self.__root.xpath('./*/@pid') if pid.isdigit()]
+            element = etree.SubElement(self.__root, f'{{{const.CUSTOM_NAMESPACE}}}property', {
+                'fmtid': const.CUSTOM_FMTID,
+                'pid': str(max(pids, default=1) + 1),
+                'name': name,
+            })
+        else:
+            for child in list(element):
+                element.remove(child)
+
+        etree.SubElement(element, f'{{{const.VT_NAMESPACE}}}lpwstr', nsmap={'vt': const.VT_NAMESPACE}).text = value
+
+    def serialize(self) -> bytes:
+        """
+        Serializes user-defined properties back to docProps/custom.xml content.
+        :return: xml bytes
+        """
+        return _serialize(self.__tree)
+
+    def __find(self, name: str):
+        for element in self.__root.iterfind(f'{{{const.CUSTOM_NAMESPACE}}}property'):
+            if element.get('name') == name:
+                return element
+
+        return None
+
+
+def declare_custom_properties(content_types_xml: bytes) -> bytes:
+    """
+    Declares content type of docProps/custom.xml in [Content_Types].xml content, unless it's already declared.
+    :param content_types_xml: [Content_Types].xml content
+    :return: new [Content_Types].xml content
+    """
+    from lxml import etree
+
+    tree = etree.ElementTree(etree.fromstring(content_types_xml, _parser()))
+    part_name = f'/{const.CUSTOM}'
+    overrides = tree.getroot().iterfind(f'{{{const.CONTENT_TYPES_NAMESPACE}}}Override')
+    if not any(override.get('PartName', '').lower() == part_name.lower() for override in overrides):
+        etree.SubElement(tree.getroot(), f'{{{const.CONTENT_TYPES_NAMESPACE}}}Override', {
+            'PartName': part_name,
+            'ContentType': const.CUSTOM_CONTENT_TYPE,
+        })
+
+    return _serialize(tree)
+
+
+def relate_custom_properties(rels_xml: bytes) -> bytes:
+    """
+    Adds relationship of package with docProps/custom.xml to _rels/.rels content, unless it's already there.
+    :param rels_xml: _rels/.rels content
+    :return: new _rels/.rels content
+    """
+    from lxml import etree
+
+    tree = etree.ElementTree(etree.fromstring(rels_xml, _parser()))
+    relationships = list(tree.getroot().iterfind(f'{{{const.RELATIONSHIPS_NAMESPACE}}}Relationship'))
+    if not any(relationship.get('Type') == const.CUSTOM_RELATIONSHIP for relationship in relationships):
+        ids = {relationship.get('Id') for relationship in relationships}
+        number = len(ids) + 1
+        while f'rId{number}' in ids:
+            number += 1
+
+        etree.SubElement(tree.getroot(), f'{{{const.RELATIONSHIPS_NAMESPACE}}}Relationship', {
+            'Id': f'rId{number}',
+            'Type': const.CUSTOM_RELATIONSHIP,
+            'Target': const.CUSTOM,
+        })
+
+    return _serialize(tree)
+
+
+class IdentifierFields(NamedTuple):
+    """
+    Properties holding identifier of marked document.
+    """
+    description: Optional[str]
+    keywords: Optional[str]
+    # MinHash signature of document content, absent in documents marked before it was introduced.
+    minhash: Optional[str]
+
+
+def read_identifier(source: Union[str, BinaryIO]) -> IdentifierFields:
+    """
+    Reads <dc:description>, <cp:keywords> and MinHash signature user-defined property of document as fast as
+    possible: only the end of central directory, central directory, docProps/core.xml and docProps/custom.xml are
+    read from the archive, and both parts are scanned by regular expressions. Unusual markup (CDATA, nested tags,
+    other encodings) is parsed by CoreProperties and CustomProperties instead, values are the same as theirs.
+    :param source: path to .docx/.xlsx document or seekable binary file object, e.g. range-reading remote file
+    :return: identifier fields
+    """
+    members = read_zip_members(source, (const.CORE, const.CUSTOM))
+    if const.CORE not in members:
+        raise KeyError(f'There is no item named {const.CORE!r} in the archive')
+
+    core_xml = members[const.CORE]
+    core_fields = _scan_core(core_xml)
+    if core_fields is None:
+        core = CoreProperties(core_xml)
+        core_fields = core.description, core.keywords
+
+    minhash = None
+    custom_xml = members.get(const.CUSTOM)
+    if custom_xml is not None:
+        minhash = _scan_custom_property(custom_xml, const.DOC_MINHASH_PROPERTY)
+        if minhash is False:
+            minhash = CustomProperties(custom_xml).get(const.DOC_MINHASH_PROPERTY)
+
+    return IdentifierFields(*core_fields, minhash)
+
+
+def _scan_core(core_xml: bytes) -> Optional[Tuple[Optional[str], Optional[str]]]:
+    """
+    Finds <dc:description> and <cp:keywords> in core.xml content by regular expressions.
+    :return: texts of both tags, None if markup is too unusual to be scanned
+    """
+    text = _decode(core_xml)
+    if text is None:
+        return None
+
+    namespaces = {}
+    for prefix, _, namespace in _NAMESPACE_DECLARATION.findall(text):
+        if namespaces.setdefault(prefix, namespace) != namespace:
+            return None
+
+    values = []
+    for name in (const.DOC_DC_DESCRIPTION, const.DOC_CP_KEYWORDS):
+        value = _scan_property(text, name, namespaces)
+        if value is False:
+            return None
+        values.append(value)
+
+    return values[0], values[1]
+
+
+def _scan_custom_property(custom_xml: bytes, name: str):
+    """
+    Finds text value of user-defined property in custom.xml content by regular expressions. Office applications
+    write it with default namespace of custom properties and prefixed vt:lpwstr tag.
+    :return: text of property, None if there is no such text property, False if it can't be scanned
+    """
+    text = _decode(custom_xml)
+    if text is None:
+        return False
+
+    defaults = _DEFAULT_NAMESPACE_DECLARATION.findall(text)
+    if not defaults or any(namespace != const.CUSTOM_NAMESPACE for _, namespace in defaults):
+        return False
+
+    namespaces = {}
+    for prefix, _, namespace in _NAMESPACE_DECLARATION.findall(text):
+        if namespaces.setdefault(prefix, namespace) != namespace or namespace == const.CUSTOM_NAMESPACE:
+            return False
+
+    # Properties with prefixed tags aren't resolved here.
+    if re.search(r'<[\w.-]+:property[\s/>]', text):
+        return False
+
+    for start in re.finditer(r'<property(\s[^>]*)?(/?)>', text):
+        attribute = _NAME_ATTRIBUTE.search(start.group(1) or '')
+        if attribute is None or html.unescape(attribute.group(2)) != name:
+            continue
+        if start.group(2):
+            return None
+
+        end = text.find('</property>', start.end())
+        if end < 0:
+            return False
+
+        value = re.fullmatch(r'\s*<([\w.-]+):lpwstr\s*>([^<]*)</\1:lpwstr\s*>\s*', text[start.end():end])
+        if value is None or namespaces.get(value.group(1)) != const.VT_NAMESPACE:
+            return False
+
+        value = value.group(2).replace('\r\n', '\n').replace('\r', '\n')
+        return html.unescape(value) if '&' in value else value or None
+
+    return None
+
+
+def _decode(xml: bytes) -> Optional[str]:
+    """
+    Decodes xml content for scanning.
+    :return: text, None if it isn't UTF-8
+    """
+    declared = _ENCODING_DECLARATION.match(xml)
+    if declared is not None and declared.group(1).lower() not in (b'utf-8', b'utf8'):
+        return None
+
+    try:
+        return xml.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        return None
+
+
+def _scan_property(text: str, name: str, namespaces: dict):
+    """
+    Finds text of property tag by its local name and namespace.
+    :return: text of tag, None if there is no such tag or it's empty, False if it can't be scanned
+    """
+    prefix, local_name = name.split(':', 1)
+    namespace = const.CORE_NAMESPACES[prefix]
+
+    # Tags with default namespace aren't resolved here.
+    if re.search(fr'<{local_name}[\s/>]', text):
+        return False
+
+    found = [match for match in re.finditer(fr'<([\w.-]+):{local_name}(\s[^>]*)?(/?)>', text)
+             if namespaces.get(match.group(1)) == namespace]
+    if not found:
+        return None
+    if len(found) > 1:
+        return False
+
+    start = found[0]
+    if start.group(3):
+        return None
+
+    end = re.compile(fr'</{re.escape(start.group(1))}:{local_name}\s*>').search(text, start.end())
+    if end is None:
+        return False
+
+    value = text[start.end():end.start()]
+    if '<' in value:
+        return False
+
+    # Line endings are normalized by XML parsers.
+    value = value.replace('\r\n', '\n').replace('\r', '\n')
+    return html.unescape(value) if '&' in value else value or None
+
+
+def _serialize(tree) -> bytes:
+    """
+    Serializes document part back to xml content.
+    """
+    from lxml import etree
+
+    # Declaration is written by hand: lxml quotes it with apostrophes unlike Office applications.
+    standalone = tree.docinfo.standalone
+    declaration = '<?xml version="1.0" encoding="UTF-8"{}?>\r\n'.format(
+        '' if standalone is None else f' standalone="{"yes" if standalone else "no"}"'
+    )
+
+    return declaration.encode('utf-8') + etree.tostring(tree.getroot(), encoding='UTF-8', xml_declaration=False)
+
+
+@lru_cache(maxsize=None)
+def _parser():
+    from lxml import etree
+
+    return etree.XMLParser(recover=True, resolve_entities=False)
+
+
+def _clark(name: str) -> str:
+    """
+    Converts prefixed name of core properties tag to {namespace}name notation.
+    """
+    prefix, local_name = name.split(':', 1)
+    return f'{{{const.CORE_NAMESPACES[prefix]}}}{local_name}'
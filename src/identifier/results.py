@@ -1,60 +1,264 @@
 # Copyright 2022 aaaaaaaalesha
 
 import csv
+import json
 import os.path
+import threading
+from abc import ABC, abstractmethod
 from datetime import datetime
-from typing import Tuple
+from typing import Dict, List, Optional, Tuple
 
 import src.constants as const
+from src.minhash import compare as minhash_cmp
 from src.ssdeep import compare as ssdeep_cmp
-from src.utils import get_file_sha3
+from src.utils import get_file_sha3, temporary_path
 
+RESULTS_EXTENSIONS = ('.csv', '.jsonl', '.parquet')
 
-def write_compare_results(data: Tuple[dict, dict], to_file: str, lhs: str) -> None:
-    extension = os.path.splitext(lhs)[1]
-    if extension in const.DOC_EXTENSIONS:
-        _write_document_results(data, to_file, lhs)
-    else:
-        _write_image_results(data, to_file, lhs)
 
+def write_compare_results(data: Tuple[dict, dict], to_file: str, lhs: str, sha3_hash: Optional[str] = None) -> None:
+    """
+    Writes single compare result to file. Use ResultsSink for writing many results: the result is appended
+    to existing file, and .parquet file has to be rewritten for that.
+    :param data: parsed identifiers of compared files
+    :param to_file: path to results file
+    :param lhs: path to first compared file
+    :param sha3_hash: SHA3-hash of first file, computed if None
+    :return: None
+    """
+    with ResultsSink(to_file) as sink:
+        sink.write(data, lhs, sha3_hash)
 
-def _write_document_results(data: Tuple[dict, dict], to_file: str, lhs: str) -> None:
+
+class ResultsSink:
+    """
+    Class implements buffered writing of compare results.
+    Output files are kept open and rows are written in batches, header is written once per file.
+    Rows are appended to existing results files, .parquet file is rewritten with them on close.
+    Results of images comparison are written in separate file with ' (img)' suffix, because of their other fields.
+    Format is chosen by extension of results file: .csv, .jsonl (JSON Lines) or .parquet (requires pyarrow).
+    Sink is safe to be fed from several threads.
+    """
+
+    def __init__(self, to_file: str, batch_size: int = 1024):
+        """
+        :param to_file: path to results file
+        :param batch_size: number of rows buffered before writing them to file
+        """
+        extension = os.path.splitext(to_file)[1]
+        if extension not in _WRITERS:
+            raise ValueError(f'Results file should have extension like {", ".join(RESULTS_EXTENSIONS)}. '
+                             f'Not {extension}.')
+
+        self.__to_file = to_file
+        self.__writer_class = _WRITERS[extension]
+        self.__batch_size = batch_size
+        self.__writers: Dict[str, _Writer] = {}
+        self.__pending: Dict[str, List[list]] = {}
+        self.__lock = threading.Lock()
+
+    def write(self, data: Tuple[dict, dict], lhs: str, sha3_hash: Optional[str] = None) -> None:
+        """
+        Buffers compare result row.
+        :param data: parsed identifiers of compared files
+        :param lhs: path to first compared file
+        :param sha3_hash: SHA3-hash of first file, computed if None
+        :return: None
+        """
+        if sha3_hash is None:
+            sha3_hash = get_file_sha3(lhs)
+
+        extension = os.path.splitext(lhs)[1]
+        if extension in const.DOC_EXTENSIONS:
+            to_file, row = self.__to_file, _document_row(data, sha3_hash)
+        else:
+            basename, results_extension = os.path.splitext(self.__to_file)
+            to_file, row = f'{basename} (img){results_extension}', _image_row(data, sha3_hash)
+
+        with self.__lock:
+            if to_file not in self.__writers:
+                self.__writers[to_file] = self.__writer_class(to_file, _field_names(*data))
+                self.__pending[to_file] = []
+
+            pending = self.__pending[to_file]
+            pending.append(row)
+            if len(pending) >= self.__batch_size:
+                self.__writers[to_file].write_rows(pending)
+                pending.clear()
+
+    def flush(self) -> None:
+        """
+        Writes all buffered rows to files.
+        :return: None
+        """
+        with self.__lock:
+            for to_file, pending in self.__pending.items():
+                if pending:
+                    self.__writers[to_file].write_rows(pending)
+                    pending.clear()
+                self.__writers[to_file].flush()
+
+    def close(self) -> None:
+        """
+        Writes all buffered rows and closes files.
+        :return: None
+        """
+        self.flush()
+        with self.__lock:
+            for writer in self.__writers.values():
+                writer.close()
+            self.__writers.clear()
+            self.__pending.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def _document_row(data: Tuple[dict, dict], sha3_hash: str) -> list:
     dict1, dict2 = data[0], data[1]
     current_dt = f"{datetime.now():%d.%m.%Y %H:%M:%S}"
-    sha3_hash = get_file_sha3(lhs)
     fhash1, fhash2 = dict1[const.FUZZY_HASH], dict2[const.FUZZY_HASH]
 
-    new_row = [current_dt] + [val for val in dict1.values()] + [sha3_hash] + \
-              [val for val in dict2.values()] + [f'{ssdeep_cmp(fhash1, fhash2)} %']
+    matching = [f'{ssdeep_cmp(fhash1, fhash2)} %']
+    if const.CONTENT_MINHASH in dict1:
+        minhash1, minhash2 = dict1[const.CONTENT_MINHASH], dict2[const.CONTENT_MINHASH]
+        matching.append(const.NOT_FOUND if const.NOT_FOUND in (minhash1, minhash2) else
+                        f'{minhash_cmp(minhash1, minhash2)} %')
 
-    __write_row(to_file, dict1, dict2, new_row)
+    return [current_dt] + [val for val in dict1.values()] + [sha3_hash] + \
+           [val for val in dict2.values()] + matching
 
 
-def _write_image_results(data: Tuple[dict, dict], to_file: str, lhs: str) -> None:
+def _image_row(data: Tuple[dict, dict], sha3_hash: str) -> list:
     dict1, dict2 = data[0], data[1]
     current_dt = f"{datetime.now():%d.%m.%Y %H:%M:%S}"
-    sha3_hash = get_file_sha3(lhs)
-
-    basename, extension = os.path.splitext(to_file)
-    to_file = f'{basename} (img){extension}'
 
     hash_string_builder = [f'{100 - (dict1[name] - dict2[name])}' for name in dict1.keys() if name.endswith('hash')]
 
-    new_row = [current_dt] + [str(fld) for fld in dict1.values()] + [sha3_hash] + \
-              [str(fld) for fld in dict2.values()] + [' % '.join(hash_string_builder)]
+    return [current_dt] + [str(fld) for fld in dict1.values()] + [sha3_hash] + \
+           [str(fld) for fld in dict2.values()] + [' % '.join(hash_string_builder)]
+
+
+def _field_names(dict1: dict, dict2: dict) -> List[str]:
+    # Documents are matched by fuzzy hash and, besides, by MinHash signature of content.
+    matching = ['Matching', const.CONTENT_SIMILARITY] if const.CONTENT_MINHASH in dict1 else ['Matching']
+
+    return ['DateTime'] + [f'{fld} 1' for fld in dict1.keys()] + ['SHA3-hash'] + \
+           [f'{fld} 2' for fld in dict2.keys()] + matching
+
+
+class _Writer(ABC):
+    """
+    Base class of results file writers.
+    """
+
+    def __init__(self, path: str, field_names: List[str]):
+        self.path = path
+        self.field_names = field_names
+
+    @abstractmethod
+    def write_rows(self, rows: List[list]) -> None:
+        pass
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class _CsvWriter(_Writer):
+    """
+    Appends rows to .csv file, header is written only in new or empty file.
+    Existing file should have the same header, otherwise columns of appended rows wouldn't match it.
+    """
+
+    def __init__(self, path: str, field_names: List[str]):
+        super().__init__(path, field_names)
+        is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+        if not is_new:
+            with open(path, encoding='utf-8', newline='') as file:
+                if next(csv.reader(file), None) != field_names:
+                    raise ValueError(f'Results file {path} has other columns, results can\'t be appended to it.')
+
+        self.__file = open(path, 'a', encoding='utf-8', newline='')
+        self.__writer = csv.writer(self.__file)
+        if is_new:
+            self.__writer.writerow(field_names)
+
+    def write_rows(self, rows: List[list]) -> None:
+        self.__writer.writerows(rows)
+
+    def flush(self) -> None:
+        self.__file.flush()
+
+    def close(self) -> None:
+        self.__file.close()
+
+
+class _JsonLinesWriter(_Writer):
+    """
+    Appends rows to .jsonl file as JSON objects, one per line.
+    """
+
+    def __init__(self, path: str, field_names: List[str]):
+        super().__init__(path, field_names)
+        self.__file = open(path, 'a', encoding='utf-8')
+
+    def write_rows(self, rows: List[list]) -> None:
+        self.__file.writelines(
+            json.dumps(dict(zip(self.field_names, row)), ensure_ascii=False) + '\n' for row in rows
+        )
+
+    def flush(self) -> None:
+        self.__file.flush()
+
+    def close(self) -> None:
+        self.__file.close()
+
+
+class _ParquetWriter(_Writer):
+    """
+    Writes rows to .parquet file by row groups. Parquet file can't be appended, so rows of existing file are copied
+    to a new one, which replaces it on close.
+    """
+
+    def __init__(self, path: str, field_names: List[str]):
+        super().__init__(path, field_names)
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as err:
+            raise ImportError('Writing results to .parquet file requires pyarrow package.') from err
+
+        self.__pyarrow = pyarrow
+        self.__schema = pyarrow.schema([(name, pyarrow.string()) for name in field_names])
+
+        existing = None
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            existing = pyarrow.parquet.read_table(path)
+            if existing.schema.names != field_names:
+                raise ValueError(f'Results file {path} has other columns, results can\'t be appended to it.')
+
+        self.__tmp_path = temporary_path(path)
+        self.__writer = pyarrow.parquet.ParquetWriter(self.__tmp_path, self.__schema)
+        if existing is not None:
+            self.__writer.write_table(existing.cast(self.__schema))
+
+    def write_rows(self, rows: List[list]) -> None:
+        columns = [[str(value) for value in column] for column in zip(*rows)]
+        self.__writer.write_table(self.__pyarrow.Table.from_arrays(columns, schema=self.__schema))
 
-    __write_row(to_file, dict1, dict2, new_row)
+    def close(self) -> None:
+        self.__writer.close()
+        os.replace(self.__tmp_path, self.path)
 
 
-def __write_row(to_file: str, dict1: dict, dict2: dict, new_row: list) -> None:
-    if not os.path.exists(to_file):
-        with open(to_file, 'w', encoding='utf-8') as file:
-            field_names = ['DateTime'] + [f'{fld} 1' for fld in dict1.keys()] + ['SHA3-hash'] + \
-                          [f'{fld} 2' for fld in dict2.keys()] + ['Matching']
-            writer = csv.writer(file)
-            writer.writerow(field_names)
-            writer.writerow(new_row)
-    elif os.path.splitext(to_file)[1] == '.csv':
-        with open(to_file, 'a', encoding='utf-8') as file:
-            writer = csv.writer(file)
-            writer.writerow(new_row)
+_WRITERS = {
+    '.csv': _CsvWriter,
+    '.jsonl': _JsonLinesWriter,
+    '.parquet': _ParquetWriter,
+}
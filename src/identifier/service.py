@@ -0,0 +1,531 @@
+# Copyright 2022 aaaaaaaalesha
+
+"""
+Long-running checker service: fuzzy hashing backend, parsers, fingerprint cache and index stay loaded
+between requests, so callers checking many files don't pay for process startup on each of them.
+
+Requests are read from Unix domain socket as JSON Lines, one object per line:
+    {"id": 1, "op": "compare", "args": {"file1": "a.docx", "file2": "b.docx"}}
+Each request gets a single line response with the same id, responses to pipelined requests of one connection
+come in order of completion:
+    {"id": 1, "ok": true, "result": {"table": "..."}}
+    {"id": 1, "ok": false, "error": "File a.docx has no identifier."}
+
+Operations:
+- ping – service information;
+- inject {path, out_dir} – injects identifier like -i does, adds marked file to index if service has one;
+- compare {file1, file2, to_file} – compares identifiers like -c does, to_file is optional results file;
+- lookup {path, top_k} – finds indexed marked files most similar to passed file;
+- excerpt {path, top_k} – finds indexed marked documents containing text of passed file;
+- index {path} – adds already marked file to index;
+- stats – queue depth, number of handled requests and collected metrics.
+"""
+
+import asyncio
+import contextlib
+import importlib
+import inspect
+import json
+import os
+import signal
+import socket
+import stat
+import threading
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Callable, Dict, NamedTuple, Optional, Set
+
+import src.metrics as metrics
+import src.ssdeep as ssdeep
+from src.identifier import batch, checker
+from src.identifier.cache import FingerprintCache
+from src.identifier.results import ResultsSink
+
+DEFAULT_JOBS = 4
+DEFAULT_MAX_QUEUE = 1024
+DEFAULT_TOP_K = 10
+# Seconds between flushes of buffered compare results to their files.
+RESULTS_FLUSH_INTERVAL = 1.0
+# Longer request lines are rejected.
+MAX_LINE = 1 << 20
+# Modules imported lazily by CLI commands, the service loads them before accepting requests.
+WARM_MODULES = ('src.extractor', 'src.imaging', 'lxml.etree', 'imagehash')
+
+
+class ServiceError(Exception):
+    pass
+
+
+class ServiceStats(NamedTuple):
+    """
+    Current load of service.
+    """
+    queued: int
+    in_flight: int
+    handled: int
+    failed: int
+
+
+class CheckerService:
+    """
+    Class implements checker service listening on Unix domain socket.
+    Injection and comparison run concurrently in a pool of jobs worker threads, each of them with its own
+    connection to fingerprint cache. Index queries and updates and writing of results files run one by one
+    in a dedicated thread, so the in-memory index is built once and results files are never written concurrently.
+    Results files stay open until the service stops, their buffered rows are flushed every RESULTS_FLUSH_INTERVAL
+    seconds; .parquet file can't be appended, so it is replaced with written rows only when the service stops.
+    Requests exceeding max_queue waiting ones are rejected, so overloaded service answers at once.
+    """
+
+    def __init__(self, socket_path: str, jobs: int = DEFAULT_JOBS, index_path: Optional[str] = None,
+                 cache_path: Optional[str] = None, max_queue: int = DEFAULT_MAX_QUEUE, socket_mode: int = 0o600):
+        """
+        :param socket_path: path of Unix domain socket
+        :param jobs: number of worker threads
+        :param index_path: path to fingerprint index database, lookup and index operations fail if None
+        :param cache_path: path to fingerprint cache database, files aren't cached if None
+        :param max_queue: maximal number of requests waiting for worker
+        :param socket_mode: permissions of socket file
+        """
+        self.__socket_path = socket_path
+        self.__jobs = jobs
+        self.__index_path = index_path
+        self.__cache_path = cache_path
+        self.__max_queue = max_queue
+        self.__socket_mode = socket_mode
+
+        self.__handlers = {
+            'ping': self.__ping,
+            'inject': self.__inject,
+            'compare': self.__compare,
+            'lookup': self.__lookup,
+            'excerpt': self.__excerpt,
+            'index': self.__add_to_index,
+            'stats': self.__stats,
+        }
+
+        self.__lock = threading.Lock()
+        self.__queued = self.__in_flight = self.__handled = self.__failed = 0
+        self.__local = threading.local()
+        self.__index = None
+        # Absolute path of results file -> its sink, used by the serial thread only.
+        self.__sinks: Dict[str, ResultsSink] = {}
+        self.__pool: Optional[Executor] = None
+        self.__serial: Optional[Executor] = None
+        self.__loop: Optional[asyncio.AbstractEventLoop] = None
+        self.__stop: Optional[asyncio.Event] = None
+        self.__ready = threading.Event()
+
+        # Latencies and queue depth are always collected in registry of the service, they are reported by stats
+        # operation. Global instrumentation is left to the embedder, e.g. enabled by -m of CLI.
+        self.__metrics = metrics.Registry()
+
+    @property
+    def stats(self) -> ServiceStats:
+        with self.__lock:
+            return ServiceStats(self.__queued, self.__in_flight, self.__handled, self.__failed)
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        """
+        Waits until service accepts connections.
+        :param timeout: timeout in seconds, None – wait forever
+        :return: True if service is ready
+        """
+        return self.__ready.wait(timeout)
+
+    def run(self) -> None:
+        """
+        Serves requests in the main thread until SIGINT or SIGTERM is received.
+        :return: None
+        """
+        asyncio.run(self.__run_until_signal())
+
+    def stop(self) -> None:
+        """
+        Stops serving, safe to call from any thread.
+        :return: None
+        """
+        if self.__loop is not None:
+            self.__loop.call_soon_threadsafe(self.__stop.set)
+
+    async def serve(self) -> None:
+        """
+        Serves requests until stop() is called.
+        :return: None
+        """
+        self.__loop = asyncio.get_running_loop()
+        self.__stop = asyncio.Event()
+
+        for name in WARM_MODULES:
+            importlib.import_module(name)
+        ssdeep.get_backend()
+
+        self.__pool = ThreadPoolExecutor(max_workers=self.__jobs, thread_name_prefix='service-worker')
+        self.__serial = ThreadPoolExecutor(max_workers=1, thread_name_prefix='service-serial')
+        server = None
+        flusher = None
+        try:
+            if self.__index_path is not None:
+                from src.identifier.index import FingerprintIndex
+
+                # Fuzzy hashes are kept in memory, the service answers many lookups.
+                self.__index = await self.__loop.run_in_executor(
+                    self.__serial, lambda: FingerprintIndex(self.__index_path, in_memory=True))
+
+            self.__remove_stale_socket()
+            server = await asyncio.start_unix_server(self.__serve_connection, path=self.__socket_path,
+                                                     limit=MAX_LINE)
+            os.chmod(self.__socket_path, self.__socket_mode)
+
+            async with server:
+                flusher = asyncio.create_task(self.__flush_results_periodically())
+                self.__ready.set()
+                await self.__stop.wait()
+        finally:
+            self.__ready.clear()
+            if flusher is not None:
+                flusher.cancel()
+            try:
+                await self.__loop.run_in_executor(self.__serial, self.__close_results)
+            finally:
+                if self.__index is not None:
+                    await self.__loop.run_in_executor(self.__serial, self.__index.close)
+                    self.__index = None
+
+                # Connections to cache opened by workers are closed when their threads finish.
+                self.__pool.shutdown(cancel_futures=True)
+                self.__serial.shutdown(cancel_futures=True)
+                # Metrics of the service are written with the global ones if instrumentation is enabled.
+                metrics.merge(self.__metrics.snapshot(reset=True))
+                if server is not None and os.path.exists(self.__socket_path):
+                    os.remove(self.__socket_path)
+
+    async def __flush_results_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(RESULTS_FLUSH_INTERVAL)
+            try:
+                await self.__loop.run_in_executor(self.__serial, self.__flush_results)
+            except OSError:
+                # Rows stay buffered, they are written by the next flush or on close.
+                pass
+
+    def __write_result(self, data: tuple, to_file: str, lhs: str) -> None:
+        """
+        Buffers compare result in the sink of results file, opening it on first use. Runs in the serial thread.
+        """
+        key = os.path.abspath(to_file)
+        sink = self.__sinks.get(key)
+        if sink is None:
+            sink = self.__sinks[key] = ResultsSink(to_file)
+
+        sink.write(data, lhs)
+
+    def __flush_results(self) -> None:
+        for sink in self.__sinks.values():
+            sink.flush()
+
+    def __close_results(self) -> None:
+        sinks, self.__sinks = self.__sinks, {}
+        # Every sink is closed even if some of them fail.
+        with contextlib.ExitStack() as stack:
+            for sink in sinks.values():
+                stack.push(sink)
+
+    async def __run_until_signal(self) -> None:
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, self.stop)
+
+        await self.serve()
+
+    def __remove_stale_socket(self) -> None:
+        """
+        Removes socket file left by killed service, refuses to replace socket of running one.
+        """
+        if not os.path.exists(self.__socket_path):
+            return
+
+        if not stat.S_ISSOCK(os.stat(self.__socket_path).st_mode):
+            raise FileExistsError(f'{self.__socket_path} exists and is not a socket')
+
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            try:
+                probe.connect(self.__socket_path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                os.remove(self.__socket_path)
+                return
+
+        raise ServiceError(f'Service is already listening on {self.__socket_path}')
+
+    async def __serve_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """
+        Reads requests of connection and handles them concurrently.
+        """
+        write_lock = asyncio.Lock()
+        tasks = set()
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    await self.__write(writer, write_lock, _error(None, f'Request is longer than {MAX_LINE} bytes'))
+                    break
+
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+
+                task = asyncio.create_task(self.__respond(line, writer, write_lock))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+            await asyncio.gather(*tasks, return_exceptions=True)
+        except ConnectionError:
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+    async def __respond(self, line: bytes, writer: asyncio.StreamWriter, write_lock: asyncio.Lock) -> None:
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError('request should be an object')
+        except ValueError as err:
+            await self.__write(writer, write_lock, _error(None, f'Invalid request: {err}'))
+            return
+
+        await self.__write(writer, write_lock, await self.__handle(request))
+
+    async def __write(self, writer: asyncio.StreamWriter, write_lock: asyncio.Lock, response: dict) -> None:
+        async with write_lock:
+            writer.write(json.dumps(response, ensure_ascii=False).encode('utf-8') + b'\n')
+            await writer.drain()
+
+    async def __handle(self, request: dict) -> dict:
+        """
+        Runs requested operation, catching any failure into error response.
+        :param request: request object
+        :return: response object
+        """
+        id_, op = request.get('id'), request.get('op')
+        handler = self.__handlers.get(op) if isinstance(op, str) else None
+        if handler is None:
+            self.__count_handled(failed=True)
+            return _error(id_, f'Unknown operation {op}, expected one of {", ".join(self.__handlers)}')
+
+        args = request.get('args') or {}
+        started = time.perf_counter()
+        try:
+            if not isinstance(args, dict):
+                raise ServiceError('args should be an object')
+            try:
+                inspect.signature(handler).bind(**args)
+            except TypeError as err:
+                raise ServiceError(f'Invalid arguments of {op}: {err}') from None
+
+            result = await handler(**args)
+        except Exception as err:
+            self.__count_handled(failed=True)
+            return _error(id_, str(err) if isinstance(err, (ServiceError, checker.NoIdentifierException))
+                          else f'{type(err).__name__}: {err}')
+        finally:
+            self.__metrics.observe(f'service.{op}', time.perf_counter() - started)
+
+        self.__count_handled(failed=False)
+        return {'id': id_, 'ok': True, 'result': result}
+
+    async def __submit(self, executor: Executor, function: Callable, *args):
+        """
+        Runs function in executor, keeping track of waiting and running requests.
+        :raises ServiceError: if too many requests are waiting
+        """
+        with self.__lock:
+            if self.__queued >= self.__max_queue:
+                raise ServiceError(f'Service is busy: {self.__queued} requests are waiting')
+            self.__queued += 1
+            self.__update_gauges()
+
+        return await self.__loop.run_in_executor(executor, self.__run_job, function, args, time.perf_counter())
+
+    def __run_job(self, function: Callable, args: tuple, submitted: float):
+        self.__metrics.observe('service.queue_wait', time.perf_counter() - submitted)
+        with self.__lock:
+            self.__queued -= 1
+            self.__in_flight += 1
+            self.__update_gauges()
+
+        try:
+            return function(*args)
+        finally:
+            with self.__lock:
+                self.__in_flight -= 1
+                self.__update_gauges()
+
+    def __update_gauges(self) -> None:
+        self.__metrics.gauge('service_queue_depth', self.__queued)
+        self.__metrics.gauge('service_in_flight', self.__in_flight)
+
+    def __count_handled(self, failed: bool) -> None:
+        with self.__lock:
+            self.__handled += 1
+            self.__failed += failed
+
+        self.__metrics.count('service_requests')
+        if failed:
+            self.__metrics.count('service_errors')
+
+    def __worker_cache(self) -> Optional[FingerprintCache]:
+        """
+        Returns fingerprint cache of current worker thread, opening it on first use.
+        """
+        if self.__cache_path is None:
+            return None
+
+        cache = getattr(self.__local, 'cache', None)
+        if cache is None:
+            cache = self.__local.cache = FingerprintCache(self.__cache_path)
+
+        return cache
+
+    def __require_index(self):
+        if self.__index is None:
+            raise ServiceError('Service has no fingerprint index, start it with -db (--index_db)')
+
+        return self.__index
+
+    async def __ping(self) -> dict:
+        return {
+            'pid': os.getpid(),
+            'jobs': self.__jobs,
+            'ssdeep_backend': ssdeep.get_backend(),
+            'index': self.__index is not None,
+            'cache': self.__cache_path is not None,
+        }
+
+    async def __inject(self, path: str, out_dir: str) -> dict:
+        with_fingerprints = self.__index is not None
+        result = await self.__submit(
+            self.__pool, lambda: batch.inject_file(path, out_dir, self.__worker_cache(), with_fingerprints))
+        if not result.ok:
+            raise ServiceError(result.error)
+
+        if self.__index is not None:
+            await self.__index_file(result.out_path, result.fingerprints)
+
+        return {'out_path': result.out_path, 'cached': result.cached}
+
+    async def __compare(self, file1: str, file2: str, to_file: Optional[str] = None) -> dict:
+        out1, out2, table = await self.__submit(self.__pool, _identity_check, file1, file2)
+        if to_file is not None:
+            await self.__submit(self.__serial, self.__write_result, (out1, out2), to_file, file1)
+
+        return {'table': table}
+
+    async def __lookup(self, path: str, top_k: int = DEFAULT_TOP_K) -> list:
+        matches = await self.__submit(self.__serial, self.__require_index().query, path, top_k)
+
+        return [{'path': match.path, 'score': match.score} for match in matches]
+
+    async def __excerpt(self, path: str, top_k: int = DEFAULT_TOP_K) -> list:
+        from src.winnowing import file_fingerprints
+
+        index = self.__require_index()
+        # Excerpt is fingerprinted by workers, the serial thread only reads postings.
+        fingerprints = await self.__submit(self.__pool, file_fingerprints, path)
+        matches = await self.__submit(self.__serial, index.search_excerpt, fingerprints, top_k)
+
+        return [{'path': match.path, 'shared': match.shared, 'coverage': match.coverage} for match in matches]
+
+    async def __add_to_index(self, path: str) -> None:
+        await self.__index_file(path)
+
+    async def __index_file(self, path: str, fingerprints: Optional[Set[int]] = None) -> None:
+        from src.identifier.index import parse_entry
+
+        index = self.__require_index()
+        # Parsing and fingerprinting are done by workers, the serial thread only writes them.
+        fields, fingerprints = await self.__submit(self.__pool, parse_entry, path, fingerprints)
+        await self.__submit(self.__serial, index.add_fields, path, fields, fingerprints)
+
+    async def __stats(self) -> dict:
+        # Stages of injection and comparison are measured only if global instrumentation is enabled.
+        registry = metrics.Registry()
+        registry.merge(self.__metrics.snapshot())
+        if metrics.enabled():
+            registry.merge(metrics.registry().snapshot())
+
+        return {**self.stats._asdict(), 'metrics': registry.summary()}
+
+
+class ServiceClient:
+    """
+    Class implements blocking client of checker service, requests are sent one by one.
+    """
+
+    def __init__(self, socket_path: str, timeout: Optional[float] = None):
+        """
+        :param socket_path: path of service Unix domain socket
+        :param timeout: timeout of socket operations in seconds, None – no timeout
+        """
+        self.__socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.__socket.settimeout(timeout)
+        try:
+            self.__socket.connect(socket_path)
+        except OSError:
+            self.__socket.close()
+            raise
+        self.__file = self.__socket.makefile('rwb')
+        self.__last_id = 0
+
+    def call(self, op: str, **args):
+        """
+        Sends request and waits for its response.
+        :param op: operation name
+        :param args: operation arguments
+        :return: operation result
+        :raises ServiceError: if operation failed
+        """
+        self.__last_id += 1
+        request = {'id': self.__last_id, 'op': op, 'args': args}
+        self.__file.write(json.dumps(request, ensure_ascii=False).encode('utf-8') + b'\n')
+        self.__file.flush()
+
+        line = self.__file.readline()
+        if not line:
+            raise ConnectionError('Service closed connection')
+
+        response = json.loads(line)
+        if not response['ok']:
+            raise ServiceError(response['error'])
+
+        return response['result']
+
+    def close(self) -> None:
+        self.__file.close()
+        self.__socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def _identity_check(file1: str, file2: str) -> tuple:
+    """
+    Compares files like checker.identity_check does, returning parsed identifiers along with table,
+    so results file can be written separately.
+    """
+    with metrics.span('compare.total'):
+        checker.check_comparable(file1, file2)
+        out1 = checker.parse_file_identifier(file1)
+        out2 = checker.parse_file_identifier(file2)
+
+        return out1, out2, checker.identity_table(file1, out1, out2)
+
+
+def _error(id_, message: str) -> dict:
+    return {'id': id_, 'ok': False, 'error': message}
@@ -0,0 +1,396 @@
+# Copyright 2022 aaaaaaaalesha
+
+import ctypes
+import ctypes.util
+import os
+import select
+import signal
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import src.constants as const
+import src.metrics as metrics
+from src.identifier import batch
+from src.identifier.batch import InjectionResult
+from src.identifier.injector import is_injected
+
+# Seconds file should stay quiet after its last event before injection.
+DEFAULT_DEBOUNCE = 1.0
+# Seconds between directories' snapshots of polling watcher.
+DEFAULT_POLL_INTERVAL = 2.0
+# Maximal seconds of waiting for events, so stop request is noticed in time.
+STOP_CHECK_INTERVAL = 0.5
+
+# Constants from <sys/inotify.h>.
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ISDIR = 0x40000000
+_IN_REMOVED = _IN_MOVED_FROM | _IN_DELETE
+_IN_WATCH_MASK = _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE | _IN_REMOVED
+_IN_EVENT = struct.Struct('iIII')
+_IN_READ_SIZE = 1 << 16
+
+# Size and modification time of file.
+_Stat = Tuple[int, int]
+
+
+class DirectoryWatcher:
+    """
+    Class implements incremental injection: files with valid extensions which appear or are modified in watched
+    directories are injected by a pool of worker processes once they stay quiet for debounce seconds.
+    Events are received from inotify on Linux, otherwise directories are polled and their snapshots are compared.
+    Files which are already marked or haven't changed since their last injection are skipped.
+    Like batch injection, files keep their folder relative to the watched directory under out_dir.
+    Injected files are remembered in memory only: after restart unmarked files are injected again,
+    unless fingerprint cache is used, then files with unchanged cached entries are considered injected.
+    """
+
+    def __init__(self, roots: Iterable[str], out_dir: str, recursive: bool = False, jobs: int = 1,
+                 cache_path: Optional[str] = None, debounce: float = DEFAULT_DEBOUNCE,
+                 poll_interval: float = DEFAULT_POLL_INTERVAL, use_inotify: bool = True,
+                 with_fingerprints: bool = False):
+        """
+        :param roots: watched directories
+        :param out_dir: destination folder for injected files
+        :param recursive: if True subdirectories are watched too
+        :param jobs: number of worker processes
+        :param cache_path: path to fingerprint cache database, files aren't cached if None
+        :param debounce: seconds file should stay quiet after its last event before injection
+        :param poll_interval: seconds between snapshots if inotify isn't available
+        :param use_inotify: if False directories are always polled
+        :param with_fingerprints: if True, winnowing fingerprints of documents content are selected in the same pass
+        """
+        self.__roots = [os.path.abspath(root) for root in roots]
+        self.__out_dir = out_dir
+        self.__destinations = batch._Destinations(out_dir, self.__roots)
+        self.__jobs = jobs
+        self.__cache_path = cache_path
+        self.__debounce = debounce
+        self.__with_fingerprints = with_fingerprints
+        # Stats of files at the moment of their last injection, entries of removed files are dropped.
+        self.__done: Dict[str, _Stat] = {}
+
+        self.__events = None
+        if use_inotify:
+            try:
+                self.__events = _InotifyEvents(self.__roots, recursive)
+            except OSError:
+                pass
+
+        if self.__events is None:
+            self.__events = _PollingEvents(self.__roots, recursive, poll_interval)
+
+    @property
+    def backend(self) -> str:
+        """
+        Name of events source: inotify or polling.
+        """
+        return self.__events.name
+
+    def results(self, stop: Optional[threading.Event] = None) -> Iterator[InjectionResult]:
+        """
+        Injects files already present in watched directories, then waits for new and modified ones.
+        :param stop: watching finishes when event is set, never if None
+        :return: iterator over injection results, skipped files are not reported
+        """
+        if not os.path.exists(self.__out_dir):
+            os.makedirs(self.__out_dir)
+
+        # Path -> time of its last event.
+        quiet_since = dict.fromkeys(self.__events.existing(), 0.)
+        in_flight: Dict[Future, Tuple[str, _Stat]] = {}
+        self.__seed_done(quiet_since)
+
+        with ProcessPoolExecutor(max_workers=self.__jobs, initializer=_init_worker,
+                                 initargs=(self.__cache_path, metrics.enabled())) as executor:
+            try:
+                while stop is None or not stop.is_set():
+                    timeout = min(self.__debounce, STOP_CHECK_INTERVAL) if not in_flight else 0.05
+                    for path in self.__events.poll(timeout):
+                        quiet_since[path] = time.monotonic()
+
+                    self.__submit_quiet(executor, quiet_since, in_flight)
+
+                    for future in [future for future in in_flight if future.done()]:
+                        path, stat = in_flight.pop(future)
+                        try:
+                            result, snapshot = future.result()
+                            metrics.merge(snapshot)
+                        except Exception as err:
+                            result = InjectionResult(path, error=f'{type(err).__name__}: {err}')
+
+                        self.__done[path] = stat
+                        if result is not None:
+                            yield result
+            finally:
+                for future in in_flight:
+                    future.cancel()
+
+    def close(self) -> None:
+        self.__events.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __submit_quiet(self, executor: ProcessPoolExecutor, quiet_since: Dict[str, float],
+                       in_flight: Dict[Future, Tuple[str, _Stat]]) -> None:
+        """
+        Submits injection of files without events for debounce seconds.
+        File being injected now is postponed until its injection finishes.
+        """
+        now = time.monotonic()
+        busy = {path for path, _ in in_flight.values()}
+        for path, since in list(quiet_since.items()):
+            if now - since < self.__debounce or path in busy:
+                continue
+
+            del quiet_since[path]
+            stat = _stat(path)
+            if stat is None:
+                # Removed file is forgotten, so stats of long gone files don't pile up and its output name is free.
+                self.__done.pop(path, None)
+                self.__destinations.release(path)
+                continue
+
+            # Unchanged since the last injection.
+            if self.__done.get(path) == stat:
+                continue
+
+            out_folder, duplicate = self.__destinations.claim(path)
+            if duplicate is not None:
+                future = Future()
+                future.set_result((duplicate, None))
+            else:
+                future = executor.submit(_inject_unmarked, path, out_folder, self.__with_fingerprints)
+            in_flight[future] = (path, stat)
+
+    def __seed_done(self, paths: Iterable[str]) -> None:
+        """
+        Considers files with unchanged entries in fingerprint cache already injected, so they aren't injected again
+        after restart of watching.
+        """
+        if self.__cache_path is None:
+            return
+
+        from src.identifier.cache import FingerprintCache
+
+        with FingerprintCache(self.__cache_path) as cache:
+            for path in paths:
+                stat = _stat(path)
+                if stat is not None and cache.is_fresh(path):
+                    self.__destinations.claim(path)
+                    self.__done[path] = stat
+
+
+def _init_worker(cache_path: Optional[str], instrumented: bool) -> None:
+    # Watching is stopped by Ctrl+C in main process, workers finish their files.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    batch.init_worker(cache_path, instrumented)
+
+
+def _inject_unmarked(path: str, out_dir: str,
+                     with_fingerprints: bool) -> Tuple[Optional[InjectionResult], Optional[dict]]:
+    """
+    Injects identifier in file by worker process, unless it is already marked.
+    :return: injection result, None if file was skipped; metrics measured in worker
+    """
+    try:
+        if is_injected(path):
+            return None, metrics.collect()
+    except Exception as err:
+        return InjectionResult(path, error=f'{type(err).__name__}: {err}'), metrics.collect()
+
+    return batch.inject_file(path, out_dir, with_fingerprints=with_fingerprints), metrics.collect()
+
+
+class _PollingEvents:
+    """
+    Detects new, modified and removed files by comparing snapshots of watched directories every interval seconds.
+    """
+    name = 'polling'
+
+    def __init__(self, roots: List[str], recursive: bool, interval: float):
+        self.__roots = roots
+        self.__recursive = recursive
+        self.__interval = interval
+        self.__snapshot = _snapshot(roots, recursive)
+        self.__next_poll = time.monotonic() + interval
+
+    def existing(self) -> List[str]:
+        return list(self.__snapshot)
+
+    def poll(self, timeout: float) -> List[str]:
+        wait = self.__next_poll - time.monotonic()
+        if wait > timeout:
+            time.sleep(timeout)
+            return []
+
+        time.sleep(max(wait, 0.))
+        snapshot = _snapshot(self.__roots, self.__recursive)
+        changed = [path for path, stat in snapshot.items() if self.__snapshot.get(path) != stat]
+        # Removed files are reported too, watcher forgets them.
+        changed += [path for path in self.__snapshot if path not in snapshot]
+
+        self.__snapshot = snapshot
+        self.__next_poll = time.monotonic() + self.__interval
+        return changed
+
+    def close(self) -> None:
+        pass
+
+
+class _InotifyEvents:
+    """
+    Receives events of files closed after writing, moved or deleted in watched directories from Linux kernel.
+    Raises OSError if inotify is unavailable or its watches limit is exceeded.
+    """
+    name = 'inotify'
+
+    def __init__(self, roots: List[str], recursive: bool):
+        self.__libc = _load_libc()
+        self.__fd = self.__libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.__fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+        self.__roots = roots
+        self.__recursive = recursive
+        # Watch descriptor -> watched directory.
+        self.__dirs: Dict[int, str] = {}
+        self.__existing = []
+        try:
+            for root in roots:
+                self.__existing += self.__add_tree(root)
+        except OSError:
+            os.close(self.__fd)
+            raise
+
+    def existing(self) -> List[str]:
+        return self.__existing
+
+    def poll(self, timeout: float) -> List[str]:
+        ready, _, _ = select.select([self.__fd], [], [], timeout)
+        if not ready:
+            return []
+
+        try:
+            data = os.read(self.__fd, _IN_READ_SIZE)
+        except BlockingIOError:
+            return []
+
+        changed = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _IN_EVENT.unpack_from(data, offset)
+            offset += _IN_EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+
+            if mask & _IN_Q_OVERFLOW:
+                # Some events are lost, unchanged files will be skipped anyway.
+                changed += list(_snapshot(self.__roots, self.__recursive))
+                continue
+
+            if mask & _IN_IGNORED:
+                self.__dirs.pop(wd, None)
+                continue
+
+            directory = self.__dirs.get(wd)
+            if directory is None:
+                continue
+
+            path = os.path.join(directory, name)
+            if mask & _IN_ISDIR:
+                if self.__recursive:
+                    # Files could land in new directory before it was watched.
+                    try:
+                        changed += self.__add_tree(path)
+                    except OSError:
+                        pass
+            elif mask & (_IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_REMOVED) and _is_valid(name):
+                changed.append(path)
+
+        return changed
+
+    def close(self) -> None:
+        os.close(self.__fd)
+
+    def __add_tree(self, directory: str) -> List[str]:
+        """
+        Watches directory and, if recursive, its subdirectories.
+        :return: paths of valid files which are already in them
+        """
+        wd = self.__libc.inotify_add_watch(self.__fd, os.fsencode(directory), _IN_WATCH_MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), directory)
+        self.__dirs[wd] = directory
+
+        files = []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if self.__recursive:
+                        files += self.__add_tree(entry.path)
+                elif _is_valid(entry.name):
+                    files.append(entry.path)
+
+        return files
+
+
+def _load_libc() -> ctypes.CDLL:
+    if not sys.platform.startswith('linux'):
+        raise OSError('inotify is available on Linux only')
+
+    libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    try:
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    except AttributeError as err:
+        raise OSError('C library has no inotify functions') from err
+
+    return libc
+
+
+def _snapshot(roots: List[str], recursive: bool) -> Dict[str, _Stat]:
+    """
+    Collects stats of valid files in directories.
+    """
+    snapshot = {}
+    for root in roots:
+        for dirpath, dirs, files in os.walk(root):
+            for file in files:
+                path = os.path.join(dirpath, file)
+                stat = _stat(path) if _is_valid(file) else None
+                if stat is not None:
+                    snapshot[path] = stat
+
+            if not recursive:
+                break
+
+    return snapshot
+
+
+def _stat(path: str) -> Optional[_Stat]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _is_valid(name: str) -> bool:
+    return os.path.splitext(name)[1] in const.VALID_EXTENSIONS
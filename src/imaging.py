@@ -0,0 +1,135 @@
+# Copyright 2022 aaaaaaaalesha
+
+from collections import deque
+from typing import Iterable, Iterator, NamedTuple, Optional
+
+import numpy
+from imagehash import ImageHash
+from PIL import Image
+
+HASH_SIZE = 8
+PHASH_SIZE = HASH_SIZE * 4
+COLOR_BINBITS = 3
+# JPEG images are decoded at reduced scale (1/2, 1/4 or 1/8), but not smaller than this size.
+DRAFT_SIZE = 512
+
+# Rows of unnormalized DCT-II matrix for the lowest frequencies, the same transform as scipy.fftpack.dct.
+_DCT = 2 * numpy.cos(
+    numpy.pi * numpy.outer(numpy.arange(HASH_SIZE), 2 * numpy.arange(PHASH_SIZE) + 1) / (2 * PHASH_SIZE)
+)
+_HUE_BINS = numpy.linspace(0, 255, 6 + 1)
+
+
+class ImageHashes(NamedTuple):
+    """
+    Perceptual hashes of image as hex strings, the same as str() of imagehash functions results.
+    """
+    avghash: str
+    dhash: str
+    phash: str
+    colorhash: str
+
+
+class ImageHashResult(NamedTuple):
+    """
+    Result of hashing a single image.
+    """
+    path: str
+    hashes: Optional[ImageHashes] = None
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def hash_image(path: str) -> ImageHashes:
+    """
+    Computes average, difference, perceptual and color hashes of image.
+    Image is decoded once (JPEG – at reduced scale) and converted to grayscale and HSV once,
+    all hashes are derived from these shared representations.
+    :param path: path to image
+    :return: image hashes
+    """
+    with Image.open(path) as img:
+        img.draft(None, (DRAFT_SIZE, DRAFT_SIZE))
+        gray = img.convert('L')
+        hsv = img.convert('HSV')
+
+    avg_pixels = numpy.asarray(gray.resize((HASH_SIZE, HASH_SIZE), Image.LANCZOS))
+    diff_pixels = numpy.asarray(gray.resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS))
+    dct_pixels = numpy.asarray(gray.resize((PHASH_SIZE, PHASH_SIZE), Image.LANCZOS), dtype=numpy.float64)
+
+    dct = _DCT @ dct_pixels @ _DCT.T
+
+    return ImageHashes(
+        avghash=str(ImageHash(avg_pixels > avg_pixels.mean())),
+        dhash=str(ImageHash(diff_pixels[:, 1:] > diff_pixels[:, :-1])),
+        phash=str(ImageHash(dct > numpy.median(dct))),
+        colorhash=str(_color_hash(numpy.asarray(gray).ravel(), numpy.asarray(hsv))),
+    )
+
+
+def hash_many(paths: Iterable[str], jobs: int = 1) -> Iterator[ImageHashResult]:
+    """
+    Hashes images, fanning work out to a pool of jobs worker processes.
+    Results are yielded in the order of passed paths, only a bounded window of images is in flight at once.
+    :param paths: paths to images
+    :param jobs: number of worker processes, 1 – hash in current process
+    :return: iterator over hashing results
+    """
+    if jobs <= 1:
+        for path in paths:
+            yield _hash_file(path)
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        pending = deque()
+        for path in paths:
+            pending.append(executor.submit(_hash_file, path))
+            if len(pending) >= jobs * 4:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+
+def _hash_file(path: str) -> ImageHashResult:
+    try:
+        return ImageHashResult(path, hash_image(path))
+    except Exception as err:
+        return ImageHashResult(path, error=f'{type(err).__name__}: {err}')
+
+
+def _color_hash(intensity: numpy.ndarray, hsv: numpy.ndarray) -> ImageHash:
+    """
+    Computes color hash like imagehash.colorhash does: fractions of black, gray and 6 hue bins
+    of faint and bright colors are discretized to COLOR_BINBITS bits each.
+    :param intensity: flat array of grayscale pixels
+    :param hsv: array of HSV pixels
+    :return: color hash
+    """
+    h, s = hsv[..., 0].ravel(), hsv[..., 1].ravel()
+
+    mask_black = intensity < 256 // 8
+    mask_gray = s < 256 // 3
+    mask_colors = ~mask_black & ~mask_gray
+    mask_faint_colors = mask_colors & (s < 256 * 2 // 3)
+    mask_bright_colors = mask_colors & (s > 256 * 2 // 3)
+
+    colors = max(1, mask_colors.sum())
+    faint_counts, _ = numpy.histogram(h[mask_faint_colors], bins=_HUE_BINS)
+    bright_counts, _ = numpy.histogram(h[mask_bright_colors], bins=_HUE_BINS)
+
+    max_value = 2 ** COLOR_BINBITS
+    fractions = [mask_black.mean(), (~mask_black & mask_gray).mean()]
+    fractions += [count * 1. / colors for count in (*faint_counts, *bright_counts)]
+    values = numpy.array([min(max_value - 1, int(fraction * max_value)) for fraction in fractions])
+
+    # Not exactly binary digits, but the same bits imagehash builds for each value.
+    i = numpy.arange(COLOR_BINBITS)
+    bits = values[:, None] // 2 ** (COLOR_BINBITS - i - 1) % 2 ** (COLOR_BINBITS - i) > 0
+
+    return ImageHash(bits)
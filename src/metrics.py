@@ -0,0 +1,322 @@
+# Copyright 2022 aaaaaaaalesha
+
+"""
+Lightweight instrumentation of injection and comparison stages.
+Instrumentation is disabled by default: spans, stopwatches and counters do nothing until enable() is called.
+Collected durations, counters and gauges are exported as JSON summary or Prometheus text format.
+"""
+
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Iterable, Iterator, List, Optional
+
+# Upper bounds of stage duration histogram buckets in seconds.
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10., float('inf'))
+PROMETHEUS_PREFIX = 'fuzzy_docmarking'
+
+_registry: Optional['Registry'] = None
+_NULL_SPAN = nullcontext()
+
+
+class Registry:
+    """
+    Class implements thread-safe storage of counters, gauges and histograms of stage durations.
+    Snapshots of registries from worker processes are merged into the main one.
+    """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__counters: Dict[str, float] = {}
+        self.__gauges: Dict[str, float] = {}
+        # Stage name -> [bucket counts, number of observations, sum, max].
+        self.__histograms: Dict[str, list] = {}
+
+    def count(self, name: str, value: float = 1) -> None:
+        with self.__lock:
+            self.__counters[name] = self.__counters.get(name, 0) + value
+
+    def gauge(self, name: str, value: float) -> None:
+        with self.__lock:
+            self.__gauges[name] = value
+
+    def observe(self, name: str, seconds: float) -> None:
+        with self.__lock:
+            histogram = self.__histograms.get(name)
+            if histogram is None:
+                histogram = self.__histograms[name] = [[0] * len(BUCKETS), 0, 0., 0.]
+
+            histogram[0][bisect_left(BUCKETS, seconds)] += 1
+            histogram[1] += 1
+            histogram[2] += seconds
+            histogram[3] = max(histogram[3], seconds)
+
+    def snapshot(self, reset=False) -> dict:
+        """
+        Copies collected values to picklable dict.
+        :param reset: if True, registry is emptied
+        :return: snapshot dict
+        """
+        with self.__lock:
+            snapshot = {
+                'counters': dict(self.__counters),
+                'gauges': dict(self.__gauges),
+                'histograms': {name: [list(counts), count, total, maximum]
+                               for name, (counts, count, total, maximum) in self.__histograms.items()},
+            }
+            if reset:
+                self.__counters.clear()
+                self.__gauges.clear()
+                self.__histograms.clear()
+
+        return snapshot
+
+    def merge(self, snapshot: dict) -> None:
+        """
+        Adds values of snapshot, e.g. taken in worker process. Gauges are replaced by snapshot ones.
+        :param snapshot: snapshot dict
+        :return: None
+        """
+        with self.__lock:
+            for name, value in snapshot['counters'].items():
+                self.__counters[name] = self.__counters.get(name, 0) + value
+
+            self.__gauges.update(snapshot.get('gauges', {}))
+
+            for name, (counts, count, total, maximum) in snapshot['histograms'].items():
+                histogram = self.__histograms.get(name)
+                if histogram is None:
+                    histogram = self.__histograms[name] = [[0] * len(BUCKETS), 0, 0., 0.]
+
+                histogram[0] = [a + b for a, b in zip(histogram[0], counts)]
+                histogram[1] += count
+                histogram[2] += total
+                histogram[3] = max(histogram[3], maximum)
+
+    def summary(self) -> dict:
+        """
+        Builds JSON-serializable summary: counters, gauges and, for each stage, number of runs, total, mean and
+        maximal duration, cumulative counts of buckets.
+        :return: summary dict
+        """
+        snapshot = self.snapshot()
+        stages = {}
+        for name, (counts, count, total, maximum) in sorted(snapshot['histograms'].items()):
+            stages[name] = {
+                'count': count,
+                'total_seconds': round(total, 6),
+                'mean_seconds': round(total / count, 6) if count else None,
+                'max_seconds': round(maximum, 6),
+                'buckets': dict(zip(map(_bucket_label, BUCKETS), _cumulative(counts))),
+            }
+
+        return {'counters': dict(sorted(snapshot['counters'].items())),
+                'gauges': dict(sorted(snapshot['gauges'].items())), 'stages': stages}
+
+    def to_prometheus(self) -> str:
+        """
+        Formats collected values in Prometheus text exposition format.
+        :return: text of metrics
+        """
+        snapshot = self.snapshot()
+        lines = []
+        for name, value in sorted(snapshot['counters'].items()):
+            metric = f'{PROMETHEUS_PREFIX}_{name}_total'
+            lines += [f'# TYPE {metric} counter', f'{metric} {value:g}']
+
+        for name, value in sorted(snapshot['gauges'].items()):
+            metric = f'{PROMETHEUS_PREFIX}_{name}'
+            lines += [f'# TYPE {metric} gauge', f'{metric} {value:g}']
+
+        metric = f'{PROMETHEUS_PREFIX}_stage_seconds'
+        lines.append(f'# TYPE {metric} histogram')
+        for name, (counts, count, total, _) in sorted(snapshot['histograms'].items()):
+            for bound, cumulative in zip(BUCKETS, _cumulative(counts)):
+                lines.append(f'{metric}_bucket{{stage="{name}",le="{_bucket_label(bound)}"}} {cumulative}')
+            lines.append(f'{metric}_sum{{stage="{name}"}} {total:.9g}')
+            lines.append(f'{metric}_count{{stage="{name}"}} {count}')
+
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path: str) -> None:
+        """
+        Writes JSON summary to .json file, metrics in Prometheus text format – to any other one.
+        :param path: path to output file
+        :return: None
+        """
+        with open(path, 'w', encoding='utf-8') as file:
+            if os.path.splitext(path)[1] == '.json':
+                json.dump(self.summary(), file, indent=2)
+            else:
+                file.write(self.to_prometheus())
+
+
+class Stopwatch:
+    """
+    Accumulates duration of several intervals of one stage, e.g. of processing each streamed item,
+    and records it as a single observation.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.seconds = 0.
+        self.__started = 0.
+
+    def __enter__(self):
+        self.__started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.seconds += time.perf_counter() - self.__started
+
+    def iterate(self, iterable: Iterable) -> Iterator:
+        """
+        Yields items of iterable, measuring time spent on producing each of them.
+        """
+        iterator = iter(iterable)
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.seconds += time.perf_counter() - started
+                return
+            self.seconds += time.perf_counter() - started
+            yield item
+
+    def record(self) -> None:
+        observe(self.name, self.seconds)
+
+
+class _NullStopwatch:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def iterate(self, iterable: Iterable) -> Iterable:
+        return iterable
+
+    def record(self) -> None:
+        pass
+
+
+_NULL_STOPWATCH = _NullStopwatch()
+
+
+def enable() -> Registry:
+    """
+    Enables instrumentation, keeping already collected values.
+    :return: global registry
+    """
+    global _registry
+    if _registry is None:
+        _registry = Registry()
+
+    return _registry
+
+
+def disable() -> None:
+    """
+    Disables instrumentation and drops collected values.
+    :return: None
+    """
+    global _registry
+    _registry = None
+
+
+def enabled() -> bool:
+    return _registry is not None
+
+
+def registry() -> Optional[Registry]:
+    """
+    Returns global registry, None if instrumentation is disabled.
+    """
+    return _registry
+
+
+def span(name: str):
+    """
+    Context manager recording duration of its block as observation of stage name.
+    :param name: stage name
+    :return: context manager
+    """
+    if _registry is None:
+        return _NULL_SPAN
+
+    return _span(_registry, name)
+
+
+def stopwatch(name: str):
+    """
+    Creates stopwatch of stage name, it does nothing if instrumentation is disabled.
+    :param name: stage name
+    :return: stopwatch
+    """
+    if _registry is None:
+        return _NULL_STOPWATCH
+
+    return Stopwatch(name)
+
+
+def count(name: str, value: float = 1) -> None:
+    if _registry is not None:
+        _registry.count(name, value)
+
+
+def gauge(name: str, value: float) -> None:
+    if _registry is not None:
+        _registry.gauge(name, value)
+
+
+def observe(name: str, seconds: float) -> None:
+    if _registry is not None:
+        _registry.observe(name, seconds)
+
+
+def collect() -> Optional[dict]:
+    """
+    Takes snapshot of collected values and empties registry, so worker process can pass them to the main one.
+    :return: snapshot dict, None if instrumentation is disabled
+    """
+    if _registry is None:
+        return None
+
+    return _registry.snapshot(reset=True)
+
+
+def merge(snapshot: Optional[dict]) -> None:
+    """
+    Adds values collected in worker process to the global registry.
+    :param snapshot: snapshot dict returned by collect()
+    :return: None
+    """
+    if _registry is not None and snapshot is not None:
+        _registry.merge(snapshot)
+
+
+@contextmanager
+def _span(registry_: Registry, name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry_.observe(name, time.perf_counter() - started)
+
+
+def _bucket_label(bound: float) -> str:
+    return '+Inf' if bound == float('inf') else f'{bound:g}'
+
+
+def _cumulative(counts: List[int]) -> List[int]:
+    total, result = 0, []
+    for value in counts:
+        total += value
+        result.append(total)
+
+    return result
@@ -0,0 +1,450 @@
+# Copyright 2022 aaaaaaaalesha
+
+"""
+MinHash signatures of document text over word shingles and banded LSH index of them.
+Unlike fuzzy hash, MinHash estimates Jaccard similarity of shingle sets, so it still matches documents
+with reordered paragraphs or ones containing only a part of the original text.
+Text is tokenized and hashed by NumPy in chunks, NumPy is imported by hashing and the index only:
+comparison of signatures is pure Python.
+"""
+
+import base64
+from typing import Dict, List, Optional, Set, Tuple
+
+from src.texthash import mix, substring_hashes, word_mask
+
+NUM_PERM = 128
+SHINGLE_SIZE = 3
+LSH_BANDS = 32
+LSH_ROWS = NUM_PERM // LSH_BANDS
+
+# Text is collected and hashed in chunks of this size in bytes.
+_CHUNK_SIZE = 1 << 20
+# Shingles are permuted in blocks of so many ones to keep temporary arrays small.
+_BLOCK_SIZE = 1 << 10
+_MASK64 = (1 << 64) - 1
+# Odd multiplier of polynomial hashes of shingles.
+_SHINGLE_BASE = 0x9E3779B97F4A7C15
+_SEED = 0x5EED
+# Pending postings of index are scanned linearly on query only while there are few of them.
+_MAX_PENDING_SCAN = 1 << 12
+# Pending postings of index are merged into sorted arrays in batches of so many postings.
+_MERGE_SIZE = 1 << 20
+
+
+def _splitmix64(state: int) -> Tuple[int, int]:
+    state = (state + 0x9E3779B97F4A7C15) & _MASK64
+    z = state
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return state, z ^ (z >> 31)
+
+
+def _permutations() -> Tuple[List[int], List[int]]:
+    """
+    Generates parameters of NUM_PERM hash functions a * x + b mod 2^64, the same on any platform.
+    """
+    state, multipliers, increments = _SEED, [], []
+    for _ in range(NUM_PERM):
+        state, a = _splitmix64(state)
+        state, b = _splitmix64(state)
+        multipliers.append(a | 1)
+        increments.append(b)
+
+    return multipliers, increments
+
+
+_MULTIPLIERS, _INCREMENTS = _permutations()
+
+
+class MinHasher:
+    """
+    Class implements MinHash of text fed by pieces, e.g. streamed from document parts.
+    Text is lowercased and split into words: ASCII letters and digits and any non-ASCII characters except
+    Latin-1 and general punctuation. Shingles of SHINGLE_SIZE consecutive words are hashed and only NUM_PERM
+    minimal values of permuted shingle hashes are kept, so memory doesn't depend on text size.
+    """
+
+    def __init__(self, markup: bool = False):
+        """
+        :param markup: if True, text is XML markup and only text between tags is tokenized, e.g. .xlsx sheetData
+        """
+        self.__markup = markup
+        self.__buffer = bytearray()
+        self.__minimums = None
+        # Hashes of the last SHINGLE_SIZE - 1 words, shingles continue over chunks.
+        self.__tail: List[int] = []
+        self.__words = 0
+
+    def update(self, text: str) -> None:
+        """
+        Feeds the next piece of text.
+        :param text: piece of text
+        :return: None
+        """
+        self.__buffer += text.lower().encode('utf-8')
+        if len(self.__buffer) >= _CHUNK_SIZE:
+            self.__minimums, self.__tail, self.__words, rest = self.__hash_chunk(bytes(self.__buffer), final=False)
+            self.__buffer = bytearray(rest)
+
+    def digest(self) -> Optional[bytes]:
+        """
+        Computes signature of all text fed so far, update can be continued afterwards.
+        :return: NUM_PERM little-endian 32-bit minimums, None if text has no words
+        """
+        minimums, _, words, _ = self.__hash_chunk(bytes(self.__buffer), final=True)
+        if not words:
+            return None
+
+        # High bits of a * x + b are the well mixed ones.
+        return (minimums >> 32).astype('<u4').tobytes()
+
+    def hexdigest(self) -> Optional[str]:
+        """
+        Computes encoded signature of all text fed so far, the one stored in document identifier.
+        :return: encoded signature, None if text has no words
+        """
+        digest = self.digest()
+        return None if digest is None else encode_signature(digest)
+
+    def __hash_chunk(self, data: bytes, final: bool) -> tuple:
+        """
+        Hashes chunk of text without changing state. Word cut by the end of chunk is returned to be hashed
+        with the next one.
+        :param data: chunk of lowercased UTF-8 text
+        :param final: whether it's the last chunk
+        :return: new minimums, tail, number of words and the rest of chunk
+        """
+        import numpy as np
+
+        minimums = self.__minimums
+        if minimums is None:
+            minimums = np.full(NUM_PERM, _MASK64, dtype=np.uint64)
+
+        chunk = np.frombuffer(data, dtype=np.uint8)
+        starts, ends = _words_of(chunk, self.__markup)
+
+        rest = b''
+        if not final and len(starts) and ends[-1] == len(chunk) and starts[-1] > 0:
+            rest, starts, ends = data[starts[-1]:], starts[:-1], ends[:-1]
+        if not final and self.__markup:
+            # Unclosed tag is hashed with the next chunk as well.
+            opened, closed = data.rfind(b'<'), data.rfind(b'>')
+            if opened > closed and opened > 0:
+                rest, keep = data[opened:], starts < opened
+                starts, ends = starts[keep], ends[keep]
+
+        tokens = np.concatenate((np.array(self.__tail, dtype=np.uint64), substring_hashes(chunk, starts, ends)))
+        words = self.__words + len(starts)
+
+        if len(tokens) >= SHINGLE_SIZE:
+            shingles = _shingle_hashes(tokens, SHINGLE_SIZE)
+        elif final and words and words < SHINGLE_SIZE:
+            # Text shorter than a shingle is a single shingle.
+            shingles = _shingle_hashes(tokens, len(tokens))
+        else:
+            shingles = np.empty(0, dtype=np.uint64)
+
+        minimums = _permuted_minimums(np.unique(shingles), minimums)
+        return minimums, tokens[-(SHINGLE_SIZE - 1):].tolist(), words, rest
+
+
+def minhash(text: str) -> Optional[str]:
+    """
+    Computes encoded MinHash signature of text.
+    :param text: text
+    :return: encoded signature, None if text has no words
+    """
+    hasher = MinHasher()
+    hasher.update(text)
+    return hasher.hexdigest()
+
+
+def encode_signature(digest: bytes) -> str:
+    """
+    Encodes signature as '<number of permutations>:<base64 of minimums>'.
+    :param digest: signature bytes returned by MinHasher.digest
+    :return: encoded signature
+    """
+    return f'{len(digest) // 4}:{base64.b64encode(digest).decode("ascii")}'
+
+
+def decode_signature(signature: str) -> bytes:
+    """
+    Decodes signature encoded by encode_signature.
+    :param signature: encoded signature
+    :return: signature bytes
+    :raises ValueError: if signature is malformed or computed with other number of permutations
+    """
+    num_perm, _, encoded = signature.partition(':')
+    if num_perm != str(NUM_PERM):
+        raise ValueError(f'MinHash signature should have {NUM_PERM} permutations: {signature[:16]}')
+
+    digest = base64.b64decode(encoded, validate=True)
+    if len(digest) != NUM_PERM * 4:
+        raise ValueError(f'MinHash signature should have {NUM_PERM * 4} bytes: {signature[:16]}')
+
+    return digest
+
+
+def is_signature(signature: Optional[str]) -> bool:
+    if not signature:
+        return False
+
+    try:
+        decode_signature(signature)
+    except ValueError:
+        return False
+
+    return True
+
+
+def jaccard(digest1: bytes, digest2: bytes) -> float:
+    """
+    Estimates Jaccard similarity of shingle sets as a share of equal minimums.
+    :param digest1: first signature bytes
+    :param digest2: second signature bytes
+    :return: value from 0 to 1
+    """
+    equal = sum(digest1[i:i + 4] == digest2[i:i + 4] for i in range(0, len(digest1), 4))
+    return equal / (len(digest1) // 4)
+
+
+def compare(signature1: str, signature2: str) -> int:
+    """
+    Computes similarity of encoded signatures in percents like ssdeep.compare does.
+    :param signature1: first encoded signature
+    :param signature2: second encoded signature
+    :return: estimated Jaccard similarity from 0 to 100
+    :raises ValueError: if one of signatures is malformed
+    """
+    return round(100 * jaccard(decode_signature(signature1), decode_signature(signature2)))
+
+
+def band_keys(digest: bytes) -> List[int]:
+    """
+    Computes keys of LSH bands of signature: hashes of band number and its LSH_ROWS minimums.
+    Keys are non-negative 63-bit integers, the same on any platform, so they can be stored in database.
+    :param digest: signature bytes
+    :return: list of LSH_BANDS keys
+    """
+    import numpy as np
+
+    return _band_keys(np.frombuffer(digest, dtype='<u4'))[0].tolist()
+
+
+class MinHashIndex:
+    """
+    Class implements banded LSH index of MinHash signatures.
+    Signature is split into LSH_BANDS bands of LSH_ROWS minimums, signatures sharing any band are candidates.
+    Pair with Jaccard similarity s becomes candidate with probability 1 - (1 - s^LSH_ROWS)^LSH_BANDS,
+    e.g. 0.4 for s = 0.3 and over 0.99 for s = 0.6, so only a few stored signatures are really compared.
+    Minimums are kept as rows of NumPy matrix and band keys as sorted NumPy array with aligned signature ids,
+    like in FuzzyHashIndex, so the index takes about 1 KB per signature.
+    """
+
+    def __init__(self):
+        import numpy as np
+
+        self.__keys: List[object] = []
+        self.__ids: Dict[object, int] = {}
+        self.__removed = 0
+        self.__minimums = np.empty((0, NUM_PERM), dtype=np.uint32)
+        self.__posting_keys = np.empty(0, dtype=np.uint64)
+        self.__posting_ids = np.empty(0, dtype=np.uint32)
+        # Band keys of signatures added since the last merge are computed at once for all of them.
+        self.__pending_ids: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self.__ids)
+
+    def __contains__(self, key) -> bool:
+        return key in self.__ids
+
+    def add(self, key, signature: str) -> None:
+        """
+        Adds signature to index, replacing one stored under the same key.
+        :param key: hashable key, e.g. document path
+        :param signature: encoded signature
+        :return: None
+        :raises ValueError: if signature is malformed
+        """
+        import numpy as np
+
+        minimums = np.frombuffer(decode_signature(signature), dtype='<u4')
+        if key in self.__ids:
+            self.remove(key)
+
+        id_ = len(self.__keys)
+        self.__keys.append(key)
+        self.__ids[key] = id_
+
+        # Matrix grows by doubling, so adding is amortized constant time.
+        if id_ == len(self.__minimums):
+            grown = np.empty((max(2 * id_, 64), NUM_PERM), dtype=np.uint32)
+            grown[:id_] = self.__minimums
+            self.__minimums = grown
+        self.__minimums[id_] = minimums
+
+        self.__pending_ids.append(id_)
+        if len(self.__pending_ids) * LSH_BANDS >= _MERGE_SIZE:
+            self.__merge()
+
+    def remove(self, key) -> None:
+        """
+        Removes signature stored under the key.
+        :param key: key of signature
+        :return: None
+        :raises KeyError: if there is no such key in index
+        """
+        id_ = self.__ids.pop(key)
+
+        # Postings of removed signatures are skipped on query until the index is compacted.
+        self.__keys[id_] = None
+        self.__removed += 1
+        if self.__removed > len(self.__keys) // 2:
+            self.__compact()
+
+    def candidates(self, signature: str) -> Set:
+        """
+        Collects keys of signatures sharing at least one band with the passed one.
+        :param signature: encoded signature
+        :return: set of keys
+        """
+        import numpy as np
+
+        ids = self.__candidate_ids(np.frombuffer(decode_signature(signature), dtype='<u4'))
+        return {self.__keys[id_] for id_ in ids.tolist()}
+
+    def query(self, signature: str, k: Optional[int] = None) -> List[Tuple[object, float]]:
+        """
+        Finds stored signatures most similar to the passed one among candidates.
+        :param signature: encoded signature
+        :param k: maximal number of returned signatures, all candidates if None
+        :return: list of (key, estimated Jaccard similarity) pairs sorted by descending similarity
+        """
+        import numpy as np
+
+        minimums = np.frombuffer(decode_signature(signature), dtype='<u4')
+        ids = self.__candidate_ids(minimums)
+        similarities = (self.__minimums[ids] == minimums).sum(axis=1) / NUM_PERM
+
+        matched = sorted(zip((self.__keys[id_] for id_ in ids.tolist()), similarities.tolist()),
+                         key=lambda item: item[1], reverse=True)
+        return matched if k is None else matched[:k]
+
+    def __candidate_ids(self, minimums):
+        """
+        Finds ids of live signatures sharing at least one band with passed minimums.
+        :return: sorted array of ids
+        """
+        import numpy as np
+
+        if len(self.__pending_ids) * LSH_BANDS > _MAX_PENDING_SCAN:
+            self.__merge()
+
+        keys = _band_keys(minimums)[0]
+        starts = np.searchsorted(self.__posting_keys, keys, side='left')
+        ends = np.searchsorted(self.__posting_keys, keys, side='right')
+        found = [self.__posting_ids[start:end] for start, end in zip(starts.tolist(), ends.tolist()) if start < end]
+
+        if self.__pending_ids:
+            # Keys include band number, so only keys of the same band are compared.
+            pending = np.array(self.__pending_ids, dtype=np.uint32)
+            found.append(pending[(_band_keys(self.__minimums[pending]) == keys).any(axis=1)])
+
+        ids = np.unique(np.concatenate(found)) if found else np.empty(0, dtype=np.uint32)
+        return np.array([id_ for id_ in ids.tolist() if self.__keys[id_] is not None], dtype=np.intp)
+
+    def __merge(self) -> None:
+        """
+        Merges pending postings into sorted arrays in linear time.
+        """
+        import numpy as np
+
+        if not self.__pending_ids:
+            return
+
+        pending = np.array(self.__pending_ids, dtype=np.uint32)
+        keys = _band_keys(self.__minimums[pending]).ravel()
+        ids = np.repeat(pending, LSH_BANDS)
+        order = np.argsort(keys, kind='stable')
+        keys, ids = keys[order], ids[order]
+
+        positions = np.searchsorted(self.__posting_keys, keys, side='right')
+        self.__posting_keys = np.insert(self.__posting_keys, positions, keys)
+        self.__posting_ids = np.insert(self.__posting_ids, positions, ids)
+        self.__pending_ids = []
+
+    def __compact(self) -> None:
+        """
+        Drops minimums and postings of removed signatures, renumbering live ones.
+        """
+        import numpy as np
+
+        self.__merge()
+        live = np.array([key is not None for key in self.__keys], dtype=bool)
+        new_ids = (np.cumsum(live) - 1).astype(np.uint32)
+
+        kept = live[self.__posting_ids]
+        self.__posting_keys = self.__posting_keys[kept]
+        self.__posting_ids = new_ids[self.__posting_ids[kept]]
+        self.__minimums = self.__minimums[:len(self.__keys)][live]
+
+        self.__keys = [key for key in self.__keys if key is not None]
+        self.__ids = {key: id_ for id_, key in enumerate(self.__keys)}
+        self.__removed = 0
+
+
+def _band_keys(minimums):
+    """
+    Keys of LSH bands of several signatures at once, see band_keys.
+    :param minimums: uint32 array of NUM_PERM minimums or matrix of such rows
+    :return: uint64 matrix of LSH_BANDS keys per signature
+    """
+    import numpy as np
+
+    bands = minimums.astype(np.uint64).reshape(-1, LSH_BANDS, LSH_ROWS)
+    keys = np.arange(1, LSH_BANDS + 1, dtype=np.uint64)
+    for row in range(LSH_ROWS):
+        keys = mix(keys * np.uint64(_SHINGLE_BASE) + bands[:, :, row])
+
+    return keys >> np.uint64(1)
+
+
+def _words_of(chunk, markup: bool) -> tuple:
+    """
+    Finds words in chunk of lowercased UTF-8 text.
+    :param chunk: uint8 array
+    :param markup: whether bytes inside tags should be skipped
+    :return: arrays of start and end offsets of words
+    """
+    import numpy as np
+
+    edges = np.flatnonzero(np.diff(word_mask(chunk, markup).astype(np.int8), prepend=0, append=0))
+    return edges[0::2], edges[1::2]
+
+
+def _shingle_hashes(tokens, size: int):
+    import numpy as np
+
+    count = len(tokens) - size + 1
+    shingles = np.zeros(count, dtype=np.uint64)
+    for i in range(size):
+        shingles = shingles * np.uint64(_SHINGLE_BASE) + tokens[i:i + count]
+
+    return mix(shingles)
+
+
+def _permuted_minimums(shingles, minimums):
+    import numpy as np
+
+    multipliers = np.array(_MULTIPLIERS, dtype=np.uint64)
+    increments = np.array(_INCREMENTS, dtype=np.uint64)[:, None]
+    for offset in range(0, len(shingles), _BLOCK_SIZE):
+        # Rows of permutations are reduced along contiguous memory.
+        permuted = np.multiply.outer(multipliers, shingles[offset:offset + _BLOCK_SIZE])
+        permuted += increments
+        minimums = np.minimum(minimums, permuted.min(axis=1))
+
+    return minimums
@@ -0,0 +1,94 @@
+# Copyright 2022 aaaaaaaalesha
+
+"""
+Profiling of a single run: deterministic cProfile of the main thread or sampling of all threads' stacks.
+"""
+
+import cProfile
+import os
+import sys
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+DEFAULT_SAMPLING_INTERVAL = 0.005
+# Profiles with these extensions are written by cProfile, other ones contain sampled stacks.
+CPROFILE_EXTENSIONS = ('.prof', '.pstats')
+
+
+class SamplingProfiler:
+    """
+    Class implements sampling profiler: stacks of all threads are taken periodically from a background thread.
+    Unlike cProfile, it sees work done in executor threads (e.g. parsing stage of comparison) and barely slows
+    the run down. Profile is written in collapsed stacks format ('thread;frame;...;frame samples' lines),
+    which is read by flame graph tools like flamegraph.pl or speedscope.
+    """
+
+    def __init__(self, interval: float = DEFAULT_SAMPLING_INTERVAL):
+        """
+        :param interval: seconds between samples
+        """
+        self.__interval = interval
+        self.__stacks = Counter()
+        self.__stop = threading.Event()
+        self.__thread = threading.Thread(target=self.__run, name='sampling-profiler', daemon=True)
+
+    def start(self) -> None:
+        self.__thread.start()
+
+    def stop(self) -> None:
+        self.__stop.set()
+        self.__thread.join()
+
+    def write(self, path: str) -> None:
+        """
+        Writes collapsed stacks sorted by number of samples.
+        :param path: path to profile file
+        :return: None
+        """
+        with open(path, 'w', encoding='utf-8') as file:
+            for stack, samples in self.__stacks.most_common():
+                file.write(f'{stack} {samples}\n')
+
+    def __run(self) -> None:
+        own = threading.get_ident()
+        while not self.__stop.wait(self.__interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+
+                self.__stacks[';'.join(reversed(stack))] += 1
+
+
+@contextmanager
+def profile(path: str):
+    """
+    Profiles block and writes profile to path: cProfile statistics of the calling thread if path has
+    .prof or .pstats extension (read them with pstats or snakeviz), sampled stacks of all threads otherwise.
+    Worker processes are not profiled.
+    :param path: path to profile file
+    """
+    if os.path.splitext(path)[1] in CPROFILE_EXTENSIONS:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(path)
+    else:
+        profiler = SamplingProfiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            profiler.write(path)
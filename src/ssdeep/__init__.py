@@ -1,13 +1,17 @@
 """
 This is a Python wrapper for ssdeep by Jesse Kornblum (http://ssdeep.sourceforge.net).
 Inspired by python-ssdeep (https://github.com/DinoTools/python-ssdeep).
+
+Two backends are available:
+- libfuzzy – the fuzzy library from ssdeep called through ctypes (bundled DLL on Windows, system libfuzzy elsewhere);
+- spamsum – built-in pure Python/NumPy implementation with byte-identical output.
+By default libfuzzy is used when it can be loaded, otherwise spamsum. The choice can be forced
+by SSDEEP_BACKEND environment variable or set_backend().
+The backend is loaded on first use and NumPy-based batch scoring and index are imported only when accessed,
+so importing the package itself costs almost nothing.
 """
+import importlib
 import os
-import sys
-import ctypes
-from os.path import join
-from os.path import split
-from pip._vendor import six
 
 # Length of an individual fuzzy hash signature component
 SPAMSUM_LENGTH = 64
@@ -15,42 +19,87 @@ SPAMSUM_LENGTH = 64
 # The longest possible length for a fuzzy hash signature
 FUZZY_MAX_RESULT = (2 * SPAMSUM_LENGTH + 20)
 
+BACKENDS = ('libfuzzy', 'spamsum')
+
+# Names imported from submodules on first access.
+_LAZY_NAMES = {
+    'compare_many': 'batch',
+    'compare_matrix': 'batch',
+    'FuzzyHashIndex': 'index',
+    'signature_keys': '_signature',
+}
+
+_backend = None
+
 
 class FuzzyLibError(Exception):
     def __init__(self, error_number):
         self.error_number = error_number
 
 
-is_64bits = sys.maxsize > 2 ** 32
-_package_path = split(__file__)[0]
-_lib_path = join(_package_path, r'bin\fuzzy_64.dll' if is_64bits else r'bin\fuzzy.dll')
-fuzzy_lib = ctypes.cdll.LoadLibrary(_lib_path)
+def _load_backend(name):
+    if name not in BACKENDS:
+        raise ValueError(f'Unknown ssdeep backend {name}, expected one of {", ".join(BACKENDS)}')
+
+    return importlib.import_module(f'{__name__}._{name}')
+
+
+def set_backend(name=None):
+    """Selects implementation of fuzzy hashing.
+
+    :param str|None name: One of BACKENDS, or None to pick libfuzzy if it can be loaded and spamsum otherwise
+    :raises OSError: If libfuzzy backend is requested, but the library can't be loaded
+    :raises ValueError: If the backend name is unknown
+    """
+    global _backend
+
+    if name is not None:
+        _backend = _load_backend(name)
+        return
+
+    try:
+        _backend = _load_backend('libfuzzy')
+    except OSError:
+        _backend = _load_backend('spamsum')
+
+
+def get_backend():
+    """Returns name of the selected backend.
+
+    :rtype: str
+    """
+    return _selected_backend().name
+
+
+def _selected_backend():
+    if _backend is None:
+        set_backend(os.environ.get('SSDEEP_BACKEND') or None)
+
+    return _backend
 
 
 def compare(signature_1, signature_2):
     """Computes the match score between two fuzzy hash signatures.
     A match score of zero indicates the signatures did not match.
 
-    :param str|unicode|bytes signature_1: First fuzzy hash signature
-    :param str|unicode|bytes signature_2: Second fuzzy hash signature
+    :param str|bytes signature_1: First fuzzy hash signature
+    :param str|bytes signature_2: Second fuzzy hash signature
     :return: A value from zero to 100 indicating the match score of the two signatures
     :rtype: int
     :raises FuzzyLibError: If the fuzzy library returns an internal error
-    :raises TypeError: If one of the signatures type is not str, unicode or bytes
+    :raises TypeError: If one of the signatures type is not str or bytes
     """
-    if isinstance(signature_1, six.text_type):
+    if isinstance(signature_1, str):
         signature_1 = signature_1.encode('ascii')
-    if isinstance(signature_2, six.text_type):
+    if isinstance(signature_2, str):
         signature_2 = signature_2.encode('ascii')
 
-    if not isinstance(signature_1, six.binary_type):
+    if not isinstance(signature_1, bytes):
         raise TypeError('"signature_1" must be of binary or text type')
-    if not isinstance(signature_2, six.binary_type):
+    if not isinstance(signature_2, bytes):
         raise TypeError('"signature_2" must be of binary or text type')
 
-    hash_1_buffer = ctypes.create_string_buffer(signature_1)
-    hash_2_buffer = ctypes.create_string_buffer(signature_2)
-    compare_result = fuzzy_lib.fuzzy_compare(hash_1_buffer, hash_2_buffer)
+    compare_result = _selected_backend().compare(signature_1, signature_2)
 
     if compare_result == -1:
         raise FuzzyLibError(compare_result)
@@ -61,44 +110,90 @@ def compare(signature_1, signature_2):
 def hash(data, encoding='utf-8'):
     """Compute the fuzzy hash of a string or binary data.
 
-    :param str|unicode|bytes data: The data to be fuzzy hashed
-    :param str|unicode encoding: The encoding that will be used to encode data if it is a string
+    :param str|bytes data: The data to be fuzzy hashed
+    :param str encoding: The encoding that will be used to encode data if it is a string
     :return: The fuzzy hash of the data
-    :rtype: str|unicode
+    :rtype: str
     :raises FuzzyLibError: If the fuzzy library returns an internal error
-    :raises TypeError: If data is not str, unicode or bytes
+    :raises TypeError: If data is not str or bytes
     """
-    if not isinstance(encoding, six.string_types):
+    if not isinstance(encoding, str):
         raise TypeError('"encoding" must be of string type')
 
-    if isinstance(data, six.text_type):
+    if isinstance(data, str):
         data = data.encode(encoding)
 
-    if not isinstance(data, six.binary_type):
+    if not isinstance(data, bytes):
         raise TypeError('"data" must be of binary or text type')
 
-    result_buffer = ctypes.create_string_buffer(FUZZY_MAX_RESULT)
-    file_buffer = ctypes.create_string_buffer(data)
-    # Ignoring the terminating null byte
-    hash_result = fuzzy_lib.fuzzy_hash_buf(file_buffer, len(file_buffer) - 1, result_buffer)
-    if hash_result != 0:
-        raise FuzzyLibError(hash_result)
+    return _selected_backend().hash(data)
+
+
+class FuzzyHasher(object):
+    """Computes fuzzy hash of data fed by portions.
+    The digest is the same as hash() of all portions joined together,
+    but the data doesn't have to be kept in memory at once.
+    Small portions are collected in a buffer of constant size before being passed to the backend.
+    """
+
+    BUFFER_SIZE = 1 << 16
+
+    def __init__(self):
+        self._state = _selected_backend().new()
+        self._buffer = bytearray()
+
+    def update(self, data, encoding='utf-8'):
+        """Feeds the next portion of data into the hash.
+
+        :param str|bytes data: The data to be fuzzy hashed
+        :param str encoding: The encoding that will be used to encode data if it is a string
+        :raises FuzzyLibError: If the fuzzy library returns an internal error
+        :raises TypeError: If data is not str or bytes
+        """
+        if isinstance(data, str):
+            data = data.encode(encoding)
 
-    hash_value = result_buffer.value.decode('ascii')
-    return hash_value
+        if not isinstance(data, (bytes, bytearray)):
+            raise TypeError('"data" must be of binary or text type')
+
+        if len(self._buffer) + len(data) < self.BUFFER_SIZE:
+            self._buffer += data
+            return
+
+        self._flush()
+        if len(data) < self.BUFFER_SIZE:
+            self._buffer += data
+        else:
+            self._state.update(bytes(data))
+
+    def digest(self):
+        """Computes fuzzy hash of all data fed so far, update can be continued afterwards.
+
+        :return: The fuzzy hash
+        :rtype: str
+        :raises FuzzyLibError: If the fuzzy library returns an internal error
+        """
+        self._flush()
+
+        return self._state.digest()
+
+    def _flush(self):
+        if self._buffer:
+            self._state.update(bytes(self._buffer))
+            self._buffer.clear()
 
 
 def hash_from_file(file_path):
     """
     Compute the fuzzy hash of a file.
 
-    :param str|unicode file_path: The path of the file to be hashed
+    :param str file_path: The path of the file to be hashed
     :return: The fuzzy hash of the file
-    :rtype: str|unicode
+    :rtype: str
     :raises IOError: If Python is unable to read the file
     :raises FuzzyLibError: If the fuzzy library returns an internal error
     """
-    if not isinstance(file_path, six.string_types):
+    if not isinstance(file_path, str):
         raise TypeError('"file_path" must be of string type')
 
     if not os.path.exists(file_path):
@@ -108,11 +203,13 @@ def hash_from_file(file_path):
     if not os.access(file_path, os.R_OK):
         raise IOError("File is not readable")
 
-    result_buffer = ctypes.create_string_buffer(FUZZY_MAX_RESULT)
-    file_path_buffer = ctypes.create_string_buffer(file_path.encode('utf-8'))
-    hash_result = fuzzy_lib.fuzzy_hash_filename(file_path_buffer, result_buffer)
-    if hash_result != 0:
-        raise FuzzyLibError(hash_result)
+    return _selected_backend().hash_from_file(file_path)
+
+
+def __getattr__(name):
+    if name not in _LAZY_NAMES:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
-    hash_value = result_buffer.value.decode('ascii')
-    return hash_value
+    value = getattr(importlib.import_module(f'{__name__}.{_LAZY_NAMES[name]}'), name)
+    globals()[name] = value
+    return value
@@ -0,0 +1,152 @@
+"""
+Backend calling libfuzzy from ssdeep through ctypes.
+"""
+import ctypes
+import ctypes.util
+import sys
+from os.path import join
+from os.path import split
+
+from . import FuzzyLibError
+
+name = 'libfuzzy'
+
+# The longest possible length for a fuzzy hash signature
+FUZZY_MAX_RESULT = 148
+
+
+def _library_candidates():
+    # Bundled library is used on Windows, system library from the ssdeep package elsewhere.
+    if sys.platform == 'win32':
+        is_64bits = sys.maxsize > 2 ** 32
+        yield join(split(__file__)[0], 'bin', 'fuzzy_64.dll' if is_64bits else 'fuzzy.dll')
+
+    # Usual sonames are tried first: find_library runs ldconfig or a compiler in a subprocess.
+    yield 'libfuzzy.so.2'
+    yield 'libfuzzy.so'
+    found = ctypes.util.find_library('fuzzy')
+    if found is not None:
+        yield found
+
+
+def _load_library():
+    errors = []
+    for candidate in _library_candidates():
+        try:
+            return ctypes.cdll.LoadLibrary(candidate)
+        except OSError as err:
+            errors.append(str(err))
+
+    raise OSError(f'Fuzzy library is not found: {"; ".join(errors)}')
+
+
+fuzzy_lib = _load_library()
+
+try:
+    fuzzy_lib.fuzzy_new.restype = ctypes.c_void_p
+    fuzzy_lib.fuzzy_update.argtypes = (ctypes.c_void_p, ctypes.c_char_p, ctypes.c_size_t)
+    fuzzy_lib.fuzzy_digest.argtypes = (ctypes.c_void_p, ctypes.c_char_p, ctypes.c_uint)
+    fuzzy_lib.fuzzy_free.argtypes = (ctypes.c_void_p,)
+    has_state_api = True
+except AttributeError:
+    # Libraries older than 2.10 can only hash whole buffers.
+    has_state_api = False
+
+
+class FuzzyState(object):
+    """Incremental fuzzy hash computation state of the library."""
+
+    def __init__(self):
+        self._state = fuzzy_lib.fuzzy_new()
+        if not self._state:
+            raise FuzzyLibError(-1)
+
+    def __del__(self):
+        if getattr(self, '_state', None):
+            fuzzy_lib.fuzzy_free(self._state)
+            self._state = None
+
+    def update(self, data):
+        """Feeds the next portion of data into the hash.
+
+        :param bytes data: Data to be hashed
+        :raises FuzzyLibError: If the fuzzy library returns an internal error
+        """
+        update_result = fuzzy_lib.fuzzy_update(self._state, data, len(data))
+        if update_result != 0:
+            raise FuzzyLibError(update_result)
+
+    def digest(self):
+        """Computes fuzzy hash of all data fed so far, update can be continued.
+
+        :return: The fuzzy hash
+        :rtype: str
+        :raises FuzzyLibError: If the fuzzy library returns an internal error
+        """
+        result_buffer = ctypes.create_string_buffer(FUZZY_MAX_RESULT)
+        digest_result = fuzzy_lib.fuzzy_digest(self._state, result_buffer, 0)
+        if digest_result != 0:
+            raise FuzzyLibError(digest_result)
+
+        return result_buffer.value.decode('ascii')
+
+
+def new():
+    """Creates incremental fuzzy hash computation state.
+    Built-in spamsum state is used with libraries lacking fuzzy_new, it produces the same hashes.
+
+    :rtype: FuzzyState|SpamSum
+    """
+    if has_state_api:
+        return FuzzyState()
+
+    from ._spamsum import SpamSum
+    return SpamSum()
+
+
+def compare(signature_1, signature_2):
+    """Computes the match score between two fuzzy hash signatures.
+
+    :param bytes signature_1: First fuzzy hash signature
+    :param bytes signature_2: Second fuzzy hash signature
+    :return: A value from zero to 100 indicating the match score, -1 on error
+    :rtype: int
+    """
+    hash_1_buffer = ctypes.create_string_buffer(signature_1)
+    hash_2_buffer = ctypes.create_string_buffer(signature_2)
+    return fuzzy_lib.fuzzy_compare(hash_1_buffer, hash_2_buffer)
+
+
+def hash(data):
+    """Computes the fuzzy hash of binary data.
+
+    :param bytes data: The data to be fuzzy hashed
+    :return: The fuzzy hash
+    :rtype: str
+    :raises FuzzyLibError: If the fuzzy library returns an internal error
+    """
+    result_buffer = ctypes.create_string_buffer(FUZZY_MAX_RESULT)
+    file_buffer = ctypes.create_string_buffer(data)
+    # Ignoring the terminating null byte
+    hash_result = fuzzy_lib.fuzzy_hash_buf(file_buffer, len(file_buffer) - 1, result_buffer)
+    if hash_result != 0:
+        raise FuzzyLibError(hash_result)
+
+    return result_buffer.value.decode('ascii')
+
+
+def hash_from_file(file_path):
+    """Computes the fuzzy hash of a file.
+
+    :param str file_path: The path of the file to be hashed
+    :return: The fuzzy hash
+    :rtype: str
+    :raises FuzzyLibError: If the fuzzy library returns an internal error
+    """
+    result_buffer = ctypes.create_string_buffer(FUZZY_MAX_RESULT)
+    file_path_buffer = ctypes.create_string_buffer(file_path.encode('utf-8'))
+    hash_result = fuzzy_lib.fuzzy_hash_filename(file_path_buffer, result_buffer)
+    if hash_result != 0:
+        raise FuzzyLibError(hash_result)
+
+    return result_buffer.value.decode('ascii')
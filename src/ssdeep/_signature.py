@@ -0,0 +1,75 @@
+"""
+Helpers for parsing fuzzy hash signatures the same way libfuzzy's fuzzy_compare does.
+"""
+import re
+
+# Length of the substring, which two signature components have to share to be scored.
+ROLLING_WINDOW = 7
+
+_SEQUENCE = re.compile(r'(.)\1{3,}', re.DOTALL)
+
+
+def eliminate_sequences(part):
+    """Collapses runs of more than three identical characters, which carry no information for scoring.
+
+    :param str part: Signature component
+    :return: Signature component without long runs
+    :rtype: str
+    """
+    return _SEQUENCE.sub(r'\1\1\1', part)
+
+
+def parse(signature):
+    """Splits fuzzy hash signature into block size and two components with eliminated sequences.
+
+    :param str signature: Fuzzy hash signature like "blocksize:part1:part2[,filename]"
+    :return: Block size, first and second signature components
+    :rtype: (int, str, str)
+    :raises ValueError: If the signature is malformed
+    """
+    block_size, part_1, part_2 = signature.split(':', maxsplit=2)
+    part_2 = part_2.split(',', maxsplit=1)[0]
+
+    return int(block_size), eliminate_sequences(part_1), eliminate_sequences(part_2)
+
+
+def ngrams(part, n=ROLLING_WINDOW):
+    """Collects all substrings of length n of signature component.
+
+    :param str part: Signature component
+    :param int n: Substrings length
+    :return: Set of substrings
+    :rtype: set
+    """
+    return {part[i:i + n] for i in range(len(part) - n + 1)}
+
+
+def posting_keys(parsed):
+    """Builds (block size, 7-gram) keys of parsed signature, the same in any process.
+    Key packs 7 ASCII characters of the 7-gram into the low 56 bits and bit length of the block size above them,
+    so it's a non-negative 64-bit integer which is exact for block sizes of spamsum (3 * 2^n).
+    Second component of signature is computed for doubled block size, so it is keyed with it.
+
+    :param parsed: Block size and components returned by parse()
+    :return: Set of keys, empty if components are shorter than ROLLING_WINDOW
+    :rtype: set
+    """
+    block_size, part_1, part_2 = parsed
+    keys = set()
+    for size, part in ((block_size, part_1), (block_size * 2, part_2)):
+        prefix = min(size.bit_length(), 127) << 56
+        keys.update(prefix | int.from_bytes(gram.encode('ascii', 'replace'), 'big') for gram in ngrams(part))
+
+    return keys
+
+
+def signature_keys(signature):
+    """Builds (block size, 7-gram) keys of fuzzy hash signature, e.g. for persistent inverted index.
+    Signatures with nonzero match score share at least one key, unless both are too short to have any.
+
+    :param str signature: Fuzzy hash signature
+    :return: Set of non-negative 64-bit integer keys
+    :rtype: set
+    :raises ValueError: If the signature is malformed
+    """
+    return posting_keys(parse(signature))
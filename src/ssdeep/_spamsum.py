@@ -0,0 +1,375 @@
+"""
+Pure Python/NumPy implementation of the spamsum algorithm, producing the same output as libfuzzy 2.14.
+The rolling hash and reset points are computed with NumPy over whole chunks of input,
+only the piecewise FNV hashes between reset points are computed in Python.
+NumPy is imported by hashing only, comparison of signatures is pure Python.
+"""
+from . import _signature
+
+name = 'spamsum'
+
+SPAMSUM_LENGTH = 64
+ROLLING_WINDOW = _signature.ROLLING_WINDOW
+MIN_BLOCKSIZE = 3
+HASH_INIT = 0x27
+NUM_BLOCKHASHES = 31
+
+_B64 = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/'
+_HASH_PRIME = 0x01000193
+# Partial FNV hash: only low 6 bits of the state are ever used, so the whole hash fits a 64 x 256 table.
+_SUM_TABLE = [bytes(((h * _HASH_PRIME) ^ c) & 0x3f for c in range(256)) for h in range(64)]
+# Input is processed by NumPy in chunks of this size to keep temporary arrays small.
+_CHUNK_SIZE = 1 << 20
+
+
+def _sum_hash(h, data):
+    for c in data:
+        h = _SUM_TABLE[h][c]
+    return h
+
+
+class SpamSum(object):
+    """Incremental fuzzy hash computation state, equivalent to libfuzzy's fuzzy_state."""
+
+    def __init__(self):
+        self._total_size = 0
+        self._reduce_border = MIN_BLOCKSIZE * SPAMSUM_LENGTH
+        self._bh_start = 0
+        self._bh_end = 1
+        self._h = [HASH_INIT] * NUM_BLOCKHASHES
+        self._half_h = [HASH_INIT] * NUM_BLOCKHASHES
+        # Digest holds at most SPAMSUM_LENGTH characters, the last one is overwritten until the end of input.
+        self._digest = [[] for _ in range(NUM_BLOCKHASHES)]
+        self._half_digest = [''] * NUM_BLOCKHASHES
+        self._need_last_h = False
+        self._last_h = 0
+        self._window = bytes(ROLLING_WINDOW - 1)
+        self._roll_sum = 0
+
+    def update(self, data):
+        """Feeds the next portion of data into the hash.
+
+        :param bytes|bytearray|memoryview data: Data to be hashed
+        """
+        data = memoryview(data).cast('B')
+        self._total_size += len(data)
+
+        for offset in range(0, len(data), _CHUNK_SIZE):
+            self._update_chunk(data[offset:offset + _CHUNK_SIZE].tobytes())
+
+    def digest(self):
+        """Computes fuzzy hash of all data fed so far. State is not modified, so update can be continued.
+
+        :return: The fuzzy hash
+        :rtype: str
+        """
+        bi = self._bh_start
+        while (MIN_BLOCKSIZE << bi) * SPAMSUM_LENGTH < self._total_size:
+            bi += 1
+        if bi >= self._bh_end:
+            bi = self._bh_end - 1
+        while bi > self._bh_start and self._dindex(bi) < SPAMSUM_LENGTH // 2:
+            bi -= 1
+
+        result = [f'{MIN_BLOCKSIZE << bi}:', ''.join(self._digest[bi][:SPAMSUM_LENGTH - 1])]
+        if self._roll_sum != 0:
+            result.append(_B64[self._h[bi]])
+        elif len(self._digest[bi]) == SPAMSUM_LENGTH:
+            result.append(self._digest[bi][-1])
+        result.append(':')
+
+        if bi < self._bh_end - 1:
+            bi += 1
+            result.append(''.join(self._digest[bi][:SPAMSUM_LENGTH // 2 - 1]))
+            if self._roll_sum != 0:
+                result.append(_B64[self._half_h[bi]])
+            else:
+                result.append(self._half_digest[bi])
+        elif self._roll_sum != 0:
+            result.append(_B64[self._h[bi]] if bi == 0 else _B64[self._last_h])
+
+        return ''.join(result)
+
+    def _dindex(self, i):
+        return min(len(self._digest[i]), SPAMSUM_LENGTH - 1)
+
+    def _roll_sums(self, data):
+        """Computes rolling hash sums after every byte of data at once.
+        Rolling hash depends only on the last ROLLING_WINDOW bytes, so its components are weighted window sums.
+        """
+        import numpy as np
+
+        window = np.frombuffer(self._window + data, dtype=np.uint8).astype(np.uint32)
+        size = len(data)
+
+        h1 = np.zeros(size, dtype=np.uint32)
+        h2 = np.zeros(size, dtype=np.uint32)
+        h3 = np.zeros(size, dtype=np.uint32)
+        for k in range(ROLLING_WINDOW):
+            c = window[ROLLING_WINDOW - 1 - k:ROLLING_WINDOW - 1 - k + size]
+            h1 += c
+            h2 += (ROLLING_WINDOW - k) * c
+            h3 ^= c << (5 * k)
+
+        return h1 + h2 + h3
+
+    def _update_chunk(self, data):
+        import numpy as np
+
+        if not data:
+            return
+
+        # Reset points are where (sum + 1) is a nonzero multiple of the block size.
+        reset_values = self._roll_sums(data) + np.uint32(1)
+        self._roll_sum = int(reset_values[-1]) - 1 & 0xffffffff
+        self._window = (self._window + data)[-(ROLLING_WINDOW - 1):]
+
+        # Block hashes only grow, so positions not divisible by the current smallest block size are never reset points.
+        divisible = (reset_values % np.uint32(MIN_BLOCKSIZE << self._bh_start) == 0) & (reset_values != 0)
+        positions = np.flatnonzero(divisible).tolist()
+
+        start = 0
+        for position, reset_value in zip(positions, reset_values[positions].tolist()):
+            self._sum_hash(data[start:position + 1])
+            start = position + 1
+
+            if reset_value % (MIN_BLOCKSIZE << self._bh_start) == 0:
+                self._reset(reset_value // MIN_BLOCKSIZE >> self._bh_start)
+
+        self._sum_hash(data[start:])
+
+    def _sum_hash(self, data):
+        """Feeds data into piecewise hashes of all working block sizes."""
+        if not data:
+            return
+
+        # Hashes of different block sizes often have the same state, each distinct state is computed once.
+        hashed = {}
+        for i in range(self._bh_start, self._bh_end):
+            for states in (self._h, self._half_h):
+                state = states[i]
+                if state not in hashed:
+                    hashed[state] = _sum_hash(state, data)
+                states[i] = hashed[state]
+
+        if self._need_last_h:
+            self._last_h = _sum_hash(self._last_h, data)
+
+    def _reset(self, h):
+        """Emits signature characters for all block sizes, for which the current position is a reset point."""
+        i = self._bh_start
+        while True:
+            digest = self._digest[i]
+            if not digest:
+                self._try_fork_blockhash()
+
+            char = _B64[self._h[i]]
+            self._half_digest[i] = _B64[self._half_h[i]]
+            if len(digest) < SPAMSUM_LENGTH - 1:
+                digest.append(char)
+                self._h[i] = HASH_INIT
+                if len(digest) < SPAMSUM_LENGTH // 2:
+                    self._half_h[i] = HASH_INIT
+                    self._half_digest[i] = ''
+            else:
+                digest[SPAMSUM_LENGTH - 1:] = char
+                self._try_reduce_blockhash()
+
+            if h & 1:
+                break
+            h >>= 1
+            i += 1
+            if i >= self._bh_end:
+                break
+
+    def _try_fork_blockhash(self):
+        last = self._bh_end - 1
+        if self._bh_end <= NUM_BLOCKHASHES - 1:
+            self._h[self._bh_end] = self._h[last]
+            self._half_h[self._bh_end] = self._half_h[last]
+            self._digest[self._bh_end] = []
+            self._half_digest[self._bh_end] = ''
+            self._bh_end += 1
+        elif self._bh_end == NUM_BLOCKHASHES and not self._need_last_h:
+            self._need_last_h = True
+            self._last_h = self._h[last]
+
+    def _try_reduce_blockhash(self):
+        if self._bh_end - self._bh_start < 2:
+            # Need at least two working hashes.
+            return
+        if self._reduce_border >= self._total_size:
+            # Initial block size estimate would select this or a smaller block size.
+            return
+        if self._dindex(self._bh_start + 1) < SPAMSUM_LENGTH // 2:
+            # Estimate adjustment would select this block size.
+            return
+
+        self._bh_start += 1
+        self._reduce_border *= 2
+
+
+def new():
+    """Creates incremental fuzzy hash computation state.
+
+    :rtype: SpamSum
+    """
+    return SpamSum()
+
+
+def hash(data):
+    """Computes fuzzy hash of binary data.
+
+    :param bytes data: The data to be fuzzy hashed
+    :return: The fuzzy hash
+    :rtype: str
+    """
+    state = SpamSum()
+    state.update(data)
+    return state.digest()
+
+
+def hash_from_file(file_path):
+    """Computes fuzzy hash of a file, reading it in chunks.
+
+    :param str file_path: The path of the file to be hashed
+    :return: The fuzzy hash
+    :rtype: str
+    """
+    state = SpamSum()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(_CHUNK_SIZE), b''):
+            state.update(chunk)
+    return state.digest()
+
+
+def compare(signature_1, signature_2):
+    """Computes the match score between two fuzzy hash signatures the same way fuzzy_compare does.
+
+    :param bytes signature_1: First fuzzy hash signature
+    :param bytes signature_2: Second fuzzy hash signature
+    :return: A value from zero to 100 indicating the match score, -1 if a signature is malformed
+    :rtype: int
+    """
+    try:
+        signature_1 = signature_1.decode('ascii')
+        signature_2 = signature_2.decode('ascii')
+        block_size_1 = int(signature_1.split(':', maxsplit=1)[0])
+        block_size_2 = int(signature_2.split(':', maxsplit=1)[0])
+    except (UnicodeDecodeError, ValueError):
+        return -1
+
+    # Signatures with neither equal nor adjacent block sizes can't be compared, that's not an error.
+    if block_size_1 not in (block_size_2, block_size_2 * 2) and block_size_2 != block_size_1 * 2:
+        return 0
+
+    try:
+        return score(_parse(signature_1), _parse(signature_2))
+    except ValueError:
+        return -1
+
+
+def score(parsed_1, parsed_2):
+    """Scores two signatures already split by _signature.parse.
+
+    :param (int, str, str) parsed_1: First parsed signature
+    :param (int, str, str) parsed_2: Second parsed signature
+    :return: A value from zero to 100 indicating the match score
+    :rtype: int
+    """
+    block_size_1, part_11, part_12 = parsed_1
+    block_size_2, part_21, part_22 = parsed_2
+
+    if block_size_1 == block_size_2:
+        if part_11 == part_21 and part_12 == part_22:
+            return 100
+        return max(score_strings(part_11, part_21, block_size_1), score_strings(part_12, part_22, block_size_1 * 2))
+    if block_size_1 * 2 == block_size_2:
+        return score_strings(part_21, part_12, block_size_2)
+    if block_size_1 == block_size_2 * 2:
+        return score_strings(part_11, part_22, block_size_1)
+
+    return 0
+
+
+def score_strings(part_1, part_2, block_size):
+    """Scores two signature components computed for the same block size.
+
+    :param str part_1: First signature component
+    :param str part_2: Second signature component
+    :param int block_size: Block size of components
+    :return: A value from zero to 100 indicating the match score
+    :rtype: int
+    """
+    if not has_common_substring(part_1, part_2):
+        return 0
+
+    return distance_score(part_1, part_2, block_size)
+
+
+def distance_score(part_1, part_2, block_size):
+    """Scores two signature components known to share a substring of ROLLING_WINDOW characters.
+
+    :param str part_1: First signature component
+    :param str part_2: Second signature component
+    :param int block_size: Block size of components
+    :return: A value from zero to 100 indicating the match score
+    :rtype: int
+    """
+    length = len(part_1) + len(part_2)
+    result = 100 - (100 * (edit_distance(part_1, part_2) * SPAMSUM_LENGTH // length)) // SPAMSUM_LENGTH
+
+    # When the block size is small, matches of short signatures shouldn't be exaggerated.
+    if block_size >= (99 + ROLLING_WINDOW) // ROLLING_WINDOW * MIN_BLOCKSIZE:
+        return result
+
+    return min(result, block_size // MIN_BLOCKSIZE * min(len(part_1), len(part_2)))
+
+
+def has_common_substring(part_1, part_2):
+    """Checks whether two signature components share a substring of ROLLING_WINDOW characters.
+
+    :param str part_1: First signature component
+    :param str part_2: Second signature component
+    :rtype: bool
+    """
+    if len(part_1) < ROLLING_WINDOW or len(part_2) < ROLLING_WINDOW:
+        return False
+
+    return not _signature.ngrams(part_1).isdisjoint(_signature.ngrams(part_2))
+
+
+def edit_distance(part_1, part_2):
+    """Computes edit distance with insertion and removal costing 1 and replacement costing 2.
+    Such distance equals len(part_1) + len(part_2) - 2 * LCS, LCS is computed bit-parallel.
+
+    :param str part_1: First string
+    :param str part_2: Second string
+    :rtype: int
+    """
+    matches = {}
+    for i, char in enumerate(part_1):
+        matches[char] = matches.get(char, 0) | 1 << i
+
+    mask = (1 << len(part_1)) - 1
+    row = mask
+    for char in part_2:
+        common = row & matches.get(char, 0)
+        row = ((row + common) | (row - common)) & mask
+
+    lcs = len(part_1) - bin(row).count('1')
+
+    return len(part_1) + len(part_2) - 2 * lcs
+
+
+def _parse(signature):
+    """Parses signature like fuzzy_compare does.
+
+    :return: Block size, first and second signature components
+    :raises ValueError: If the signature is malformed
+    """
+    block_size, part_1, part_2 = _signature.parse(signature)
+    if len(part_1) > SPAMSUM_LENGTH or len(part_2) > SPAMSUM_LENGTH:
+        raise ValueError('Signature component is too long')
+
+    return block_size, part_1, part_2
@@ -0,0 +1,347 @@
+"""
+Batch scoring of fuzzy hash signatures.
+Signatures are parsed once, block size compatibility is checked with NumPy for all of them at once
+and edit distance is computed only for components sharing a 7-character substring,
+so scoring many signatures doesn't cross the FFI boundary for every pair like compare() does.
+Scores are the same as compare() returns.
+"""
+import numpy as np
+
+from . import FuzzyLibError
+from . import _signature
+from . import _spamsum
+
+_ROLLING_WINDOW = _signature.ROLLING_WINDOW
+_SPAMSUM_LENGTH = _spamsum.SPAMSUM_LENGTH
+# Code of 7-gram never produced by 7 bytes, marks positions beyond the end of component.
+_NO_GRAM = np.uint64(0xFFFFFFFFFFFFFFFF)
+_BITMAP_BITS = 16
+_FIBONACCI_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+
+def compare_many(signature, signatures):
+    """Computes match scores between one fuzzy hash signature and each of the passed ones.
+
+    :param str|bytes signature: Fuzzy hash signature
+    :param signatures: Iterable of fuzzy hash signatures
+    :return: Array of match scores from zero to 100 aligned with signatures
+    :rtype: numpy.ndarray
+    :raises FuzzyLibError: If one of the signatures is malformed
+    :raises TypeError: If one of the signatures type is not str or bytes
+    """
+    query = _Signatures([signature])
+    batch = _Signatures(signatures)
+    scores = np.zeros(len(batch), dtype=np.uint8)
+
+    # Only signatures with compatible block sizes are packed for scoring.
+    compatible = np.flatnonzero(_compatible(batch.block_sizes, query.block_sizes[0]))
+    if compatible.size:
+        batch = batch.subset(compatible)
+        compatible_scores = np.zeros(len(batch), dtype=np.uint8)
+        _score_row(query, 0, batch, compatible_scores)
+        scores[compatible] = compatible_scores
+
+    return scores
+
+
+def compare_matrix(signatures, others=None):
+    """Computes match scores between fuzzy hash signatures.
+
+    If others are not passed, all pairs of signatures are scored, which is useful for clustering.
+    Only pairs sharing a (block size, 7-gram) key are really compared then.
+
+    :param signatures: Iterable of fuzzy hash signatures for matrix rows
+    :param others: Iterable of fuzzy hash signatures for matrix columns, signatures themselves if None
+    :return: Matrix of match scores from zero to 100, symmetric if others are not passed
+    :rtype: numpy.ndarray
+    :raises FuzzyLibError: If one of the signatures is malformed
+    :raises TypeError: If one of the signatures type is not str or bytes
+    """
+    rows = _Signatures(signatures)
+
+    if others is None:
+        return _all_pairs(rows)
+
+    columns = _Signatures(others)
+    scores = np.zeros((len(rows), len(columns)), dtype=np.uint8)
+    for i in range(len(rows)):
+        _score_row(rows, i, columns, scores[i])
+
+    return scores
+
+
+class _Signatures(object):
+    """Signatures with components packed into NumPy arrays for bulk 7-gram lookups.
+
+    Sequences are eliminated from packed components with NumPy as well,
+    components are parsed into strings only for signatures which are really scored.
+    Malformed components are only reported when the signature is compared,
+    like fuzzy_compare doesn't look at components of signatures with incompatible block sizes.
+    """
+
+    def __init__(self, signatures):
+        self.texts = [_to_bytes(signature) for signature in signatures]
+        self._parsed = {}
+        self._components = None
+
+        try:
+            block_sizes = [int(text.split(b':', maxsplit=1)[0]) for text in self.texts]
+        except ValueError:
+            raise FuzzyLibError(-1)
+        self.block_sizes = np.array(block_sizes, dtype=np.int64)
+
+    @property
+    def components(self):
+        """Packed first and second components, see _pack."""
+        if self._components is None:
+            self._components = _pack(self.texts)
+
+        return self._components
+
+    def __len__(self):
+        return len(self.texts)
+
+    def subset(self, indices):
+        """Selects signatures by indices without parsing them again.
+
+        :rtype: _Signatures
+        """
+        subset = _Signatures([])
+        subset.texts = [self.texts[i] for i in indices.tolist()]
+        subset.block_sizes = self.block_sizes[indices]
+
+        return subset
+
+    def parsed(self, i):
+        """Returns block size and components of i-th signature with eliminated sequences."""
+        if i not in self._parsed:
+            try:
+                self._parsed[i] = _signature.parse(self.texts[i].decode('ascii'))
+            except UnicodeDecodeError:
+                raise FuzzyLibError(-1)
+
+        return self._parsed[i]
+
+    def equal_to(self, other, i, indices):
+        """Checks which of the signatures have the same components as i-th signature of other.
+
+        :rtype: numpy.ndarray
+        """
+        result = np.ones(len(indices), dtype=bool)
+        for (chars, lengths), (other_chars, other_lengths) in zip(self.components, other.components):
+            result &= (lengths[indices] == other_lengths[i]) & (chars[indices] == other_chars[i]).all(axis=1)
+
+        return result
+
+    def check(self, indices):
+        """Ensures signatures are well-formed.
+
+        :raises FuzzyLibError: If one of the signatures is malformed
+        """
+        (_, lengths_1), (_, lengths_2) = self.components
+        if (lengths_1[indices] > _SPAMSUM_LENGTH).any() or (lengths_2[indices] > _SPAMSUM_LENGTH).any():
+            raise FuzzyLibError(-1)
+
+    def shares_gram(self, grams, part, indices):
+        """Checks which of the signatures have a component containing one of the 7-grams.
+
+        :param numpy.ndarray grams: Sorted 7-gram codes
+        :param int part: Number of component, 1 or 2
+        :param numpy.ndarray indices: Indices of checked signatures
+        :rtype: numpy.ndarray
+        """
+        chars, lengths = self.components[part - 1]
+        codes = _gram_codes(chars[indices], lengths[indices])
+
+        # Rows are prefiltered by a bitmap of multiplicative hashes of 7-grams, found ones are checked exactly.
+        bitmap = np.zeros(1 << _BITMAP_BITS, dtype=bool)
+        bitmap[_bitmap_slots(grams)] = True
+        rows = np.flatnonzero(bitmap[_bitmap_slots(codes)].any(axis=1))
+
+        result = np.zeros(len(indices), dtype=bool)
+        result[rows] = np.isin(codes[rows], grams).any(axis=1)
+
+        return result
+
+    def grams(self, i, part):
+        """Returns sorted 7-gram codes of i-th signature component."""
+        chars, lengths = self.components[part - 1]
+        codes = _gram_codes(chars[i:i + 1], lengths[i:i + 1])
+
+        return np.unique(codes[codes != _NO_GRAM])
+
+
+def _compatible(block_sizes, block_size):
+    """Checks which block sizes are equal or adjacent to the passed one.
+
+    :rtype: numpy.ndarray
+    """
+    return (block_sizes == block_size) | (block_sizes == block_size * 2) | (block_sizes * 2 == block_size)
+
+
+def _score_row(rows, i, columns, out):
+    """Scores i-th signature of rows against all columns, writing scores to out."""
+    block_size = rows.block_sizes[i]
+    others = columns.block_sizes
+    same = np.flatnonzero(others == block_size)
+    double = np.flatnonzero(others == block_size * 2)
+    half = np.flatnonzero(others * 2 == block_size)
+
+    if same.size + double.size + half.size == 0:
+        return
+
+    rows.check([i])
+    columns.check(np.concatenate((same, double, half)))
+    block_size, part_1, part_2 = rows.parsed(i)
+    grams_1 = rows.grams(i, 1)
+    grams_2 = rows.grams(i, 2)
+
+    if same.size:
+        equal = columns.equal_to(rows, i, same)
+        out[same[equal]] = 100
+        hits_1 = columns.shares_gram(grams_1, 1, same)
+        hits_2 = columns.shares_gram(grams_2, 2, same)
+        for j, hit_1, hit_2 in zip(same.tolist(), (hits_1 & ~equal).tolist(), (hits_2 & ~equal).tolist()):
+            if hit_1 or hit_2:
+                _, other_1, other_2 = columns.parsed(j)
+                out[j] = max(_spamsum.distance_score(part_1, other_1, block_size) if hit_1 else 0,
+                             _spamsum.distance_score(part_2, other_2, block_size * 2) if hit_2 else 0)
+
+    # Second component of the row and first component of the column are computed for the same block size.
+    if double.size:
+        hits = columns.shares_gram(grams_2, 1, double)
+        for j in double[hits].tolist():
+            out[j] = _spamsum.distance_score(part_2, columns.parsed(j)[1], block_size * 2)
+
+    if half.size:
+        hits = columns.shares_gram(grams_1, 2, half)
+        for j in half[hits].tolist():
+            out[j] = _spamsum.distance_score(part_1, columns.parsed(j)[2], block_size)
+
+
+def _pack(texts):
+    """Packs components of signatures into zero-padded matrices of characters eliminating sequences.
+    Malformed signatures are marked by component lengths over SPAMSUM_LENGTH.
+
+    :param list texts: Fuzzy hash signatures
+    :return: Matrix of characters and lengths for first and second components
+    :rtype: list
+    """
+    chars = np.array(texts, dtype=bytes)
+    width = chars.dtype.itemsize
+    chars = chars.view(np.uint8).reshape(len(texts), width)
+    positions = np.arange(width)
+    # Component characters are gathered from windows of padded signatures starting at component offsets.
+    windows = np.lib.stride_tricks.sliding_window_view(
+        np.pad(chars, ((0, 0), (0, _SPAMSUM_LENGTH))), _SPAMSUM_LENGTH, axis=1)
+    rows = np.arange(len(texts))
+
+    colons = chars == ord(':')
+    well_formed = colons.sum(axis=1) >= 2
+    first = np.argmax(colons, axis=1)
+    colons[rows, first] = False
+    second = np.argmax(colons, axis=1)
+    # Second component ends with filename separator or with the signature itself.
+    stops = ((chars == ord(',')) | (chars == 0)) & (positions > second[:, np.newaxis])
+    end = np.where(stops.any(axis=1), np.argmax(stops, axis=1), width)
+
+    components = []
+    for part, start, length in ((1, first + 1, second - first - 1), (2, second + 1, end - second - 1)):
+        length = np.where(well_formed, length, _SPAMSUM_LENGTH + 1)
+        part_chars = windows[rows, np.minimum(start, width)]
+        part_chars[np.arange(_SPAMSUM_LENGTH) >= length[:, np.newaxis]] = 0
+
+        # Valid signatures never have longer components, but sequence elimination may shorten them enough.
+        for i in np.flatnonzero(well_formed & (length > _SPAMSUM_LENGTH)).tolist():
+            eliminated = _signature.parse(texts[i].decode('ascii', 'replace'))[part].encode('ascii', 'replace')
+            length[i] = len(eliminated)
+            if length[i] <= _SPAMSUM_LENGTH:
+                part_chars[i] = np.frombuffer(eliminated.ljust(_SPAMSUM_LENGTH, b'\0'), dtype=np.uint8)
+
+        components.append(_eliminate_sequences(part_chars, length))
+
+    return components
+
+
+def _eliminate_sequences(chars, lengths):
+    """Drops every character repeating three previous ones, like _signature.eliminate_sequences does.
+
+    :param numpy.ndarray chars: Matrix of components characters
+    :param numpy.ndarray lengths: Lengths of components, ones over SPAMSUM_LENGTH are kept as is
+    :return: Matrix of characters and lengths of components without long runs
+    :rtype: (numpy.ndarray, numpy.ndarray)
+    """
+    repeated = np.zeros(chars.shape, dtype=bool)
+    repeated[:, 3:] = ((chars[:, 3:] == chars[:, 2:-1]) & (chars[:, 3:] == chars[:, 1:-2]) &
+                       (chars[:, 3:] == chars[:, :-3]))
+    repeated &= np.arange(_SPAMSUM_LENGTH) < lengths[:, np.newaxis]
+    lengths = np.where(lengths > _SPAMSUM_LENGTH, lengths, lengths - repeated.sum(axis=1))
+
+    # Only components with runs are compacted, kept characters are moved to the front preserving order.
+    rows = np.flatnonzero(repeated.any(axis=1))
+    if rows.size:
+        keep = ~repeated[rows]
+        order = np.argsort(~keep, axis=1, kind='stable')
+        compacted = np.take_along_axis(chars[rows], order, axis=1)
+        compacted[np.arange(_SPAMSUM_LENGTH) >= lengths[rows, np.newaxis]] = 0
+        chars[rows] = compacted
+
+    return chars, lengths
+
+
+def _gram_codes(chars, lengths):
+    """Encodes each 7-gram of components into a 56-bit integer, positions out of component get _NO_GRAM.
+    Codes are read as overlapping little-endian 64-bit words with the eighth byte masked out.
+    """
+    width = _SPAMSUM_LENGTH - _ROLLING_WINDOW + 1
+    padded = np.zeros((len(chars), _SPAMSUM_LENGTH + 8), dtype=np.uint8)
+    padded[:, :_SPAMSUM_LENGTH] = chars
+    words = np.lib.stride_tricks.as_strided(padded.view('<u8'), shape=(len(chars), width),
+                                            strides=(padded.strides[0], 1))
+    codes = words & np.uint64(0x00FFFFFFFFFFFFFF)
+    codes[np.arange(width) > lengths[:, np.newaxis] - _ROLLING_WINDOW] = _NO_GRAM
+
+    return codes
+
+
+def _bitmap_slots(codes):
+    return (codes * _FIBONACCI_MULTIPLIER) >> np.uint64(64 - _BITMAP_BITS)
+
+
+def _all_pairs(batch):
+    """Scores all pairs of signatures comparing only pairs sharing a (block size, 7-gram) key."""
+    size = len(batch)
+    batch.check(np.arange(size))
+    parsed = [batch.parsed(i) for i in range(size)]
+    scores = np.zeros((size, size), dtype=np.uint8)
+    np.fill_diagonal(scores, 100)
+
+    groups = {}
+    for i, (block_size, part_1, part_2) in enumerate(parsed):
+        keys = {(block_size, part_1[j:j + _ROLLING_WINDOW]) for j in range(len(part_1) - _ROLLING_WINDOW + 1)}
+        keys.update((block_size * 2, part_2[j:j + _ROLLING_WINDOW])
+                    for j in range(len(part_2) - _ROLLING_WINDOW + 1))
+        # Identical signatures score 100 even when they are too short to have any 7-gram.
+        keys.add(parsed[i])
+        for key in keys:
+            groups.setdefault(key, []).append(i)
+
+    pairs = set()
+    for ids in groups.values():
+        for k, i in enumerate(ids):
+            pairs.update((i, j) for j in ids[k + 1:])
+
+    for i, j in pairs:
+        scores[i, j] = scores[j, i] = _spamsum.score(parsed[i], parsed[j])
+
+    return scores
+
+
+def _to_bytes(signature):
+    if isinstance(signature, str):
+        return signature.encode('ascii')
+
+    if not isinstance(signature, bytes):
+        raise TypeError('Signature must be of binary or text type')
+
+    return signature
@@ -0,0 +1,162 @@
+"""
+Inverted index over fuzzy hash signatures for fast similarity search.
+"""
+import heapq
+
+import numpy as np
+
+from . import _signature
+from .batch import compare_many
+
+# Pending postings are scanned linearly on query only while there are few of them.
+_MAX_PENDING_SCAN = 1 << 12
+# Pending postings are merged into sorted arrays in batches of so many postings.
+_MERGE_SIZE = 1 << 20
+
+
+class FuzzyHashIndex(object):
+    """Index of fuzzy hash signatures keyed by (block size, 7-gram).
+
+    Two signatures have nonzero match score only if their block sizes are equal or adjacent
+    and the components computed for the same block size share a 7-character substring.
+    Therefore only signatures sharing at least one key with the queried one are really compared.
+
+    Postings are kept as a sorted NumPy array of 64-bit keys with aligned signature ids,
+    so the index takes about 12 bytes per key. Key collisions only add candidates, which are compared anyway.
+    """
+
+    def __init__(self):
+        self._keys = []
+        self._signatures = []
+        self._ids = {}
+        self._removed = 0
+        self._posting_hashes = np.empty(0, dtype=np.uint64)
+        self._posting_ids = np.empty(0, dtype=np.uint32)
+        self._pending_hashes = []
+        self._pending_ids = []
+        # Identical signatures score 100 even when they are too short to have any 7-gram.
+        self._short = {}
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, key):
+        return key in self._ids
+
+    def add(self, key, signature):
+        """Adds signature to the index, replacing the previous signature stored under the same key.
+
+        :param key: Hashable key identifying the signature, e.g. document path
+        :param str signature: Fuzzy hash signature
+        :raises ValueError: If the signature is malformed
+        """
+        parsed = _signature.parse(signature)
+        postings = _postings_of(parsed)
+
+        if key in self._ids:
+            self.remove(key)
+
+        id_ = len(self._keys)
+        self._keys.append(key)
+        self._signatures.append(signature)
+        self._ids[key] = id_
+
+        if not postings:
+            self._short.setdefault(parsed, set()).add(id_)
+
+        self._pending_hashes.extend(postings)
+        self._pending_ids.extend([id_] * len(postings))
+
+        if len(self._pending_hashes) >= _MERGE_SIZE:
+            self._merge()
+
+    def remove(self, key):
+        """Removes signature stored under the key from the index.
+
+        :param key: Key of the signature
+        :raises KeyError: If there is no such key in the index
+        """
+        id_ = self._ids.pop(key)
+
+        parsed = _signature.parse(self._signatures[id_])
+        if parsed in self._short:
+            self._short[parsed].discard(id_)
+            if not self._short[parsed]:
+                del self._short[parsed]
+
+        # Postings of removed signatures are skipped on query until the index is compacted.
+        self._keys[id_] = None
+        self._signatures[id_] = None
+        self._removed += 1
+
+        if self._removed > len(self._keys) // 2:
+            self._compact()
+
+    def candidates(self, signature):
+        """Collects keys of signatures which may have nonzero match score with the passed one.
+
+        :param str signature: Fuzzy hash signature
+        :return: Set of keys
+        :rtype: set
+        """
+        parsed = _signature.parse(signature)
+        postings = _postings_of(parsed)
+        ids = set(self._short.get(parsed, ()))
+
+        if len(self._pending_hashes) > _MAX_PENDING_SCAN:
+            self._merge()
+
+        if postings:
+            hashes = np.fromiter(postings, dtype=np.uint64, count=len(postings))
+            starts = np.searchsorted(self._posting_hashes, hashes, side='left')
+            ends = np.searchsorted(self._posting_hashes, hashes, side='right')
+            for start, end in zip(starts.tolist(), ends.tolist()):
+                if start < end:
+                    ids.update(self._posting_ids[start:end].tolist())
+
+            ids.update(id_ for posting, id_ in zip(self._pending_hashes, self._pending_ids) if posting in postings)
+
+        return {self._keys[id_] for id_ in ids if self._keys[id_] is not None}
+
+    def query(self, signature, threshold=1, k=None):
+        """Finds stored signatures most similar to the passed one.
+
+        :param str signature: Fuzzy hash signature
+        :param int threshold: Minimal match score of returned signatures
+        :param int|None k: Maximal number of returned signatures, all of them if None
+        :return: List of (key, score) pairs sorted by descending score
+        :rtype: list
+        """
+        keys = list(self.candidates(signature))
+        scores = compare_many(signature, [self._signatures[self._ids[key]] for key in keys])
+        matched = [(key, score) for key, score in zip(keys, scores.tolist()) if score >= max(threshold, 1)]
+
+        if k is None:
+            return sorted(matched, key=lambda item: item[1], reverse=True)
+
+        return heapq.nlargest(k, matched, key=lambda item: item[1])
+
+    def _merge(self):
+        """Merges pending postings into sorted arrays in linear time."""
+        hashes = np.array(self._pending_hashes, dtype=np.uint64)
+        ids = np.array(self._pending_ids, dtype=np.uint32)
+        order = np.argsort(hashes, kind='stable')
+        hashes, ids = hashes[order], ids[order]
+
+        positions = np.searchsorted(self._posting_hashes, hashes, side='right')
+        self._posting_hashes = np.insert(self._posting_hashes, positions, hashes)
+        self._posting_ids = np.insert(self._posting_ids, positions, ids)
+        self._pending_hashes = []
+        self._pending_ids = []
+
+    def _compact(self):
+        """Rebuilds the index without postings of removed signatures."""
+        live = [(key, signature) for key, signature in zip(self._keys, self._signatures) if key is not None]
+        self.__init__()
+        for key, signature in live:
+            self.add(key, signature)
+
+
+def _postings_of(parsed):
+    """Keys of parsed signature, see _signature.posting_keys."""
+    return _signature.posting_keys(parsed)
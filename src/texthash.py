@@ -0,0 +1,75 @@
+# Copyright 2022 aaaaaaaalesha
+
+"""
+NumPy primitives of text fingerprints shared by MinHash and winnowing: finding word bytes in chunk of UTF-8 text
+and hashing its substrings. NumPy is imported on first call.
+"""
+
+# Odd multiplier of polynomial hashes, so it's invertible modulo 2^64.
+_BASE = 0x100000001B3
+
+
+def word_mask(chunk, markup: bool = False):
+    """
+    Finds bytes of words in chunk of lowercased UTF-8 text: ASCII letters and digits and any non-ASCII characters
+    except Latin-1 and general punctuation.
+    :param chunk: uint8 array
+    :param markup: if True, chunk is XML markup and bytes inside tags aren't word ones
+    :return: bool array
+    """
+    import numpy as np
+
+    is_word = (chunk >= 0x80) | ((chunk >= ord('0')) & (chunk <= ord('9'))) | \
+              ((chunk >= ord('a')) & (chunk <= ord('z'))) | ((chunk >= ord('A')) & (chunk <= ord('Z')))
+
+    # U+00A0..U+00BF: no-break space, guillemets, section sign and other Latin-1 punctuation.
+    lead = np.flatnonzero((chunk[:-1] == 0xC2) & (chunk[1:] >= 0xA0) & (chunk[1:] <= 0xBF))
+    is_word[lead] = is_word[lead + 1] = False
+    # U+2000..U+207F: spaces, dashes, quotes, ellipsis and other general punctuation.
+    lead = np.flatnonzero((chunk[:-2] == 0xE2) & ((chunk[1:-1] == 0x80) | (chunk[1:-1] == 0x81)))
+    is_word[lead] = is_word[lead + 1] = is_word[lead + 2] = False
+
+    if markup:
+        depth = np.cumsum((chunk == ord('<')).astype(np.int64) - (chunk == ord('>')))
+        is_word &= depth <= 0
+
+    return is_word
+
+
+def substring_hashes(chunk, starts, ends):
+    """
+    Hashes substrings as polynomials of their bytes: prefix sums of b_i * B^i give hash of any substring
+    multiplied by B^start, which is removed by modular inverse. Arithmetic is modulo 2^64.
+    :param chunk: uint8 array
+    :param starts: array of start offsets of substrings
+    :param ends: array of end offsets of substrings
+    :return: uint64 array of hashes
+    """
+    import numpy as np
+
+    if not len(starts):
+        return np.empty(0, dtype=np.uint64)
+
+    size = len(chunk)
+    powers = np.cumprod(np.full(size, _BASE, dtype=np.uint64))
+    powers = np.concatenate((np.ones(1, dtype=np.uint64), powers[:-1]))
+    inverse = np.cumprod(np.full(size, pow(_BASE, -1, 1 << 64), dtype=np.uint64))
+    inverse = np.concatenate((np.ones(1, dtype=np.uint64), inverse[:-1]))
+
+    sums = np.concatenate((np.zeros(1, dtype=np.uint64), np.cumsum(chunk.astype(np.uint64) * powers)))
+    return mix((sums[ends] - sums[starts]) * inverse[starts])
+
+
+def mix(values):
+    """
+    Finalizer of MurmurHash3 spreading every input bit over the whole 64-bit hash.
+    :param values: uint64 array
+    :return: uint64 array
+    """
+    import numpy as np
+
+    values = values ^ (values >> np.uint64(33))
+    values = values * np.uint64(0xFF51AFD7ED558CCD)
+    values = values ^ (values >> np.uint64(33))
+    values = values * np.uint64(0xC4CEB9FE1A85EC53)
+    return values ^ (values >> np.uint64(33))
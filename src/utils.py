@@ -2,10 +2,12 @@
 
 import base64
 import os
+import struct
+import time
 import zipfile
+import zlib
 import hashlib
-
-from bs4 import BeautifulSoup
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, Optional, Tuple, Union
 
 
 def encode_base64_id(text: str) -> str:
@@ -47,54 +49,338 @@ def get_files_list(path: str) -> list:
     return out_list
 
 
-def zip_path_to_file(dir_path: str, file_path: str) -> None:
+def rewrite_zip(src_path: str, dst_path: str,
+                transforms: Dict[str, Callable[[Optional[bytes]], Optional[bytes]]]) -> None:
     """
-    Zips all files and subdirectories from directory path in file_path
-    :param dir_path: path to directory for zipping
-    :param file_path: out file path for zipping
+    Copies ZIP archive from src_path to dst_path in a single pass, regenerating only members from transforms.
+    Compressed data of all other members is copied as is, without inflating and deflating it again.
+    Members of transforms missing in source archive are built from None and appended, unless None is built.
+    Archive is written to a temporary file next to dst_path and moved in place when complete, so readers and
+    concurrent writers of dst_path never see a partially written archive. Rewriting archive in place is safe too.
+    :param src_path: path to source ZIP archive
+    :param dst_path: out file path for rewritten archive
+    :param transforms: dict of member name -> function building new member content from the original one
     :return: None
     """
-    if os.path.exists(file_path):
-        os.remove(file_path)
+    with open(src_path, 'rb') as src, zipfile.ZipFile(src, 'r') as zip_in:
+        tmp_path = temporary_path(dst_path)
+        try:
+            with open(tmp_path, 'xb') as dst, zipfile.ZipFile(dst, 'w') as zip_out:
+                for info in zip_in.infolist():
+                    if info.filename in transforms:
+                        new_info = zipfile.ZipInfo(info.filename, info.date_time)
+                        new_info.external_attr = info.external_attr
+                        new_info.compress_type = zipfile.ZIP_DEFLATED
+                        zip_out.writestr(new_info, transforms[info.filename](zip_in.read(info)))
+                    else:
+                        _copy_raw_member(src, info, zip_out)
+
+                for name, transform in transforms.items():
+                    if name in zip_out.NameToInfo:
+                        continue
+                    content = transform(None)
+                    if content is not None:
+                        zip_out.writestr(zipfile.ZipInfo(name, time.localtime()[:6]), content,
+                                         compress_type=zipfile.ZIP_DEFLATED)
+
+                zip_out.comment = zip_in.comment
+
+            os.replace(tmp_path, dst_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+
+def temporary_path(path: str) -> str:
+    """
+    Builds unique name of hidden temporary file in the same folder as path, so it can be moved to path atomically.
+    :param path: path to file
+    :return: path to temporary file
+    """
+    import secrets
+
+    folder, name = os.path.split(path)
+    return os.path.join(folder, f'.{name}.{secrets.token_hex(4)}.tmp')
+
+
+def _copy_raw_member(src, info: zipfile.ZipInfo, zip_out: zipfile.ZipFile) -> None:
+    """
+    Copies compressed data of archive member to zip_out without recompression.
+    :param src: binary file object of source archive
+    :param info: source archive member info
+    :param zip_out: archive opened for writing
+    :return: None
+    """
+    # Skip local file header of source member: 30 fixed bytes, file name and extra field.
+    src.seek(info.header_offset + 26)
+    name_length, extra_length = struct.unpack('<HH', src.read(4))
+    src.seek(name_length + extra_length, os.SEEK_CUR)
+
+    # Sizes and CRC are already known, so new local header is written without trailing data descriptor.
+    info.flag_bits &= ~0x08
+    info.header_offset = zip_out.fp.tell()
+    zip_out.fp.write(info.FileHeader())
+
+    remaining = info.compress_size
+    while remaining > 0:
+        chunk = src.read(min(remaining, 1 << 20))
+        if not chunk:
+            raise zipfile.BadZipFile(f'Truncated data of member {info.filename}.')
+        zip_out.fp.write(chunk)
+        remaining -= len(chunk)
+
+    zip_out.filelist.append(info)
+    zip_out.NameToInfo[info.filename] = info
+    zip_out.start_dir = zip_out.fp.tell()
+
+
+# ZIP records, the same layouts as zipfile uses.
+_END_RECORD = struct.Struct('<4s4H2LH')
+_END_RECORD_SIGNATURE = b'PK\x05\x06'
+_ZIP64_LOCATOR = struct.Struct('<4sLQL')
+_ZIP64_LOCATOR_SIGNATURE = b'PK\x06\x07'
+_ZIP64_END_RECORD = struct.Struct('<4sQ2H2L4Q')
+_ZIP64_END_RECORD_SIGNATURE = b'PK\x06\x06'
+_CENTRAL_HEADER = struct.Struct('<4s4B4HL2L5H2L')
+_CENTRAL_HEADER_SIGNATURE = b'PK\x01\x02'
+_LOCAL_HEADER = struct.Struct('<4s2B4HL2L2H')
+_LOCAL_HEADER_SIGNATURE = b'PK\x03\x04'
+_ZIP64_EXTRA_ID = 0x0001
+_MAX_COMMENT_SIZE = 0xFFFF
+
+
+def read_zip_member(source: Union[str, BinaryIO], name: str) -> bytes:
+    """
+    Reads single member of ZIP archive touching only the end of central directory record, central directory
+    and the member itself, e.g. docProps/core.xml of a huge document on a network share.
+    Members compressed by other methods than stored and deflated are read by zipfile.
+    :param source: path to archive or seekable binary file object, it's not closed
+    :param name: member name
+    :return: member content
+    :raises KeyError: if archive has no such member
+    :raises zipfile.BadZipFile: if source isn't a valid ZIP archive
+    """
+    members = read_zip_members(source, (name,))
+    if name not in members:
+        raise KeyError(f'There is no item named {name!r} in the archive')
+
+    return members[name]
+
+
+def read_zip_members(source: Union[str, BinaryIO], names: Iterable[str]) -> Dict[str, bytes]:
+    """
+    Reads several members of ZIP archive like read_zip_member, central directory is read once for all of them.
+    :param source: path to archive or seekable binary file object, it's not closed
+    :param names: member names
+    :return: dict of member name -> content, missing members are absent
+    :raises zipfile.BadZipFile: if source isn't a valid ZIP archive
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as file:
+            return read_zip_members(file, names)
+
+    cd_offset, cd_size, concat = _locate_central_directory(source)
+    central_directory = _read_at(source, cd_offset, cd_size)
+
+    members = {}
+    for name in names:
+        try:
+            header = _find_central_header(central_directory, name)
+        except KeyError:
+            continue
+        members[name] = _read_member(source, name, header, concat)
+
+    return members
+
+
+def _read_member(source: BinaryIO, name: str, header: Tuple[int, int, int, int, int], concat: int) -> bytes:
+    """
+    Reads member content by its central directory header.
+    :param source: seekable binary file object
+    :param name: member name
+    :param header: member fields found by _find_central_header
+    :param concat: number of bytes prepended to archive
+    :return: member content
+    """
+    flags, method, crc, compressed_size, header_offset = header
+    if flags & 0x1 or method not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+        # Encrypted or compressed by rare method.
+        source.seek(0)
+        with zipfile.ZipFile(source) as zip_ref:
+            return zip_ref.read(name)
+
+    header_offset += concat
+    local_header = _LOCAL_HEADER.unpack(_read_at(source, header_offset, _LOCAL_HEADER.size))
+    if local_header[0] != _LOCAL_HEADER_SIGNATURE:
+        raise zipfile.BadZipFile(f'Bad magic number for file header of {name!r}')
+
+    name_length, extra_length = local_header[10], local_header[11]
+    data = _read_at(source, header_offset + _LOCAL_HEADER.size + name_length + extra_length, compressed_size)
+    content = zlib.decompress(data, -zlib.MAX_WBITS) if method == zipfile.ZIP_DEFLATED else data
 
-    if not os.path.isdir(dir_path):
-        raise NotADirectoryError(f'{dir_path} is not directory.')
+    if zlib.crc32(content) != crc:
+        raise zipfile.BadZipFile(f'Bad CRC-32 for file {name!r}')
 
-    with zipfile.ZipFile(file_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-        for root, dirs, files in os.walk(dir_path):
-            for file in files:
-                filename = os.path.join(root, file)
-                relpath = os.path.relpath(os.path.join(root, file), dir_path)
-                zipf.write(filename, relpath)
+    return content
 
 
-def extract_xml_tags(path: str, out_list: list, tag_name: str, attrs=False) -> None:
+def _locate_central_directory(file: BinaryIO) -> Tuple[int, int, int]:
     """
-    Finds all tags in xml file and appends its str representation content to out_list.
+    Finds central directory by the end of central directory record (and its ZIP64 counterpart, if any).
+    :param file: seekable binary file object
+    :return: offset of central directory in file, its size and number of bytes prepended to archive
+    """
+    size = file.seek(0, os.SEEK_END)
+    tail_size = min(size, _END_RECORD.size + _MAX_COMMENT_SIZE)
+    tail = _read_at(file, size - tail_size, tail_size)
+
+    # Record without comment is the last 22 bytes, otherwise the comment follows it.
+    position = tail.rfind(_END_RECORD_SIGNATURE, 0, len(tail) - _END_RECORD.size + len(_END_RECORD_SIGNATURE))
+    if position < 0:
+        raise zipfile.BadZipFile('File is not a zip file')
+
+    end_offset = size - tail_size + position
+    _, _, _, _, entries, cd_size, cd_offset, _ = _END_RECORD.unpack_from(tail, position)
+
+    if entries == 0xFFFF or 0xFFFFFFFF in (cd_size, cd_offset):
+        locator_offset = end_offset - _ZIP64_LOCATOR.size
+        if locator_offset >= 0 and \
+                _read_at(file, locator_offset, _ZIP64_LOCATOR.size)[:4] == _ZIP64_LOCATOR_SIGNATURE:
+            # ZIP64 end record is expected right before the locator, like zipfile does.
+            end_offset = locator_offset - _ZIP64_END_RECORD.size
+            record = _ZIP64_END_RECORD.unpack(_read_at(file, end_offset, _ZIP64_END_RECORD.size))
+            if record[0] != _ZIP64_END_RECORD_SIGNATURE:
+                raise zipfile.BadZipFile('Corrupt ZIP64 end of central directory record')
+            cd_size, cd_offset = record[8], record[9]
+
+    # Archive may be appended to other data, e.g. self-extracting executable.
+    concat = end_offset - cd_size - cd_offset
+    if concat < 0:
+        raise zipfile.BadZipFile('Bad offset of central directory')
+
+    return cd_offset + concat, cd_size, concat
+
+
+def _find_central_header(central_directory: bytes, name: str) -> Tuple[int, int, int, int, int]:
+    """
+    Finds central directory header of member by its name, the last one wins like in zipfile.
+    :param central_directory: central directory content
+    :param name: member name
+    :return: flags, compression method, CRC-32, compressed size and local header offset of member
+    """
+    # Names are encoded in UTF-8 or, in old archives, in cp437.
+    encoded_names = {name.encode('utf-8')}
+    try:
+        encoded_names.add(name.encode('cp437'))
+    except UnicodeEncodeError:
+        pass
+
+    found = None
+    for encoded in encoded_names:
+        position = central_directory.find(encoded)
+        while position >= 0:
+            header = position - _CENTRAL_HEADER.size
+            if header >= 0 and central_directory[header:header + 4] == _CENTRAL_HEADER_SIGNATURE:
+                fields = _CENTRAL_HEADER.unpack_from(central_directory, header)
+                if fields[12] == len(encoded) and (found is None or header > found[0]):
+                    found = header, fields
+            position = central_directory.find(encoded, position + 1)
+
+    if found is None:
+        raise KeyError(f'There is no item named {name!r} in the archive')
+
+    header, fields = found
+    flags, method, crc, compressed_size, file_size = fields[5], fields[6], fields[9], fields[10], fields[11]
+    extra_length, header_offset = fields[13], fields[18]
+
+    if 0xFFFFFFFF in (compressed_size, file_size, header_offset):
+        extra_start = header + _CENTRAL_HEADER.size + fields[12]
+        values = iter(_zip64_extra(central_directory[extra_start:extra_start + extra_length]))
+        # Only fields overflowed in the header are stored in the extra field, in this order.
+        if file_size == 0xFFFFFFFF:
+            next(values, None)
+        if compressed_size == 0xFFFFFFFF:
+            compressed_size = next(values)
+        if header_offset == 0xFFFFFFFF:
+            header_offset = next(values)
+
+    return flags, method, crc, compressed_size, header_offset
+
+
+def _zip64_extra(extra: bytes) -> Tuple[int, ...]:
+    position = 0
+    while position + 4 <= len(extra):
+        extra_id, length = struct.unpack_from('<HH', extra, position)
+        if extra_id == _ZIP64_EXTRA_ID:
+            data = extra[position + 4:position + 4 + length]
+            return struct.unpack_from(f'<{len(data) // 8}Q', data)
+        position += 4 + length
+
+    raise zipfile.BadZipFile('Missing ZIP64 extra field')
+
+
+def _read_at(file: BinaryIO, offset: int, size: int) -> bytes:
+    file.seek(offset)
+    data = file.read(size)
+    if len(data) != size:
+        raise zipfile.BadZipFile('Truncated ZIP archive')
+
+    return data
+
+
+def iter_xml_tags(path: str, tag_name: str, attrs=False) -> Iterator[str]:
+    """
+    Finds all tags in xml file and yields its str representation content one by one.
     :param path: path to xml file
-    :param out_list: list for tags content extracting
     :param tag_name: name of tags we are searching for
-    :param attrs: if True adds full tag, otherwise – only string content inside
-    :return: None
+    :param attrs: if True yields full tag, otherwise – only string content inside
+    :return: iterator over tags content
     """
+    # BeautifulSoup is heavy to import and only this reference implementation needs it.
+    from bs4 import BeautifulSoup
+
     with open(path, encoding='utf-8') as file:
         soup = BeautifulSoup(file.read(), 'xml')
-        for tag in soup.find_all(tag_name):
-            if attrs:
-                out_list.append(str(tag))
+
+    for tag in soup.find_all(tag_name):
+        if attrs:
+            yield str(tag)
+            continue
+
+        if tag.string is not None:
+            if tag.get('xml:space') is not None:
+                yield ' '
                 continue
+            yield tag.string
 
-            if tag.string is not None:
-                if tag.get('xml:space') is not None:
-                    out_list.append(' ')
-                    continue
-                out_list.append(tag.string)
 
+# Size of chunks files are hashed by.
+HASH_CHUNK_SIZE = 1 << 20
 
-def get_file_sha3(path: str) -> str:
-    sha3 = None
-    with open(path, 'rb') as f:
-        data = bytes(f.read())
-        sha3 = hashlib.sha3_256(data).hexdigest()
 
-    return sha3
+def get_file_digests(path: str, algorithms=('sha3_256',)) -> Dict[str, str]:
+    """
+    Computes several digests of file in a single pass.
+    File is read by fixed-size chunks into one reused buffer, so memory usage doesn't depend on file size.
+    :param path: path to file
+    :param algorithms: names of hashlib algorithms, e.g. 'sha3_256', 'sha256', 'blake2b'
+    :return: dict of algorithm name -> hex digest
+    """
+    hashers = {name: hashlib.new(name) for name in algorithms}
+    buffer = bytearray(HASH_CHUNK_SIZE)
+    view = memoryview(buffer)
+
+    with open(path, 'rb', buffering=0) as f:
+        while True:
+            size = f.readinto(buffer)
+            if not size:
+                break
+            for hasher in hashers.values():
+                hasher.update(view[:size])
+
+    return {name: hasher.hexdigest() for name, hasher in hashers.items()}
+
+
+def get_file_sha3(path: str) -> str:
+    return get_file_digests(path)['sha3_256']
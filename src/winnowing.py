@@ -0,0 +1,167 @@
+# Copyright 2022 aaaaaaaalesha
+
+"""
+Winnowing fingerprints of text (Schleimer, Wilkerson, Aiken, 2003) for finding excerpts of marked documents.
+Text is normalized to lowercase word characters, so spacing, punctuation and line breaks of the excerpt don't matter.
+All KGRAM_SIZE-byte substrings of normalized text are hashed and the minimal hash of every WINDOW_SIZE consecutive
+ones is selected. Any common substring of at least GUARANTEED_SIZE normalized bytes therefore has a common
+fingerprint, while only about 2 / (WINDOW_SIZE + 1) of hashes are kept.
+"""
+
+import os
+from typing import Set
+
+import src.constants as const
+from src.texthash import substring_hashes, word_mask
+
+KGRAM_SIZE = 50
+WINDOW_SIZE = 100
+GUARANTEED_SIZE = WINDOW_SIZE + KGRAM_SIZE - 1
+# Query files with these extensions are read as markup, only text between tags is fingerprinted.
+MARKUP_EXTENSIONS = ('.html', '.htm', '.xml')
+
+# Text is collected and fingerprinted in chunks of this size in bytes.
+_CHUNK_SIZE = 1 << 20
+_MAX_HASH = (1 << 64) - 1
+
+
+class Winnower:
+    """
+    Class implements winnowing of text fed by pieces, e.g. streamed from document parts.
+    Normalized text of the last window is kept between chunks, so fingerprints don't depend on how text is split.
+    """
+
+    def __init__(self, markup: bool = False):
+        """
+        :param markup: if True, text is XML markup and only text between tags is fingerprinted, e.g. .xlsx sheetData
+        """
+        self.__markup = markup
+        self.__buffer = bytearray()
+        self.__fingerprints: Set[int] = set()
+        # Normalized bytes of the last WINDOW_SIZE - 1 k-grams, windows continue over chunks.
+        self.__tail = b''
+
+    def update(self, text: str) -> None:
+        """
+        Feeds the next piece of text.
+        :param text: piece of text
+        :return: None
+        """
+        self.__buffer += text.lower().encode('utf-8')
+        if len(self.__buffer) < _CHUNK_SIZE:
+            return
+
+        data, rest = bytes(self.__buffer), b''
+        if self.__markup:
+            # Unclosed tag is processed with the next chunk.
+            opened = data.rfind(b'<')
+            if opened > data.rfind(b'>'):
+                data, rest = data[:opened], data[opened:]
+
+        self.__tail = self.__winnow(self.__tail + self.__normalized(data), self.__fingerprints)
+        self.__buffer = bytearray(rest)
+
+    def fingerprints(self) -> Set[int]:
+        """
+        Selects fingerprints of all text fed so far, update can be continued afterwards.
+        Text shorter than a window gets the minimal hash of its k-grams as the only fingerprint.
+        :return: set of signed 64-bit fingerprints, empty if normalized text is shorter than KGRAM_SIZE
+        """
+        fingerprints = set(self.__fingerprints)
+        tail = self.__winnow(self.__tail + self.__normalized(bytes(self.__buffer)), fingerprints)
+        if not fingerprints and len(tail) >= KGRAM_SIZE:
+            fingerprints.update(_signed(_kgram_hashes(tail).min(keepdims=True)))
+
+        return fingerprints
+
+    def __normalized(self, data: bytes) -> bytes:
+        import numpy as np
+
+        chunk = np.frombuffer(data, dtype=np.uint8)
+        return chunk[word_mask(chunk, self.__markup)].tobytes()
+
+    @staticmethod
+    def __winnow(normalized: bytes, fingerprints: Set[int]) -> bytes:
+        """
+        Adds minimal hashes of all complete windows of normalized text to fingerprints.
+        :return: normalized bytes to be prepended to the next chunk
+        """
+        if len(normalized) < GUARANTEED_SIZE:
+            return normalized
+
+        import numpy as np
+
+        # Consecutive windows mostly share their minimum, so fingerprints are deduplicated before leaving NumPy.
+        minimums = _window_minimums(_kgram_hashes(normalized), WINDOW_SIZE)
+        selected = minimums[np.concatenate(([True], minimums[1:] != minimums[:-1]))]
+        fingerprints.update(_signed(np.unique(selected)))
+        return normalized[len(normalized) - GUARANTEED_SIZE + 1:]
+
+
+def text_fingerprints(text: str, markup: bool = False) -> Set[int]:
+    """
+    Selects winnowing fingerprints of text.
+    :param text: text
+    :param markup: if True, only text between tags is fingerprinted
+    :return: set of fingerprints
+    """
+    winnower = Winnower(markup)
+    winnower.update(text)
+    return winnower.fingerprints()
+
+
+def file_fingerprints(path: str) -> Set[int]:
+    """
+    Selects winnowing fingerprints of file content: text of .docx/.xlsx document (the same one fuzzy hash is
+    computed of) or any other file read as UTF-8 text, e.g. saved email body.
+    :param path: path to file
+    :return: set of fingerprints
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension in const.DOC_EXTENSIONS:
+        import zipfile
+
+        import src.extractor as extractor
+
+        winnower = Winnower(markup=extractor.CONTENT_TAGS[extension][1])
+        with zipfile.ZipFile(path) as zip_ref:
+            for piece in extractor.iter_document_content(zip_ref, extension):
+                winnower.update(piece)
+
+        return winnower.fingerprints()
+
+    winnower = Winnower(markup=extension in MARKUP_EXTENSIONS)
+    with open(path, encoding='utf-8', errors='replace') as file:
+        for text in iter(lambda: file.read(_CHUNK_SIZE), ''):
+            winnower.update(text)
+
+    return winnower.fingerprints()
+
+
+def _kgram_hashes(normalized: bytes):
+    import numpy as np
+
+    chunk = np.frombuffer(normalized, dtype=np.uint8)
+    starts = np.arange(len(chunk) - KGRAM_SIZE + 1)
+    return substring_hashes(chunk, starts, starts + KGRAM_SIZE)
+
+
+def _window_minimums(hashes, window: int):
+    """
+    Computes minimums of all windows in linear time (van Herk/Gil-Werman): hashes are split into blocks of window
+    size and each window is covered by the suffix of one block and the prefix of the next one.
+    """
+    import numpy as np
+
+    count = len(hashes) - window + 1
+    padding = np.full(-len(hashes) % window, _MAX_HASH, dtype=np.uint64)
+    blocks = np.concatenate((hashes, padding)).reshape(-1, window)
+
+    prefixes = np.minimum.accumulate(blocks, axis=1).ravel()
+    suffixes = np.minimum.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].ravel()
+    return np.minimum(suffixes[:count], prefixes[window - 1:window - 1 + count])
+
+
+def _signed(hashes) -> list:
+    # SQLite integers are signed 64-bit ones.
+    return hashes.view('i8').tolist()
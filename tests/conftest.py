@@ -0,0 +1,92 @@
+# Copyright 2022 aaaaaaaalesha
+
+import random
+import zipfile
+
+import pytest
+
+from src.identifier.injector import IdentifierInjector
+
+CORE_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\r\n'
+    '<cp:coreProperties xmlns:cp="http://schemas.openxmlformats.org/package/2006/metadata/core-properties" '
+    'xmlns:dc="http://purl.org/dc/elements/1.1/"><dc:creator>Ivan Petrov</dc:creator></cp:coreProperties>'
+)
+CONTENT_TYPES_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\r\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/word/document.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    '<Override PartName="/docProps/core.xml" '
+    'ContentType="application/vnd.openxmlformats-package.core-properties+xml"/></Types>'
+)
+RELS_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\r\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="word/document.xml"/>'
+    '<Relationship Id="rId2" '
+    'Type="http://schemas.openxmlformats.org/package/2006/relationships/metadata/core-properties" '
+    'Target="docProps/core.xml"/></Relationships>'
+)
+DOCUMENT_XML = (
+    '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>{}</w:body>'
+    '</w:document>'
+)
+
+
+def _make_paragraphs_document(path, paragraphs: list, core_xml: str = CORE_XML) -> str:
+    body = ''.join(f'<w:p><w:r><w:t>{text}</w:t></w:r></w:p>' for text in paragraphs)
+    with zipfile.ZipFile(path, 'w') as zip_out:
+        zip_out.writestr('[Content_Types].xml', CONTENT_TYPES_XML)
+        zip_out.writestr('_rels/.rels', RELS_XML)
+        zip_out.writestr('docProps/core.xml', core_xml)
+        zip_out.writestr('word/document.xml', DOCUMENT_XML.format(body))
+
+    return str(path)
+
+
+def _make_document(path, text: str, core_xml: str = CORE_XML) -> str:
+    return _make_paragraphs_document(path, [text] * 50, core_xml)
+
+
+def _random_paragraphs(seed: int, count: int = 200) -> list:
+    rnd = random.Random(seed)
+    words = [''.join(rnd.choice('абвгдежзиклмнопрстуф') for _ in range(6)) for _ in range(3000)]
+    return [' '.join(rnd.choice(words) for _ in range(30)) for _ in range(count)]
+
+
+@pytest.fixture
+def make_document():
+    """
+    Factory of minimal .docx documents repeating text in 50 paragraphs: make_document(path, text[, core_xml]).
+    """
+    return _make_document
+
+
+@pytest.fixture
+def make_paragraphs_document():
+    """
+    Factory of minimal .docx documents of passed paragraphs: make_paragraphs_document(path, paragraphs[, core_xml]).
+    """
+    return _make_paragraphs_document
+
+
+@pytest.fixture
+def random_paragraphs():
+    """
+    Generator of reproducible paragraphs of random words: random_paragraphs(seed[, count]).
+    """
+    return _random_paragraphs
+
+
+@pytest.fixture
+def source_document(tmp_path) -> str:
+    return _make_document(tmp_path / 'source.docx', 'confidential report')
+
+
+@pytest.fixture
+def marked_document(tmp_path, source_document) -> str:
+    return IdentifierInjector(source_document).inject_identifier(str(tmp_path / 'out'))
@@ -0,0 +1,26 @@
+# Copyright 2022 aaaaaaaalesha
+
+import os
+
+from src.identifier.batch import inject_many
+from src.identifier.injector import is_injected
+
+
+def test_inject_many_same_names(tmp_path, make_document):
+    paths = []
+    for i in range(8):
+        (tmp_path / 'in' / str(i)).mkdir(parents=True)
+        paths.append(make_document(tmp_path / 'in' / str(i) / 'report.docx', f'report {i}'))
+
+    # Relative folders are kept under the output one.
+    results = list(inject_many(paths, str(tmp_path / 'out1'), jobs=2, roots=[str(tmp_path / 'in')]))
+    assert all(result.ok for result in results)
+    assert sorted(result.out_path for result in results) == \
+           sorted(str(tmp_path / 'out1' / str(i) / 'report.docx') for i in range(8))
+    assert all(is_injected(result.out_path) for result in results)
+
+    # Without roots all files would be written to the same output file.
+    results = list(inject_many(paths, str(tmp_path / 'out2'), jobs=2))
+    assert [result.ok for result in results] == [True] + [False] * 7
+    assert 'already written' in results[1].error
+    assert os.listdir(tmp_path / 'out2') == ['report.docx']
@@ -0,0 +1,43 @@
+# Copyright 2022 aaaaaaaalesha
+
+from benchmarks import startup
+from benchmarks.corpus import CorpusItem, make_corpus
+from benchmarks.suite import regressions, run
+from src.identifier.injector import IdentifierInjector
+
+CORPUS = (
+    CorpusItem('doc.docx', {'paragraphs': 20, 'headers': 1, 'footers': 1}),
+    CorpusItem('sheet.xlsx', {'rows': 20, 'sheets': 2}),
+    CorpusItem('image.png', {'width': 64, 'height': 48}),
+)
+
+
+def test_suite(tmp_path):
+    paths = make_corpus(str(tmp_path / 'corpus'), CORPUS)
+    others = {path: IdentifierInjector(path).inject_identifier(str(tmp_path / 'marked')) for path in paths}
+
+    results = run(paths, repeat=1, others=others)
+
+    assert [item['file'] for item in results] == ['doc.docx', 'sheet.xlsx', 'image.png']
+    assert list(results[0]['stages']) == ['extract', 'parse', 'hash', 'minhash', 'rewrite_core', 'rezip', 'inject',
+                                         'compare']
+    assert list(results[2]['stages']) == ['hash', 'inject', 'compare']
+
+    slower = [{**item, 'stages': {stage: {**timings, 'median': timings['median'] * 2 + 0.01}
+                                  for stage, timings in item['stages'].items()}} for item in results]
+    assert len(regressions(slower, results, threshold=0.5)) == 19
+    assert regressions(results, slower, threshold=0.5) == []
+
+
+def test_startup_loads_only_needed_modules():
+    results = startup.run(repeat=1)
+
+    assert list(results) == ['python', 'help', 'compare_documents', 'compare_images', 'inject_document',
+                             'inject_image']
+    assert results['help']['heavy_modules'] == []
+    for name, result in list(results.items())[1:]:
+        assert result['unexpected_modules'] == [], name
+    assert 'PIL' in results['compare_images']['heavy_modules']
+
+    slower = {name: {**timings, 'median': timings['median'] * 2} for name, timings in results.items()}
+    assert len(startup.regressions(slower, results, threshold=0.5)) == 6
@@ -0,0 +1,49 @@
+# Copyright 2022 aaaaaaaalesha
+
+import os
+import shutil
+
+from src.identifier.batch import inject_many
+from src.identifier.cache import FingerprintCache
+
+
+def test_fingerprint_cache(tmp_path):
+    path = tmp_path / 'a.bin'
+    path.write_bytes(b'original content')
+
+    with FingerprintCache(str(tmp_path / 'cache.db'), max_bytes=2000) as cache:
+        assert cache.get(str(path)) is None
+        cache.put(str(path), {'fuzzy_hash': '3:abc:def'})
+        assert cache.get(str(path)) == {'fuzzy_hash': '3:abc:def'}
+
+        # Touched or moved file with the same content is found by digest.
+        os.utime(path, ns=(0, 0))
+        moved = tmp_path / 'b.bin'
+        shutil.copy(path, moved)
+        assert cache.get(str(path)) == {'fuzzy_hash': '3:abc:def'}
+        assert cache.get(str(moved)) == {'fuzzy_hash': '3:abc:def'}
+
+        path.write_bytes(b'changed content')
+        assert cache.get(str(path)) is None
+        assert cache.stats == (1, 2, 2, 0)
+
+        for i in range(20):
+            item = tmp_path / f'{i}.bin'
+            item.write_bytes(str(i).encode())
+            cache.put(str(item), {})
+
+        # Entry takes more than 200 bytes: path, 128 hex digits of digest and row overhead.
+        assert len(cache) < 10
+        assert cache.stats.evictions > 0
+
+
+def test_inject_many_cached(tmp_path, source_document):
+    cache_path = str(tmp_path / 'cache.db')
+
+    first = list(inject_many([source_document], str(tmp_path / 'out1'), cache_path=cache_path))
+    second = list(inject_many([source_document], str(tmp_path / 'out2'), cache_path=cache_path))
+
+    assert first[0].ok and not first[0].cached
+    assert second[0].ok and second[0].cached
+    with open(first[0].out_path, 'rb') as out1, open(second[0].out_path, 'rb') as out2:
+        assert out1.read() == out2.read()
@@ -0,0 +1,57 @@
+# Copyright 2022 aaaaaaaalesha
+
+import io
+import os
+import tempfile
+import zipfile
+
+import src.extractor as extractor
+import src.utils as utils
+from benchmarks.corpus import make_docx
+from src.identifier.injector import IdentifierInjector
+
+XML = (
+    b'<?xml version="1.0" encoding="UTF-8"?>'
+    b'<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>'
+    b'<w:p><w:r><w:t>Hello &amp; welcome</w:t></w:r><w:r><w:t xml:space="preserve">  </w:t></w:r></w:p>'
+    b'<w:p><w:r><w:t>second</w:t><!-- note --></w:r></w:p>'
+    b'<sheetData xmlns="urn:s"><row r="1" a=\'x"y\'><c>1</c>  <c/></row></sheetData>'
+    b'</w:body></w:document>'
+)
+
+
+def test_iter_xml_content_matches_beautifulsoup(tmp_path):
+    path = tmp_path / 'document.xml'
+    path.write_bytes(XML)
+
+    for tag_name, attrs in (('w:t', False), ('sheetData', True), ('w:p', True), ('c', False)):
+        # Pieces may be split differently, only concatenated content is hashed.
+        expected = ''.join(utils.iter_xml_tags(str(path), tag_name, attrs))
+        assert ''.join(extractor.iter_xml_content(io.BytesIO(XML), tag_name, attrs)) == expected
+
+
+def test_hashing_reads_only_content_members(tmp_path, monkeypatch):
+    path = tmp_path / 'report.docx'
+    make_docx(str(path), paragraphs=50, headers=1, footers=1)
+    with zipfile.ZipFile(path, 'a') as zip_out:
+        zip_out.writestr('word/media/image1.png', os.urandom(1 << 20))
+        zip_out.writestr('word/theme/theme1.xml', '<theme/>')
+
+    def forbidden(*args, **kwargs):
+        raise AssertionError('Nothing should be extracted to disk')
+
+    opened = []
+    zip_open = zipfile.ZipFile.open
+
+    def open_member(self, name, *args, **kwargs):
+        opened.append(getattr(name, 'filename', name))
+        return zip_open(self, name, *args, **kwargs)
+
+    monkeypatch.setattr(tempfile, 'mkdtemp', forbidden)
+    monkeypatch.setattr(zipfile.ZipFile, 'extract', forbidden)
+    monkeypatch.setattr(zipfile.ZipFile, 'extractall', forbidden)
+    monkeypatch.setattr(zipfile.ZipFile, 'open', open_member)
+
+    IdentifierInjector(str(path))
+
+    assert sorted(opened) == ['docProps/core.xml', 'word/document.xml', 'word/footer1.xml', 'word/header1.xml']
@@ -0,0 +1,30 @@
+# Copyright 2022 aaaaaaaalesha
+
+import random
+
+from src.identifier.hamming import HammingIndex
+
+
+def _distance(hashes1, hashes2) -> int:
+    return sum(bin(h1 ^ h2).count('1') for h1, h2 in zip(hashes1, hashes2))
+
+
+def test_hamming_index_matches_linear_scan():
+    rnd = random.Random(0)
+    centers = [tuple(rnd.getrandbits(64) for _ in range(3)) for _ in range(10)]
+    items = {}
+    index = HammingIndex(3)
+    for i in range(6000):
+        items[i] = tuple(value ^ (1 << rnd.randrange(64)) ^ (1 << rnd.randrange(64)) for value in rnd.choice(centers))
+        index.add(i, items[i])
+
+    for i in range(0, 6000, 3):
+        index.remove(i)
+        del items[i]
+
+    for center in centers:
+        expected = sorted(_distance(hashes, center) for hashes in items.values())
+        assert [distance for _, distance in index.nearest(center, k=25)] == expected[:25]
+        assert sorted(distance for _, distance in index.within(center, 40)) == [d for d in expected if d <= 40]
+        for key, distance in index.nearest(center, k=5):
+            assert _distance(items[key], center) == distance
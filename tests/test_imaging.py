@@ -0,0 +1,27 @@
+# Copyright 2022 aaaaaaaalesha
+
+import imagehash
+import numpy
+from PIL import Image
+
+import src.imaging as imaging
+
+
+def test_hash_image_matches_imagehash(tmp_path):
+    y, x = numpy.mgrid[0:300, 0:400]
+    pixels = numpy.stack([x % 256, y % 256, (x * y) % 256], axis=-1).astype(numpy.uint8)
+    path = str(tmp_path / 'image.png')
+    Image.fromarray(pixels).save(path)
+
+    with Image.open(path) as img:
+        expected = imaging.ImageHashes(
+            str(imagehash.average_hash(img)),
+            str(imagehash.dhash(img)),
+            str(imagehash.phash(img)),
+            str(imagehash.colorhash(img)),
+        )
+
+    assert imaging.hash_image(path) == expected
+    results = list(imaging.hash_many([path, str(tmp_path / 'missing.png'), path], jobs=2))
+    assert [result.hashes for result in results] == [expected, None, expected]
+    assert not results[1].ok
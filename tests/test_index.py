@@ -0,0 +1,99 @@
+# Copyright 2022 aaaaaaaalesha
+
+import random
+import sqlite3
+
+import src.constants as const
+from src.identifier import checker
+from src.identifier import index as fingerprint_index
+from src.identifier.index import FingerprintIndex, build_index
+from src.identifier.injector import IdentifierInjector
+
+
+def test_document_postings(tmp_path, make_paragraphs_document, random_paragraphs):
+    paragraphs = random_paragraphs(0, 100)
+    variants = [paragraphs, paragraphs[:90] + random_paragraphs(1, 10), paragraphs[:50], random_paragraphs(2, 100)]
+    marked = [IdentifierInjector(make_paragraphs_document(tmp_path / f'{i}.docx', variant))
+              .inject_identifier(str(tmp_path / 'out')) for i, variant in enumerate(variants)]
+    fields = checker.parse_file_identifier(marked[0])
+    # Fuzzy hash too short to have any 7-gram matches only itself.
+    short = {**fields, const.FUZZY_HASH: '3:ab:cd', const.CONTENT_MINHASH: const.NOT_FOUND}
+
+    with FingerprintIndex(str(tmp_path / 'index.db')) as index:
+        for path in marked:
+            index.add(path)
+        index.add_fields(str(tmp_path / 'short.docx'), short)
+
+        matches = index.query(fields, k=10)
+        assert [match.path for match in matches][:3] == marked[:3]
+        assert str(tmp_path / 'short.docx') not in [match.path for match in matches]
+        assert [match.path for match in index.query(short)] == [str(tmp_path / 'short.docx')]
+        # Content is found by LSH bands of MinHash signature even if fuzzy hash doesn't match.
+        by_content = index.query({**fields, const.FUZZY_HASH: '3:xy:zw'}, k=2)
+        assert [match.path for match in by_content] == marked[:2] and by_content[0].score == 100
+
+        index.remove(marked[1])
+        assert marked[1] not in [match.path for match in index.query(fields)]
+
+    # Loaded in memory, index finds the same documents.
+    with FingerprintIndex(str(tmp_path / 'index.db'), in_memory=True) as index:
+        assert index.query(fields, k=10) == [match for match in matches if match.path != marked[1]]
+
+    # Index created before postings were stored gets them on open.
+    with sqlite3.connect(str(tmp_path / 'index.db')) as connection:
+        connection.execute('DELETE FROM fuzzy_postings')
+        connection.execute('DELETE FROM minhash_bands')
+        connection.execute('PRAGMA user_version = 0')
+    connection.close()
+    with FingerprintIndex(str(tmp_path / 'index.db')) as index:
+        assert [match.path for match in index.query(fields, k=2)] == [marked[0], marked[2]]
+        assert [match.path for match in index.query({**fields, const.FUZZY_HASH: '3:xy:zw'}, k=1)] == [marked[0]]
+
+
+def test_build_index(tmp_path, monkeypatch, make_document, marked_document, source_document):
+    monkeypatch.setattr(fingerprint_index, 'BULK_SIZE', 2)
+    other = IdentifierInjector(make_document(tmp_path / 'other.docx', 'other report')).inject_identifier(
+        str(tmp_path / 'other'))
+
+    # File without identifier fails alone, files of the same transaction are committed.
+    results = list(build_index(str(tmp_path / 'index.db'), [marked_document, source_document, other]))
+    assert [result.ok for result in results] == [True, False, True]
+    with FingerprintIndex(str(tmp_path / 'index.db')) as index:
+        assert len(index) == 2
+        assert index.query(marked_document, k=1)[0].path == marked_document
+
+
+def test_image_postings(tmp_path):
+    generator = random.Random(0)
+    hashes = [[generator.getrandbits(64) for _ in fingerprint_index.IMG_HASH_FIELDS] for _ in range(300)]
+    paths = [str(tmp_path / f'{i}.png') for i in range(len(hashes))]
+
+    with FingerprintIndex(str(tmp_path / 'index.db')) as index:
+        for path, values in zip(paths, hashes):
+            index.add_fields(path, {const.FROM_FILE: 'source.png',
+                                    **{name: f'{value:016x}' for name, value in
+                                       zip(fingerprint_index.IMG_HASH_FIELDS, values)}})
+
+        # Near duplicate differs from the first image in a few bits of every hash.
+        query = {name: f'{value ^ 0b1011:016x}' for name, value in zip(fingerprint_index.IMG_HASH_FIELDS, hashes[0])}
+        matches = index.query(query, k=3)
+        assert matches[0].path == paths[0] and matches[0].score == 97
+        assert matches[0].fields[const.FROM_FILE] == 'source.png'
+        # The nearest image is found by probing alone, the rest are found by comparing with all images.
+        assert index.query(query, k=1) == matches[:1]
+
+        index.remove(paths[0])
+        matches = index.query(query, k=5)
+        assert paths[0] not in [match.path for match in matches]
+
+    # Loaded in memory, index finds images as close, ties may be broken in other order.
+    with FingerprintIndex(str(tmp_path / 'index.db'), in_memory=True) as index:
+        assert [match.score for match in index.query(query, k=5)] == [match.score for match in matches]
+
+    # Index created before substrings of image hashes were stored gets them on open.
+    with sqlite3.connect(str(tmp_path / 'index.db')) as connection:
+        connection.execute('DELETE FROM image_substrings')
+        connection.execute('PRAGMA user_version = 2')
+    connection.close()
+    with FingerprintIndex(str(tmp_path / 'index.db')) as index:
+        assert index.query(query, k=5) == matches
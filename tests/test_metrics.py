@@ -0,0 +1,43 @@
+# Copyright 2022 aaaaaaaalesha
+
+import json
+
+import src.metrics as metrics
+from src.identifier import checker
+from src.identifier.batch import inject_many
+
+
+def test_metrics(tmp_path, source_document):
+    registry = metrics.enable()
+    try:
+        results = list(inject_many([source_document], str(tmp_path / 'out')))
+        checker.identity_check(results[0].out_path, results[0].out_path)
+
+        summary = registry.summary()
+        assert summary['counters']['inject_files'] == 1
+        assert summary['counters']['compare_files'] == 2
+        for stage in ('inject.read_core', 'inject.extract_parse', 'inject.ssdeep', 'inject.minhash',
+                      'inject.build_core', 'inject.build_custom', 'inject.write', 'compare.parse_identifier',
+                      'compare.score'):
+            assert summary['stages'][stage]['count'] >= 1
+
+        # Snapshot taken in worker process is added to the main registry.
+        worker = metrics.Registry()
+        worker.count('inject_files', 2)
+        worker.observe('inject.write', 100.)
+        registry.merge(worker.snapshot())
+        assert registry.summary()['counters']['inject_files'] == 3
+        assert registry.summary()['stages']['inject.write']['buckets']['+Inf'] == 2
+
+        registry.write(str(tmp_path / 'metrics.json'))
+        registry.write(str(tmp_path / 'metrics.prom'))
+    finally:
+        metrics.disable()
+
+    with open(tmp_path / 'metrics.json', encoding='utf-8') as file:
+        assert json.load(file)['counters']['inject_files'] == 3
+
+    prometheus = (tmp_path / 'metrics.prom').read_text(encoding='utf-8')
+    assert 'fuzzy_docmarking_inject_files_total 3\n' in prometheus
+    assert 'fuzzy_docmarking_stage_seconds_count{stage="inject.write"} 2\n' in prometheus
+    assert not metrics.enabled()
@@ -0,0 +1,84 @@
+# Copyright 2022 aaaaaaaalesha
+
+import random
+
+import src.constants as const
+import src.minhash as minhash
+from src.identifier import checker
+from src.identifier.index import FingerprintIndex, build_index
+from src.identifier.injector import IdentifierInjector
+
+
+def test_min_hasher(random_paragraphs):
+    text = ' '.join(random_paragraphs(0))
+    signature = minhash.minhash(text)
+
+    # Signature doesn't depend on how text is split into pieces and chunks.
+    hasher = minhash.MinHasher()
+    for i in range(0, len(text), 777):
+        hasher.update(text[i:i + 777].upper())
+    assert hasher.hexdigest() == signature
+
+    markup = minhash.MinHasher(markup=True)
+    for piece in ('<row r="1"><c r="A1" t="s">', '<v>Привет, «мир»</v>', '</c></row>'):
+        markup.update(piece)
+    assert minhash.compare(markup.hexdigest(), minhash.minhash('привет мир')) == 100
+
+    assert minhash.minhash(' ,.— ') is None
+    assert minhash.compare(signature, minhash.minhash(' '.join(random_paragraphs(1)))) == 0
+
+
+def test_minhash_index(random_paragraphs):
+    paragraphs = random_paragraphs(0)
+    signatures = [minhash.minhash(' '.join(paragraphs[:count])) for count in (200, 180, 160)]
+    index = minhash.MinHashIndex()
+    for i, signature in enumerate(signatures):
+        index.add(i, signature)
+    index.add('other', minhash.minhash(' '.join(random_paragraphs(1))))
+
+    # Band keys are stored in database as signed 64-bit integers.
+    keys = minhash.band_keys(minhash.decode_signature(signatures[0]))
+    assert len(set(keys)) == minhash.LSH_BANDS and all(0 <= key < 1 << 63 for key in keys)
+
+    matches = index.query(signatures[0])
+    assert [key for key, _ in matches] == [0, 1, 2] and matches[0][1] == 1
+    assert index.candidates(signatures[2]) == {0, 1, 2}
+
+    # Replaced and removed signatures aren't found, compaction keeps the rest.
+    index.add(0, signatures[2])
+    index.remove(1)
+    index.remove('other')
+    assert len(index) == 2 and 1 not in index
+    assert sorted(index.query(signatures[2]), key=str) == [(0, 1.0), (2, 1.0)]
+
+
+def test_reordered_and_partial_documents(tmp_path, make_paragraphs_document, random_paragraphs):
+    paragraphs = random_paragraphs(0)
+    reordered = random.Random(1).sample(paragraphs, len(paragraphs))
+    documents = {
+        'source': make_paragraphs_document(tmp_path / 'source.docx', paragraphs),
+        'reordered': make_paragraphs_document(tmp_path / 'reordered.docx', reordered),
+        'half': make_paragraphs_document(tmp_path / 'half.docx', paragraphs[:100] + random_paragraphs(2, 100)),
+        'other': make_paragraphs_document(tmp_path / 'other.docx', random_paragraphs(3)),
+    }
+    marked = {name: IdentifierInjector(path).inject_identifier(str(tmp_path / name))
+              for name, path in documents.items()}
+    fields = {name: checker.parse_file_identifier(path) for name, path in marked.items()}
+
+    similarity = {name: minhash.compare(fields['source'][const.CONTENT_MINHASH], fields[name][const.CONTENT_MINHASH])
+                  for name in fields}
+    # Paragraphs are joined without spaces like fuzzy hash content, so only words at their borders differ.
+    assert similarity['source'] == 100 and similarity['reordered'] >= 75
+    assert 20 <= similarity['half'] <= 50
+    assert similarity['other'] == 0
+    assert ' Content MinHash ' in checker.identity_check(marked['source'], marked['half'])
+
+    results = list(build_index(str(tmp_path / 'index.db'), [*marked.values(), documents['source']]))
+    assert [result.ok for result in results] == [True] * 4 + [False]
+    assert 'has no identifier' in results[-1].error
+
+    with FingerprintIndex(str(tmp_path / 'index.db')) as index:
+        matches = index.query(marked['source'], k=4)
+
+    assert [match.path for match in matches][:3] == [marked['source'], marked['reordered'], marked['half']]
+    assert matches[2].score >= 20
@@ -0,0 +1,70 @@
+# Copyright 2022 aaaaaaaalesha
+
+import asyncio
+import json
+
+import pytest
+
+import src.constants as const
+from src.identifier import checker
+from src.identifier.pipeline import compare_paths
+from src.identifier.results import ResultsSink, write_compare_results
+
+
+def test_compare_paths(tmp_path, source_document, marked_document):
+    (tmp_path / 'broken.docx').write_bytes(b'not a zip')
+
+    paths = [marked_document] * 20 + [str(tmp_path / 'broken.docx'), source_document]
+
+    session = checker.ComparisonSession(marked_document)
+
+    async def collect():
+        return [result async for result in compare_paths(session, iter(paths), jobs=3, queue_size=1)]
+
+    results = asyncio.run(collect())
+    assert sorted(result.path for result in results) == sorted(paths)
+    assert sum(result.ok for result in results) == 20
+    assert all('100 %' in result.table for result in results if result.ok)
+
+
+def test_comparison_session_hashes_target_once(tmp_path, monkeypatch, marked_document):
+    calls = []
+    monkeypatch.setattr(checker, 'get_file_sha3', lambda path: calls.append(path) or 'sha3')
+    with checker.ComparisonSession(marked_document, str(tmp_path / 'results.csv')) as session:
+        results = list(session.compare_many([marked_document, marked_document, str(tmp_path / 'missing.docx')]))
+
+    assert calls == [marked_document]
+    assert [result.ok for result in results] == [True, True, False]
+    assert (tmp_path / 'results.csv').read_text(encoding='utf-8').count('sha3') == 2
+
+
+def test_results_sink_formats(tmp_path):
+    fields = {'Filename': 'a.docx', 'Fuzzy hash': '3:a:b', 'Hash integrity': True}
+    for extension in ('.csv', '.jsonl'):
+        to_file = str(tmp_path / f'results{extension}')
+        for _ in range(2):
+            with ResultsSink(to_file, batch_size=2) as sink:
+                for _ in range(3):
+                    sink.write((fields, fields), 'a.docx', 'sha3')
+
+        lines = (tmp_path / f'results{extension}').read_text(encoding='utf-8').splitlines()
+        # Header is written only once in .csv file.
+        assert len(lines) == (7 if extension == '.csv' else 6)
+        if extension == '.jsonl':
+            assert json.loads(lines[-1])['Matching'] == '100 %'
+        else:
+            assert lines[-1].endswith('100 %')
+
+    # Rows with content similarity column don't match the header of existing .csv file.
+    with_minhash = {**fields, const.CONTENT_MINHASH: const.NOT_FOUND}
+    with pytest.raises(ValueError, match='other columns'):
+        write_compare_results((with_minhash, with_minhash), str(tmp_path / 'results.csv'), 'a.docx', 'sha3')
+
+    # Parquet file can't be appended, but it's rewritten with earlier results.
+    pyarrow_parquet = pytest.importorskip('pyarrow.parquet')
+    to_file = str(tmp_path / 'results.parquet')
+    with ResultsSink(to_file, batch_size=2) as sink:
+        for _ in range(3):
+            sink.write((fields, fields), 'a.docx', 'sha3')
+    write_compare_results((fields, fields), to_file, 'a.docx', 'sha3')
+    assert pyarrow_parquet.read_table(to_file).column('Matching').to_pylist() == ['100 %'] * 4
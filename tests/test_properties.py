@@ -0,0 +1,108 @@
+# Copyright 2022 aaaaaaaalesha
+
+import io
+import zipfile
+
+import src.constants as const
+from src.identifier import checker
+from src.identifier.injector import IdentifierInjector
+from src.identifier.properties import CoreProperties, CustomProperties, read_identifier
+
+CORE_XML = (
+    b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\r\n'
+    b'<cp:coreProperties xmlns:cp="http://schemas.openxmlformats.org/package/2006/metadata/core-properties" '
+    b'xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:dcterms="http://purl.org/dc/terms/">'
+    b'<dc:creator>Ivan Petrov</dc:creator><dcterms:created>2021-05-30T11:51:00Z</dcterms:created>'
+    b'<cp:keywords>old</cp:keywords></cp:coreProperties>'
+)
+
+
+def test_core_properties_round_trip():
+    core = CoreProperties(CORE_XML)
+    assert core.creator == 'Ivan Petrov'
+    assert core.created == '2021-05-30T11:51:00Z'
+    assert core.modified is None
+    assert core.description is None
+
+    core.keywords = '3::'
+    core.description = 'aWQ='
+    core_xml = core.serialize()
+    assert core_xml.startswith(b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>')
+
+    parsed = CoreProperties(core_xml)
+    assert (parsed.creator, parsed.keywords, parsed.description) == ('Ivan Petrov', '3::', 'aWQ=')
+    assert core_xml.count(b'<cp:keywords>') == 1
+
+
+def test_read_identifier_matches_core_properties():
+    root = (
+        '<cp:coreProperties xmlns:cp="http://schemas.openxmlformats.org/package/2006/metadata/core-properties" '
+        'xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:x="urn:other">{}</cp:coreProperties>'
+    )
+    variants = [
+        '<dc:description>aWQ=</dc:description><cp:keywords>3:ab+/:cd</cp:keywords>',
+        '<dc:description/><cp:keywords></cp:keywords>',
+        '<dc:description>aWQ=</dc:description><dc:identifier>128:AAAA</dc:identifier>',
+        '<dc:description xml:lang="en">a &amp; b &#1080;\r\nc</dc:description>',
+        '<x:description>other namespace</x:description>',
+        '<dc:description><![CDATA[aWQ=]]></dc:description>',
+        '<dc:description>a<!-- comment -->b</dc:description>',
+        '<description xmlns="http://purl.org/dc/elements/1.1/">default namespace</description>',
+    ]
+    for variant in variants:
+        core_xml = ('<?xml version="1.0" encoding="UTF-8"?>' + root.format(variant)).encode('utf-8')
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zip_out:
+            zip_out.writestr('word/media/image1.png', b'\0' * 1000)
+            zip_out.writestr(const.CORE, core_xml)
+
+        core = CoreProperties(core_xml)
+        assert read_identifier(archive) == (core.description, core.keywords, None), variant
+
+
+def test_read_minhash_matches_custom_properties():
+    root = (
+        '<Properties xmlns="http://schemas.openxmlformats.org/officeDocument/2006/custom-properties" '
+        'xmlns:vt="http://schemas.openxmlformats.org/officeDocument/2006/docPropsVTypes">{}</Properties>'
+    )
+    prop = '<property fmtid="{{D5CDD505-2E9C-101B-9397-08002B2CF9AE}}" pid="{}" name="{}">{}</property>'
+    variants = [
+        '',
+        prop.format(2, 'Client', '<vt:lpwstr>ACME</vt:lpwstr>'),
+        prop.format(2, 'Client', '<vt:lpwstr>ACME</vt:lpwstr>') +
+        prop.format(3, const.DOC_MINHASH_PROPERTY, '<vt:lpwstr>128:AAAA</vt:lpwstr>'),
+        prop.format(2, const.DOC_MINHASH_PROPERTY, '<vt:lpwstr>a &amp; b\r\nc</vt:lpwstr>'),
+        prop.format(2, const.DOC_MINHASH_PROPERTY, '<vt:lpwstr></vt:lpwstr>'),
+        prop.format(2, const.DOC_MINHASH_PROPERTY, '<vt:i4>5</vt:i4>'),
+        prop.format(2, const.DOC_MINHASH_PROPERTY, '<vt:lpwstr><![CDATA[128:AAAA]]></vt:lpwstr>'),
+        prop.format(2, const.DOC_MINHASH_PROPERTY, '<t:lpwstr xmlns:t="urn:other">128:AAAA</t:lpwstr>'),
+    ]
+    for variant in variants:
+        custom_xml = ('<?xml version="1.0" encoding="UTF-8"?>' + root.format(variant)).encode('utf-8')
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zip_out:
+            zip_out.writestr(const.CORE, CORE_XML)
+            zip_out.writestr(const.CUSTOM, custom_xml)
+
+        expected = CustomProperties(custom_xml).get(const.DOC_MINHASH_PROPERTY)
+        assert read_identifier(archive).minhash == expected, variant
+
+
+def test_injection_keeps_core_identifier(tmp_path, make_document):
+    core_xml = CORE_XML.replace(b'</cp:coreProperties>', b'<dc:identifier>DMS-2024-00042</dc:identifier>'
+                                                          b'</cp:coreProperties>').decode('utf-8')
+    source = make_document(tmp_path / 'source.docx', 'confidential report', core_xml)
+
+    marked = IdentifierInjector(source).inject_identifier(str(tmp_path / 'out'))
+    # Marking document again updates its property instead of adding another one.
+    marked = IdentifierInjector(marked).inject_identifier(str(tmp_path / 'again'))
+
+    with zipfile.ZipFile(marked) as zip_ref:
+        members = {name: zip_ref.read(name).decode('utf-8') for name in zip_ref.namelist()}
+
+    assert '<dc:identifier>DMS-2024-00042</dc:identifier>' in members[const.CORE]
+    assert members[const.CUSTOM].count(const.DOC_MINHASH_PROPERTY) == 1
+    assert members[const.CONTENT_TYPES].count(f'PartName="/{const.CUSTOM}"') == 1
+    assert members[const.PACKAGE_RELATIONSHIPS].count(f'Target="{const.CUSTOM}"') == 1
+    assert checker.parse_file_identifier(marked)[const.CONTENT_MINHASH] == read_identifier(marked).minhash
+    assert read_identifier(marked).minhash.startswith('128:')
@@ -0,0 +1,88 @@
+# Copyright 2022 aaaaaaaalesha
+
+import asyncio
+import json
+import os
+import socket
+import threading
+import time
+
+import pytest
+
+import src.metrics as metrics
+from src.identifier.service import CheckerService, ServiceClient, ServiceError
+
+
+@pytest.fixture
+def service(tmp_path):
+    socket_path = str(tmp_path / 'checker.sock')
+    checker_service = CheckerService(socket_path, jobs=3, index_path=str(tmp_path / 'index.db'),
+                                     cache_path=str(tmp_path / 'cache.db'))
+    thread = threading.Thread(target=asyncio.run, args=(checker_service.serve(),))
+    thread.start()
+    assert checker_service.wait_ready(timeout=30)
+
+    yield checker_service, socket_path
+
+    checker_service.stop()
+    thread.join(timeout=30)
+    assert not os.path.exists(socket_path)
+
+
+def test_service(service, tmp_path, source_document):
+    checker_service, socket_path = service
+    out_dir = str(tmp_path / 'out')
+
+    with ServiceClient(socket_path, timeout=30) as client:
+        assert client.call('ping')['index']
+
+        marked = client.call('inject', path=source_document, out_dir=out_dir)
+        assert not marked['cached']
+        assert client.call('inject', path=source_document, out_dir=out_dir)['cached']
+
+        table = client.call('compare', file1=marked['out_path'], file2=marked['out_path'],
+                            to_file=str(tmp_path / 'results.csv'))['table']
+        assert '100 %' in table
+        client.call('compare', file1=marked['out_path'], file2=marked['out_path'],
+                    to_file=str(tmp_path / 'results.csv'))
+
+        assert client.call('lookup', path=marked['out_path'], top_k=1) == [{'path': marked['out_path'], 'score': 100}]
+        assert client.call('excerpt', path=marked['out_path']) == [{'path': marked['out_path'], 'shared': 1,
+                                                                    'coverage': 1}]
+
+        with pytest.raises(ServiceError, match='no identifier'):
+            client.call('compare', file1=source_document, file2=marked['out_path'])
+        with pytest.raises(ServiceError, match='Invalid arguments of compare'):
+            client.call('compare', path=marked['out_path'])
+        with pytest.raises(ServiceError, match='Unknown operation'):
+            client.call('remove')
+
+    # Pipelined requests are handled concurrently, each response carries id of its request.
+    requests = [{'id': i, 'op': 'compare', 'args': {'file1': marked['out_path'], 'file2': marked['out_path']}}
+                for i in range(20)]
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(socket_path)
+        connection.sendall(b'not json\n' + b''.join(json.dumps(request).encode() + b'\n' for request in requests))
+        connection.shutdown(socket.SHUT_WR)
+        responses = [json.loads(line) for line in connection.makefile('rb')]
+
+    assert responses[0] == {'id': None, 'ok': False, 'error': 'Invalid request: Expecting value: line 1 column 1 '
+                                                              '(char 0)'}
+    assert sorted(response['id'] for response in responses[1:]) == list(range(20))
+    assert all(response['ok'] for response in responses[1:])
+
+    stats = checker_service.stats
+    assert (stats.queued, stats.in_flight, stats.handled, stats.failed) == (0, 0, 30, 3)
+
+    # Results file is kept open between requests, its rows are flushed periodically.
+    deadline = time.monotonic() + 10
+    while len((tmp_path / 'results.csv').read_text(encoding='utf-8').splitlines()) < 3:
+        assert time.monotonic() < deadline
+        time.sleep(0.1)
+
+    with ServiceClient(socket_path) as client:
+        summary = client.call('stats')['metrics']
+    assert summary['stages']['service.compare']['count'] == 24
+    assert summary['gauges'] == {'service_in_flight': 0, 'service_queue_depth': 0}
+    # Service doesn't turn on instrumentation of its embedder.
+    assert not metrics.enabled()
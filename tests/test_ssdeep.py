@@ -0,0 +1,92 @@
+# Copyright 2022 aaaaaaaalesha
+
+import os
+import random
+
+import pytest
+
+import src.ssdeep as ssdeep
+from src.ssdeep import _spamsum
+
+
+def test_spamsum_known_digests():
+    assert _spamsum.hash(b'') == '3::'
+    assert _spamsum.hash(b'hello world' * 100) == \
+        '6:rJPVPVPVPVPVPVPVPVPVPVPVPVPVPVPVPVPVPVPVPVPVPVPVPVPVPVPVPVPVPVPd:H'
+
+
+def test_spamsum_chunked_update():
+    data = os.urandom(200000)
+    state = _spamsum.SpamSum()
+    offset = 0
+    while offset < len(data):
+        size = random.randint(1, 10000)
+        state.update(data[offset:offset + size])
+        offset += size
+
+    assert state.digest() == _spamsum.hash(data)
+
+
+def test_spamsum_compare():
+    data = bytes(random.getrandbits(8) for _ in range(30000))
+    changed = data[:15000] + b'changed' + data[15000:]
+    signature = _spamsum.hash(data).encode('ascii')
+
+    assert _spamsum.compare(signature, signature) == 100
+    assert 0 < _spamsum.compare(signature, _spamsum.hash(changed).encode('ascii')) < 100
+    assert _spamsum.compare(b'3:abcdefgh:abc', b'96:abcdefgh:abc') == 0
+    assert _spamsum.compare(b'bad', signature) == -1
+
+
+def test_edit_distance():
+    assert _spamsum.edit_distance('', 'abc') == 3
+    assert _spamsum.edit_distance('kitten', 'sitting') == 5
+    assert _spamsum.edit_distance('abcdef', 'abcdef') == 0
+
+
+def test_backend_matches_libfuzzy():
+    try:
+        libfuzzy = ssdeep._load_backend('libfuzzy')
+    except OSError:
+        pytest.skip('libfuzzy is not available')
+
+    signatures = []
+    for n in (0, 100, 5000, 60000):
+        data = os.urandom(n)
+        assert _spamsum.hash(data) == libfuzzy.hash(data)
+        signatures.append(_spamsum.hash(data).encode('ascii'))
+
+    for signature_1 in signatures:
+        for signature_2 in signatures:
+            assert _spamsum.compare(signature_1, signature_2) == libfuzzy.compare(signature_1, signature_2)
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        ssdeep.set_backend('unknown')
+
+
+def test_compare_many_and_matrix():
+    base = bytes(random.getrandbits(8) for _ in range(20000))
+    signatures = [ssdeep.hash(base), ssdeep.hash(base[:10000] + b'changed' + base[10000:]), ssdeep.hash(base[:5000]),
+                  ssdeep.hash(os.urandom(20000)), '3::', '3:aaaaaaaaaaabcdefgh:abcdefgh', '3:aaabcdefgh:abcdefgh']
+    expected = [[ssdeep.compare(signature_1, signature_2) for signature_2 in signatures] for signature_1 in signatures]
+
+    assert [ssdeep.compare_many(signature, signatures).tolist() for signature in signatures] == expected
+    assert ssdeep.compare_matrix(signatures).tolist() == expected
+    assert ssdeep.compare_matrix(signatures[:2], signatures[::-1]).tolist() == [row[::-1] for row in expected[:2]]
+
+    with pytest.raises(ssdeep.FuzzyLibError):
+        ssdeep.compare_many(signatures[0], [signatures[0].split(':')[0] + ':abc'])
+
+
+def test_fuzzy_hasher():
+    pieces = [os.urandom(random.randint(0, 3 * ssdeep.FuzzyHasher.BUFFER_SIZE // 2)) for _ in range(20)]
+    hasher = ssdeep.FuzzyHasher()
+    for piece in pieces:
+        hasher.update(piece)
+
+    assert hasher.digest() == ssdeep.hash(b''.join(pieces))
+
+    hasher.update('текст')
+    assert hasher.digest() == ssdeep.hash(b''.join(pieces) + 'текст'.encode('utf-8'))
@@ -1,5 +1,6 @@
 # Copyright 2022 aaaaaaaalesha
 
+import hashlib
 import os
 
 import src.utils as utils
@@ -11,3 +12,13 @@ def test_base64_coding():
         assert test_str == utils.decode_base64_id(
             utils.encode_base64_id(test_str)
         )
+
+
+def test_file_digests(tmp_path):
+    data = os.urandom(utils.HASH_CHUNK_SIZE * 2 + 123)
+    path = tmp_path / 'data.bin'
+    path.write_bytes(data)
+
+    digests = utils.get_file_digests(str(path), ('sha3_256', 'sha256', 'blake2b'))
+    assert digests == {name: hashlib.new(name, data).hexdigest() for name in ('sha3_256', 'sha256', 'blake2b')}
+    assert utils.get_file_sha3(str(path)) == hashlib.sha3_256(data).hexdigest()
@@ -0,0 +1,76 @@
+# Copyright 2022 aaaaaaaalesha
+
+import shutil
+import threading
+
+import pytest
+
+from src.identifier.injector import is_injected
+from src.identifier.watch import DirectoryWatcher
+
+
+@pytest.mark.parametrize('use_inotify', [True, False])
+def test_directory_watcher(tmp_path, use_inotify, make_document):
+    watched, out = tmp_path / 'watched', tmp_path / 'out'
+    (watched / 'nested').mkdir(parents=True)
+    make_document(watched / 'existing.docx', 'existing report')
+
+    stop = threading.Event()
+    timer = threading.Timer(30, stop.set)
+    timer.start()
+
+    with DirectoryWatcher([str(watched)], str(out), recursive=True, debounce=0.2, poll_interval=0.2,
+                          use_inotify=use_inotify) as watcher:
+        results = watcher.results(stop)
+        first = next(results)
+        assert first.ok and first.path.endswith('existing.docx')
+        assert is_injected(first.out_path)
+
+        # Marked file is skipped, so the next result is about the new one.
+        shutil.copy(first.out_path, watched / 'marked.docx')
+        make_document(watched / 'nested' / 'new.docx', 'new report')
+        second = next(results)
+        assert second.ok and second.path.endswith('new.docx')
+
+        # Removed file is forgotten by the time of the next injection.
+        (watched / 'existing.docx').unlink()
+        make_document(watched / 'third.docx', 'third report')
+        third = next(results)
+        assert third.ok and third.path.endswith('third.docx')
+        assert first.path not in watcher._DirectoryWatcher__done
+
+        stop.set()
+        assert list(results) == []
+
+    timer.cancel()
+
+
+def test_directory_watcher_destinations(tmp_path, make_document):
+    watched, out, cache_path = tmp_path / 'watched', tmp_path / 'out', str(tmp_path / 'cache.sqlite')
+    for folder in ('a', 'b'):
+        (watched / folder).mkdir(parents=True)
+        make_document(watched / folder / 'report.docx', f'{folder} report')
+
+    stop = threading.Event()
+    timer = threading.Timer(30, stop.set)
+    timer.start()
+
+    with DirectoryWatcher([str(watched)], str(out), recursive=True, cache_path=cache_path, debounce=0.1,
+                          use_inotify=False) as watcher:
+        results = watcher.results(stop)
+        out_paths = sorted(next(results).out_path for _ in range(2))
+        assert out_paths == [str(out / 'a' / 'report.docx'), str(out / 'b' / 'report.docx')]
+        stop.set()
+        assert list(results) == []
+
+    # After restart files with unchanged cached entries aren't injected again.
+    stop.clear()
+    make_document(watched / 'a' / 'new.docx', 'new report')
+    with DirectoryWatcher([str(watched)], str(out), recursive=True, cache_path=cache_path, debounce=0.1,
+                          use_inotify=False) as watcher:
+        results = watcher.results(stop)
+        assert next(results).out_path == str(out / 'a' / 'new.docx')
+        stop.set()
+        assert list(results) == []
+
+    timer.cancel()
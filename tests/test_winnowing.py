@@ -0,0 +1,60 @@
+# Copyright 2022 aaaaaaaalesha
+
+import src.winnowing as winnowing
+from src.identifier import index as fingerprint_index
+from src.identifier.index import FingerprintIndex
+from src.identifier.injector import IdentifierInjector
+
+
+def test_winnower(monkeypatch, random_paragraphs):
+    text = '\n'.join(random_paragraphs(0, 100))
+    fingerprints = winnowing.text_fingerprints(text)
+    assert 0 < len(fingerprints) < len(text) / winnowing.WINDOW_SIZE * 4
+
+    # Fingerprints don't depend on how text is split into pieces and chunks.
+    monkeypatch.setattr(winnowing, '_CHUNK_SIZE', 1000)
+    winnower = winnowing.Winnower()
+    for i in range(0, len(text), 333):
+        winnower.update(text[i:i + 333])
+    assert winnower.fingerprints() == fingerprints
+
+    # Case, spacing and punctuation of excerpt don't matter.
+    excerpt = text[len(text) // 2:len(text) // 2 + 1000]
+    assert winnowing.text_fingerprints(f'<p>{excerpt.upper()}</p>'.replace(' ', ',\n '), markup=True) <= fingerprints
+
+    assert winnowing.text_fingerprints('too short') == set()
+    assert len(winnowing.text_fingerprints(text[:winnowing.GUARANTEED_SIZE // 4])) == 1
+
+
+def test_search_excerpt(tmp_path, monkeypatch, make_paragraphs_document, random_paragraphs):
+    documents = [make_paragraphs_document(tmp_path / f'{seed}.docx', random_paragraphs(seed)) for seed in range(4)]
+    injectors = [IdentifierInjector(path, with_fingerprints=True) for path in documents]
+    marked = [injector.inject_identifier(str(tmp_path / 'marked')) for injector in injectors]
+    # Fingerprints are selected in the same pass as hashes of content.
+    assert injectors[0].fingerprints == winnowing.file_fingerprints(marked[0])
+    assert IdentifierInjector(documents[0]).fingerprints is None
+
+    # Email quotes a few paragraphs from the middle of the third document.
+    email = tmp_path / 'email.txt'
+    quoted = '\n\n'.join(random_paragraphs(2)[120:126])
+    email.write_text(f'Hi, look what I found:\n\n{quoted}\n\nBye', encoding='utf-8')
+
+    with FingerprintIndex(str(tmp_path / 'index.db')) as index:
+        with monkeypatch.context() as patch:
+            # Content of documents isn't read again.
+            patch.setattr(fingerprint_index, 'file_fingerprints', None)
+            for path, injector in zip(marked, injectors):
+                index.add(path, injector.fingerprints)
+        # Re-added document replaces its fingerprints.
+        index.add(marked[2])
+
+        matches = index.search_excerpt(str(email), k=3)
+        assert [match.path for match in matches] == [marked[2]]
+        assert matches[0].coverage > 0.9
+        assert matches[0].fields['Filename'] == '2.docx'
+
+        assert index.search_excerpt(marked[1])[0].coverage == 1
+        assert index.search_excerpt(winnowing.text_fingerprints('\n'.join(random_paragraphs(9, 10)))) == []
+
+        index.remove(marked[2])
+        assert index.search_excerpt(str(email)) == []